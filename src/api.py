@@ -0,0 +1,297 @@
+import os
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+from aiohttp import web
+from .config import Config
+from . import retriever
+from . import resources
+from . import cache
+from . import tracing
+from . import warmup
+from . import llm_clients
+from . import catalog
+from .generator import agenerate_from_documents
+from .logger_setup import setup_logging
+
+logger = logging.getLogger("rag_chatbot_logger")
+
+# API keys used when a request doesn't carry its own
+DEFAULT_API_KEYS = {
+    "OpenAI": Config.OPENAI_API_KEY,
+    "Google": Config.GOOGLE_API_KEY,
+    "Anthropic": Config.ANTHROPIC_API_KEY,
+}
+
+
+class QueryBatcher:
+    """
+    Collects concurrent retrieval requests for up to Config.API_BATCH_WAIT_MS (or until
+    Config.API_MAX_BATCH_SIZE is reached) and serves them with one embedding forward pass
+    and one FAISS search call. The blocking work runs in a worker thread so the event loop
+    keeps accepting requests while a batch is processed.
+    """
+
+    def __init__(self, max_batch_size: int = None, max_wait_ms: float = None):
+        self.max_batch_size = max_batch_size or Config.API_MAX_BATCH_SIZE
+        self.max_wait = (max_wait_ms if max_wait_ms is not None else Config.API_BATCH_WAIT_MS) / 1000
+        self._queue = None
+        self._task = None
+        self.batches = 0
+        self.queries = 0
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def retrieve(self, query: str, k: int):
+        """Returns (docs, query_embedding, index_version) for a query, or None if nothing is ingested"""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((query, k, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                results = await loop.run_in_executor(None, self._process, batch)
+                for (_, _, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _process(self, batch):
+        index = resources.get_index()
+        if index is None:
+            return [None] * len(batch)
+
+        self.batches += 1
+        self.queries += len(batch)
+        index_version = index.version
+        queries = [query for query, _, _ in batch]
+        max_k = max(k for _, k, _ in batch)
+
+        with tracing.span("api.retrieve_batch", batch_size=len(batch)):
+            query_embeddings = retriever.embed_queries(queries)
+            results = retriever.search_batch(index, queries, query_embeddings, k=max_k)
+        return [
+            (docs[:k], embedding, index_version)
+            for (_, k, _), docs, embedding in zip(batch, results, query_embeddings)
+        ]
+
+
+def _error(status: int, message: str):
+    return web.json_response({"error": message}, status=status)
+
+
+async def handle_query(request: web.Request):
+    try:
+        body = await request.json()
+    except ValueError:
+        return _error(400, "Request body must be JSON")
+    if not isinstance(body, dict):
+        return _error(400, "Request body must be a JSON object")
+
+    query = body.get("query") or ""
+    model_name = body.get("model", "Local")
+    k = body.get("k", 4)
+    if not isinstance(query, str) or not query.strip():
+        return _error(400, "Missing 'query'")
+    query = query.strip()
+    if model_name not in llm_clients.PROVIDERS:
+        return _error(400, f"'model' must be one of {', '.join(llm_clients.PROVIDERS)}")
+    # bool is a subclass of int, but "k": true is a client bug
+    if not isinstance(k, int) or isinstance(k, bool) or not 1 <= k <= Config.API_MAX_K:
+        return _error(400, f"'k' must be an integer between 1 and {Config.API_MAX_K}")
+
+    api_key = body.get("api_key") or DEFAULT_API_KEYS.get(model_name)
+    if model_name != "Local" and not api_key:
+        return _error(400, f"No API key provided for {model_name}")
+
+    started = time.perf_counter()
+    retrieved = await request.app["batcher"].retrieve(query, k)
+    if retrieved is None:
+        return _error(409, "No documents have been ingested yet")
+    docs, query_embedding, index_version = retrieved
+
+    cached = False
+    answer = None
+    if Config.ANSWER_CACHE_ENABLED:
+        scope = cache.answer_scope(model_name, index_version, query)
+        answer = cache.answer_cache.lookup(scope, query_embedding)
+        cached = answer is not None
+
+    if answer is None:
+        # LLM calls run concurrently, bounded so a burst can't exhaust provider rate limits
+        async with request.app["llm_semaphore"]:
+            try:
+                answer = await agenerate_from_documents(model_name, query, docs, api_key)
+            except ValueError as e:
+                return _error(400, str(e))
+            except Exception as e:
+                logger.error(f"LLM call failed: {e}", exc_info=True)
+                return _error(502, f"An error occurred while generating the response: {str(e)}")
+        if Config.ANSWER_CACHE_ENABLED:
+            cache.answer_cache.store(scope, query, query_embedding, answer)
+
+    return web.json_response({
+        "answer": answer,
+        "cached": cached,
+        "sources": [{"source": doc.metadata.get("source"), "content": doc.page_content} for doc in docs],
+        "latency_ms": (time.perf_counter() - started) * 1000,
+    })
+
+
+async def handle_ingest(request: web.Request):
+    """Accepts a multipart upload of one or more files and ingests them, replacing documents with the same name"""
+    from .ingest import ingest_documents, last_ingest_stats
+
+    reader = await request.multipart()
+    temp_paths = []
+    og_names = []
+    try:
+        while True:
+            part = await reader.next()
+            if part is None:
+                break
+            if not part.filename:
+                continue
+            suffix = f".{part.filename.split('.')[-1]}"
+            with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
+                while chunk := await part.read_chunk():
+                    tmp_file.write(chunk)
+                temp_paths.append(tmp_file.name)
+                og_names.append(part.filename)
+
+        if not temp_paths:
+            return _error(400, "No files uploaded")
+
+        # Ingestion is CPU heavy and writes the index, so one runs at a time, off the event loop
+        async with request.app["ingest_lock"]:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, ingest_documents, temp_paths, og_names, logger)
+            chunks = last_ingest_stats["chunks"]
+        return web.json_response({"files": og_names, "chunks": chunks})
+    except Exception as e:
+        logger.error(f"Error ingesting documents: {e}", exc_info=True)
+        return _error(500, f"Error ingesting documents: {str(e)}")
+    finally:
+        for temp_path in temp_paths:
+            try:
+                os.unlink(temp_path)
+            except OSError as e:
+                logger.warning(f"Failed to delete temporary file {temp_path}: {e}")
+
+
+async def handle_delete(request: web.Request):
+    from .ingest import delete_document
+
+    file_name = request.match_info["file_name"]
+    async with request.app["ingest_lock"]:
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, delete_document, file_name, logger)
+        except ValueError as e:
+            return _error(404, str(e))
+    return web.json_response({"deleted": file_name})
+
+
+async def handle_documents(request: web.Request):
+    """Lists ingested documents a page at a time, ?q= filters by file name"""
+    try:
+        offset = max(0, int(request.query.get("offset", 0)))
+        limit = min(max(1, int(request.query.get("limit", Config.CATALOG_PAGE_SIZE))), Config.API_MAX_PAGE_SIZE)
+    except ValueError:
+        return _error(400, "'offset' and 'limit' must be integers")
+    search = request.query.get("q") or None
+    documents = await asyncio.get_running_loop().run_in_executor(None, catalog.get_catalog, logger)
+    return web.json_response({
+        "total": documents.count(search),
+        "offset": offset,
+        "limit": limit,
+        "documents": documents.list(offset=offset, limit=limit, search=search),
+    })
+
+
+async def handle_health(request: web.Request):
+    batcher = request.app["batcher"]
+    return web.json_response({
+        "status": "ok",
+        "index_loaded": resources.get_stats()["index_loaded"],
+        "batches": batcher.batches,
+        "queries": batcher.queries,
+        "mean_batch_size": batcher.queries / batcher.batches if batcher.batches else 0.0,
+        "llm": llm_clients.latency_stats(),
+        "llm_clients": llm_clients.pool_stats(),
+        "caches": cache.get_stats(),
+    })
+
+
+async def handle_metrics(request: web.Request):
+    text = tracing.registry.render_prometheus() + cache.render_prometheus()
+    return web.Response(text=text, content_type="text/plain")
+
+
+async def _on_startup(app: web.Application):
+    app["batcher"].start()
+    # Loading the model and the index up front keeps the first request fast
+    timings = await asyncio.get_running_loop().run_in_executor(None, warmup.warm_up)
+    logger.info(f"Warm-up finished in {timings['total']:.2f}s")
+
+
+async def _on_cleanup(app: web.Application):
+    await app["batcher"].stop()
+    llm_clients.clear()
+
+
+def create_app() -> web.Application:
+    app = web.Application(client_max_size=Config.API_MAX_UPLOAD_MB * 1024 * 1024)
+    app["batcher"] = QueryBatcher()
+    app["llm_semaphore"] = asyncio.Semaphore(Config.API_MAX_CONCURRENT_LLM_CALLS)
+    app["ingest_lock"] = asyncio.Lock()
+    app.router.add_post("/query", handle_query)
+    app.router.add_post("/ingest", handle_ingest)
+    app.router.add_get("/documents", handle_documents)
+    app.router.add_delete("/documents/{file_name}", handle_delete)
+    app.router.add_get("/health", handle_health)
+    app.router.add_get("/metrics", handle_metrics)
+    app.on_startup.append(_on_startup)
+    app.on_cleanup.append(_on_cleanup)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless query/ingest HTTP service")
+    parser.add_argument("--host", default=Config.API_HOST)
+    parser.add_argument("--port", type=int, default=Config.API_PORT)
+    args = parser.parse_args()
+
+    setup_logging(logging.INFO)
+    web.run_app(create_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import sys
+import json
+import time
+import logging
+import argparse
+from collections import deque
+from .config import Config
+from .retriever import iter_retrieve_batches
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+def read_queries(path: str, input_format: str = "auto"):
+    """
+    Yields {"query": ..., ...} records from a file: "text" is one query per line, "jsonl" one
+    JSON object with a "query" field per line (other fields are passed through to the output),
+    "qna" a test_data QnA file. "auto" picks by extension, with "-" reading text from stdin.
+    """
+    if input_format == "auto":
+        input_format = "jsonl" if path.endswith(".jsonl") else "qna" if "QnA" in path else "text"
+
+    if input_format == "qna":
+        from .benchmark import load_qna
+        for pair in load_qna(path):
+            yield {"query": pair["question"], "answer": pair["answer"]}
+        return
+
+    f = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    try:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            yield json.loads(line) if input_format == "jsonl" else {"query": line}
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def _result(doc, rank: int, include_content: bool) -> dict:
+    result = {
+        "rank": rank,
+        "source": doc.metadata.get("source"),
+        "language": doc.metadata.get("language"),
+        "page": doc.metadata.get("page"),
+        "start_index": doc.metadata.get("start_index"),
+    }
+    if include_content:
+        result["content"] = doc.page_content
+    return result
+
+
+def run(records, output, k: int = 4, mode: str = None, filters=None, batch_size: int = None,
+        include_content: bool = True) -> dict:
+    """Retrieves documents for every record and writes one JSON line per query as soon as its batch is done"""
+    records = iter(records)
+    pending = deque()
+
+    def queries():
+        # Records are kept until their result is written, in input order, so extra fields can be passed through
+        for record in records:
+            pending.append(record)
+            yield record["query"]
+
+    started = time.perf_counter()
+    count = 0
+    for query, docs in iter_retrieve_batches(queries(), k=k, mode=mode, filters=filters, batch_size=batch_size):
+        record = pending.popleft()
+        record["results"] = [_result(doc, rank, include_content) for rank, doc in enumerate(docs, start=1)]
+        output.write(json.dumps(record, ensure_ascii=False) + "\n")
+        count += 1
+    elapsed = time.perf_counter() - started
+    return {"queries": count, "seconds": elapsed, "queries_per_s": count / elapsed if elapsed else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrieve documents for many queries at once, writing JSONL")
+    parser.add_argument("input", help="Query file (one per line, .jsonl with a 'query' field, or a QnA file), '-' for stdin")
+    parser.add_argument("--format", choices=["auto", "text", "jsonl", "qna"], default="auto")
+    parser.add_argument("--output", help="JSONL output file, defaults to stdout")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--mode", choices=["dense", "lexical", "hybrid"], default=Config.RETRIEVAL_MODE)
+    parser.add_argument("--batch-size", type=int, default=Config.RETRIEVAL_BATCH_SIZE)
+    parser.add_argument("--source", action="append", help="Only return chunks of this file (repeatable)")
+    parser.add_argument("--language", action="append", help="Only return chunks in this language (repeatable)")
+    parser.add_argument("--no-content", action="store_true", help="Leave the chunk text out of the output")
+    args = parser.parse_args()
+
+    filters = {}
+    if args.source:
+        filters["source"] = set(args.source)
+    if args.language:
+        filters["language"] = set(args.language)
+
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        stats = run(
+            read_queries(args.input, args.format), output, k=args.k, mode=args.mode, filters=filters or None,
+            batch_size=args.batch_size, include_content=not args.no_content
+        )
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    sys.stderr.write(f"{stats['queries']} queries in {stats['seconds']:.2f}s ({stats['queries_per_s']:.1f} queries/s)\n")
+
+
+if __name__ == "__main__":
+    main()
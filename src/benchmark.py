@@ -0,0 +1,276 @@
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+from typing import List
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from .config import Config
+from . import resources
+from . import cache
+from .tokenizer import get_encoding
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+TEST_DATA_DIR = "test_data"
+
+# Every QnA file and the document its answers come from
+QNA_SOURCES = {
+    "HR_Policy_QnA_eng.txt": "hr_policy.pdf",
+    "HR_Policy_QnA_esp.txt": "hr_policy_esp.txt",
+    "HR_Policy_QnA_fr.txt": "hr_policy_fr.txt",
+    "HR_Policy_QnA_hindi.txt": "hr_policy_hindi.txt",
+    "indian_constitution_QnA.txt": "indian_constitution.txt",
+}
+
+# Question/answer prefixes used across the QnA files: "Q." / "Q1:" / "Q :" / "P:" / "प्र:" and "A." / "R:" / "उ:"
+_QUESTION_RE = re.compile(r"^(?:Q\d*|P|प्र)\s*[.:]\s*(.+)$")
+_ANSWER_RE = re.compile(r"^(?:A\d*|R|उ)\s*[.:]\s*(.+)$")
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Deterministic, offline stand-in for the embedding model. Character trigrams of each
+    word are hashed into a fixed number of dimensions and the vector is L2-normalized,
+    so lexically similar texts land close together without downloading any model.
+    """
+
+    def __init__(self, dimension: int = 384):
+        self.dimension = dimension
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for word in text.lower().split():
+            padded = f"#{word}#"
+            for i in range(max(1, len(padded) - 2)):
+                vector[zlib.crc32(padded[i:i + 3].encode("utf-8")) % self.dimension] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+def load_qna(path: str):
+    """Parses a QnA file into a list of {"question", "answer"} dicts"""
+    pairs = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            question_match = _QUESTION_RE.match(line)
+            if question_match:
+                question, _, rest = question_match.group(1).partition("\t")
+                pairs.append({"question": question.strip(), "answer": None})
+                # Some files keep the answer on the same line, after a tab
+                answer_match = _ANSWER_RE.match(rest.strip())
+                if answer_match:
+                    pairs[-1]["answer"] = answer_match.group(1).strip()
+                continue
+
+            answer_match = _ANSWER_RE.match(line)
+            if answer_match and pairs and pairs[-1]["answer"] is None:
+                pairs[-1]["answer"] = answer_match.group(1).strip()
+    return pairs
+
+
+def percentiles(samples: List[float]) -> dict:
+    values = np.array(samples) * 1000
+    return {
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "mean_ms": float(values.mean()),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _use_workspace(workspace: str):
+    """Points every on-disk artifact at a scratch directory so the benchmark never touches real data"""
+    Config.INDEX_ROOT = workspace
+    Config.EMBEDDING_CACHE_PATH = os.path.join(workspace, "embedding_cache")
+
+
+def bench_ingestion(data_dir: str, log: logging.Logger) -> dict:
+    from .ingest import ingest_documents, last_ingest_stats
+    file_names = sorted(os.listdir(data_dir))
+    ingest_documents([os.path.join(data_dir, name) for name in file_names], file_names, log)
+    return dict(last_ingest_stats)
+
+
+def bench_index_load(repeat: int) -> dict:
+    samples = []
+    for _ in range(repeat):
+        resources.invalidate()
+        started = time.perf_counter()
+        resources.get_vectorstore()
+        samples.append(time.perf_counter() - started)
+    return percentiles(samples)
+
+
+def bench_retrieval(qna_dir: str, k: int, repeat: int) -> dict:
+    from .retriever import retrieve_documents
+
+    latencies = []
+    hits = 0
+    reciprocal_ranks = []
+    per_file = {}
+    for qna_file, source in QNA_SOURCES.items():
+        pairs = load_qna(os.path.join(qna_dir, qna_file))
+        file_hits = 0
+        for pair in pairs:
+            for _ in range(repeat):
+                # Caches are emptied so every sample measures a full embed + search
+                cache.clear_all()
+                started = time.perf_counter()
+                docs = retrieve_documents(pair["question"], k=k)
+                latencies.append(time.perf_counter() - started)
+
+            sources = [doc.metadata.get("source") for doc in docs]
+            rank = sources.index(source) + 1 if source in sources else None
+            reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+            if rank:
+                hits += 1
+                file_hits += 1
+        per_file[qna_file] = {"questions": len(pairs), f"recall@{k}": file_hits / len(pairs) if pairs else 0.0}
+
+    questions = len(reciprocal_ranks)
+    return {
+        "questions": questions,
+        "latency": percentiles(latencies),
+        f"recall@{k}": hits / questions if questions else 0.0,
+        "mrr": float(np.mean(reciprocal_ranks)) if reciprocal_ranks else 0.0,
+        "per_file": per_file,
+    }
+
+
+def bench_batch_retrieval(qna_dir: str, k: int) -> dict:
+    """Throughput of retrieving every QnA question one by one versus in one batch, both with cold caches"""
+    from .retriever import retrieve_documents, retrieve_documents_batch
+    questions = [pair["question"] for qna_file in QNA_SOURCES for pair in load_qna(os.path.join(qna_dir, qna_file))]
+
+    cache.clear_all()
+    started = time.perf_counter()
+    for question in questions:
+        retrieve_documents(question, k=k)
+    loop_seconds = time.perf_counter() - started
+
+    cache.clear_all()
+    started = time.perf_counter()
+    retrieve_documents_batch(questions, k=k)
+    batch_seconds = time.perf_counter() - started
+    return {
+        "questions": len(questions),
+        "loop_queries_per_s": len(questions) / loop_seconds if loop_seconds else 0.0,
+        "batch_queries_per_s": len(questions) / batch_seconds if batch_seconds else 0.0,
+        "speedup": loop_seconds / batch_seconds if batch_seconds else 0.0,
+    }
+
+
+def bench_generation(qna_dir: str, repeat: int) -> dict:
+    """End-to-end generate_response latency with a deterministic fake LLM in place of a provider"""
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+    from .generator import generate_response
+    llm = FakeListChatModel(responses=["This is a canned answer from the fake model."])
+    latencies = []
+    for qna_file in QNA_SOURCES:
+        for pair in load_qna(os.path.join(qna_dir, qna_file)):
+            for _ in range(repeat):
+                cache.clear_all()
+                started = time.perf_counter()
+                generate_response("Fake", pair["question"], llm=llm)
+                latencies.append(time.perf_counter() - started)
+    return {"latency": percentiles(latencies)}
+
+
+def run(embeddings: str = "hash", k: int = 4, repeat: int = 3, test_data_dir: str = TEST_DATA_DIR) -> dict:
+    """Runs the whole suite in a scratch workspace and returns the results as a dict"""
+    log = logging.getLogger("rag_benchmark")
+    log.addHandler(logging.NullHandler())
+    data_dir = os.path.abspath(os.path.join(test_data_dir, "data"))
+    qna_dir = os.path.abspath(os.path.join(test_data_dir, "QnA_files"))
+
+    if embeddings == "hash":
+        resources.set_embeddings(HashingEmbeddings())
+    else:
+        # Only a model that is already in the local Hugging Face cache is used
+        os.environ["HF_HUB_OFFLINE"] = "1"
+        os.environ["TRANSFORMERS_OFFLINE"] = "1"
+
+    workspace = tempfile.mkdtemp(prefix="rag_benchmark_")
+    try:
+        _use_workspace(workspace)
+        resources.invalidate()
+        cache.clear_all()
+
+        results = {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "embeddings": embeddings if embeddings == "hash" else f"{Config.EMBEDDING_MODEL} ({Config.EMBEDDING_BACKEND})",
+            "config": {
+                "k": k,
+                "repeat": repeat,
+                "index_type": Config.INDEX_TYPE,
+                "index_format": Config.INDEX_FORMAT,
+                "retrieval_mode": Config.RETRIEVAL_MODE,
+                "language_sharding": Config.LANGUAGE_SHARDING,
+                "shard_routing": Config.SHARD_ROUTING,
+                "ingest_workers": Config.INGEST_WORKERS,
+                "embedding_batch_size": Config.EMBEDDING_BATCH_SIZE,
+                # "approximate" when the tiktoken encoding isn't available offline
+                "tokenizer": get_encoding().name,
+            },
+        }
+        results["ingestion"] = bench_ingestion(data_dir, log)
+        results["index_load"] = bench_index_load(repeat)
+        results["retrieval"] = bench_retrieval(qna_dir, k, repeat)
+        results["batch_retrieval"] = bench_batch_retrieval(qna_dir, k)
+        results["generation"] = bench_generation(qna_dir, repeat)
+        return results
+    finally:
+        resources.invalidate()
+        shutil.rmtree(workspace, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline ingestion and retrieval benchmark on test_data")
+    parser.add_argument("--embeddings", choices=["hash", "local"], default="hash",
+                        help="hash: deterministic stand-in, local: the configured model from the local HF cache")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3, help="Timed samples per question")
+    parser.add_argument("--test-data", default=TEST_DATA_DIR)
+    parser.add_argument("--output", help="Write the JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    results = run(args.embeddings, args.k, args.repeat, args.test_data)
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        sys.stdout.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
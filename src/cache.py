@@ -0,0 +1,173 @@
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+from .config import Config
+from .language import detect_language
+
+
+class LRUCache:
+    """
+    A small thread-safe LRU cache with an optional time-to-live per entry.
+    Keeps hit/miss/eviction counters so the hit rate can be reported.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float = None):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _expired(self, stored_at: float) -> bool:
+        return self.ttl_seconds is not None and time.monotonic() - stored_at > self.ttl_seconds
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or self._expired(entry[0]):
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def filters_key(filters):
+    """Hashable form of metadata filters such as {"language": ["fr"]}, None without filters"""
+    return tuple(sorted((field, tuple(sorted(values))) for field, values in filters.items())) if filters else None
+
+
+def answer_scope(model_name: str, index_version: str, query: str, filters=None):
+    """
+    What an answer depends on besides the question's meaning: the LLM model, the index
+    version, the language the answer is written in (the query's) and the metadata filters
+    the context was retrieved with. Multilingual embeddings put a question and its
+    translation close together, so without the language a cached answer could come back
+    in the wrong language.
+    """
+    return model_name, index_version, detect_language(query)[0], filters_key(filters)
+
+
+class SemanticAnswerCache:
+    """
+    Caches generated answers and returns one when a new query embedding is within a
+    cosine similarity threshold of a previously answered query with the same scope (see
+    answer_scope), so answers go stale once new data is ingested.
+    Query embeddings are expected to be L2-normalized, so cosine similarity is a dot product.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float = None, threshold: float = 0.95):
+        self.threshold = threshold
+        self._entries = LRUCache(max_size, ttl_seconds)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, scope: tuple, query_embedding):
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        with self._lock:
+            best_key, best_score = None, -1.0
+            for key, (stored_at, (vector, _)) in list(self._entries._data.items()):
+                if key[0] != scope:
+                    continue
+                if self._entries._expired(stored_at):
+                    continue
+                score = float(np.dot(vector, query_vector))
+                if score > best_score:
+                    best_key, best_score = key, score
+
+            if best_key is not None and best_score >= self.threshold:
+                self.hits += 1
+                return self._entries.get(best_key)[1]
+            self.misses += 1
+            return None
+
+    def store(self, scope: tuple, query: str, query_embedding, answer: str):
+        vector = np.asarray(query_embedding, dtype=np.float32)
+        with self._lock:
+            self._entries.put((scope, query), (vector, answer))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self._entries.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+# Tier 1: exact-match query embeddings (keyed on embedding model) and retrieval results (keyed on index version)
+embedding_cache = LRUCache(Config.QUERY_CACHE_SIZE, Config.QUERY_CACHE_TTL_SECONDS)
+retrieval_cache = LRUCache(Config.QUERY_CACHE_SIZE, Config.QUERY_CACHE_TTL_SECONDS)
+
+# Tier 2: semantic answer cache (keyed on LLM model, index version, answer language and filters)
+answer_cache = SemanticAnswerCache(
+    Config.ANSWER_CACHE_SIZE,
+    Config.ANSWER_CACHE_TTL_SECONDS,
+    Config.SEMANTIC_CACHE_THRESHOLD
+)
+
+
+def clear_all():
+    """Empties every cache tier"""
+    embedding_cache.clear()
+    retrieval_cache.clear()
+    answer_cache.clear()
+
+
+def get_stats() -> dict:
+    """Returns size and hit rate for every cache tier"""
+    return {
+        "query_embeddings": embedding_cache.stats(),
+        "retrieval": retrieval_cache.stats(),
+        "answers": answer_cache.stats(),
+    }
+
+
+def render_prometheus() -> str:
+    """Renders the size and counters of every cache tier in the Prometheus text exposition format"""
+    stats = get_stats()
+    lines = []
+    for field, kind in (("size", "gauge"), ("hits", "counter"), ("misses", "counter"), ("evictions", "counter")):
+        name = "rag_cache_entries" if field == "size" else f"rag_cache_{field}_total"
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(f'{name}{{tier="{tier}"}} {tier_stats[field]}' for tier, tier_stats in stats.items())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,210 @@
+import os
+import json
+import hashlib
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from typing import List
+from .config import Config
+from . import snapshots
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+COLUMNS = ("doc_id", "file_name", "content_hash", "language", "word_count", "chunk_count", "ingested_at",
+           "index_version")
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS documents ("
+    "doc_id TEXT PRIMARY KEY, file_name TEXT NOT NULL, content_hash TEXT, language TEXT, "
+    "word_count INTEGER, chunk_count INTEGER, ingested_at REAL, index_version TEXT)",
+    "CREATE INDEX IF NOT EXISTS documents_content_hash ON documents (content_hash)",
+    "CREATE INDEX IF NOT EXISTS documents_file_name ON documents (file_name COLLATE NOCASE)",
+)
+
+_readers = {}  # version -> DocumentCatalog, only the current version's is kept
+_readers_lock = threading.Lock()
+
+
+def document_id(file_name: str) -> str:
+    """Stable id of a document, derived from its file name so a re-upload replaces the same document"""
+    return hashlib.sha1(file_name.encode("utf-8")).hexdigest()[:16]
+
+
+def _escape_like(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+class DocumentCatalog:
+    """
+    The documents of one index version in a SQLite table, indexed by content hash and file
+    name, so listing a page, searching by name and duplicate checks don't read every entry.
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()  # Shared by the Streamlit script threads
+
+    def _query(self, sql: str, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _where(self, search: str = None):
+        if not search:
+            return "", ()
+        return " WHERE file_name LIKE ? ESCAPE '\\'", (f"%{_escape_like(search)}%",)
+
+    def count(self, search: str = None) -> int:
+        where, params = self._where(search)
+        return self._query(f"SELECT COUNT(*) FROM documents{where}", params)[0][0]
+
+    def list(self, offset: int = 0, limit: int = None, search: str = None) -> List[dict]:
+        """A page of documents ordered by file name, only those whose name contains `search` if given"""
+        where, params = self._where(search)
+        rows = self._query(
+            f"SELECT * FROM documents{where} ORDER BY file_name COLLATE NOCASE LIMIT ? OFFSET ?",
+            params + (-1 if limit is None else limit, offset)
+        )
+        return [dict(row) for row in rows]
+
+    def get(self, file_name: str):
+        rows = self._query("SELECT * FROM documents WHERE doc_id = ?", (document_id(file_name),))
+        return dict(rows[0]) if rows else None
+
+    def find_by_hash(self, content_hash: str) -> List[str]:
+        """Names of the documents with this content"""
+        rows = self._query("SELECT file_name FROM documents WHERE content_hash = ?", (content_hash,))
+        return [row[0] for row in rows]
+
+    def is_ingested(self, file_name: str, content_hash: str) -> bool:
+        """Whether this exact file (same name and content) is already in the index"""
+        rows = self._query(
+            "SELECT 1 FROM documents WHERE doc_id = ? AND content_hash = ?", (document_id(file_name), content_hash)
+        )
+        return bool(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CatalogWriter(DocumentCatalog):
+    """The catalog of a snapshot version being written, changes are committed on close()"""
+
+    def upsert(self, documents: List[dict], index_version: str, ingested_at: float = None):
+        """Adds documents or replaces those with the same id, stamped with their ingest time and index version"""
+        rows = [
+            (doc.get("doc_id") or document_id(doc["file_name"]), doc["file_name"], doc.get("content_hash"),
+             doc.get("language"), doc.get("word_count"), doc.get("chunk_count"), ingested_at, index_version)
+            for doc in documents
+        ]
+        with self._lock:
+            self._conn.executemany(f"INSERT OR REPLACE INTO documents VALUES ({','.join('?' * len(COLUMNS))})", rows)
+
+    def remove(self, doc_ids: List[str]):
+        with self._lock:
+            self._conn.executemany("DELETE FROM documents WHERE doc_id = ?", [(doc_id,) for doc_id in doc_ids])
+
+    def close(self):
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            with self._lock:
+                self._conn.close()
+
+
+def _create(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False)
+    for statement in _SCHEMA:
+        conn.execute(statement)
+    return conn
+
+
+def _read_only(path: str) -> sqlite3.Connection:
+    # Published versions are never modified, so SQLite can skip locking and change detection
+    return sqlite3.connect(f"{Path(path).resolve().as_uri()}?mode=ro&immutable=1", uri=True, check_same_thread=False)
+
+
+def _import_json(writer: CatalogWriter, json_path: str, version: str, log: logging.Logger):
+    """Copies the entries of a documents.json written before the catalog existed"""
+    with open(json_path, "r") as f:
+        documents = json.load(f)
+    # The ingest time wasn't recorded, the entries get the version they were found in
+    writer.upsert(documents, version)
+    log.info(f"Migrated {len(documents)} documents from {json_path} into the document catalog")
+
+
+def open_for_writing(snapshot, log: logging.Logger = logger) -> CatalogWriter:
+    """
+    Starts the catalog of a new snapshot version from the one of its base version: copied
+    (the base must not be modified, readers may still use it), migrated from the base's
+    documents.json, or empty.
+    """
+    path = snapshot.path(Config.CATALOG_PATH)
+    writer = CatalogWriter(_create(path))
+    base_path = snapshot.base_path(Config.CATALOG_PATH)
+    if base_path is not None and os.path.exists(base_path):
+        source = _read_only(base_path)
+        try:
+            with writer._lock:
+                source.backup(writer._conn)
+        finally:
+            source.close()
+    else:
+        json_path = snapshot.base_path(Config.DOCUMENTS_JSON_PATH)
+        if json_path is not None and os.path.exists(json_path):
+            _import_json(writer, json_path, snapshot.base, log)
+    return writer
+
+
+def _needs_migration(version: str) -> bool:
+    return not os.path.exists(snapshots.path(Config.CATALOG_PATH, version)) and \
+        os.path.exists(snapshots.path(Config.DOCUMENTS_JSON_PATH, version))
+
+
+def _migrate_current(log: logging.Logger):
+    """Index written before the catalog existed: publishes it again with its documents.json turned into a catalog"""
+    with snapshots.writer(log) as snapshot:
+        if snapshot.base is None or not _needs_migration(snapshot.base):
+            # Another writer migrated it while this one waited for the lock
+            snapshot.discard()
+            return
+        for name in snapshots.index_names():
+            if name not in (Config.DOCUMENTS_JSON_PATH, Config.CATALOG_PATH):
+                snapshot.inherit(name)
+        open_for_writing(snapshot, log).close()
+
+
+def get_catalog(log: logging.Logger = logger) -> DocumentCatalog:
+    """
+    Returns the catalog of the current index version, opened once per version. Before the
+    first ingest it is an empty in-memory catalog.
+    """
+    version = snapshots.current()
+    if version is not None and _needs_migration(version):
+        _migrate_current(log)
+        version = snapshots.current()
+
+    with _readers_lock:
+        reader = _readers.get(version)
+        if reader is not None:
+            return reader
+        path = snapshots.path(Config.CATALOG_PATH, version) if version is not None else None
+        if path is not None and os.path.exists(path):
+            reader = DocumentCatalog(_read_only(path))
+        else:
+            # Nothing ingested yet, or an empty version published by "Clear Data"
+            reader = DocumentCatalog(_create(":memory:"))
+        # Catalogs of replaced versions are dropped, not closed, a request may still be using one
+        _readers.clear()
+        _readers[version] = reader
+        return reader
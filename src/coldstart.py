@@ -0,0 +1,113 @@
+import sys
+import json
+import math
+import argparse
+import subprocess
+from .config import Config
+
+# Entry points first, then the heavy dependencies that are now imported lazily
+MODULES = (
+    "src.interface",
+    "src.api",
+    "src.generator",
+    "src.retriever",
+    "src.ingest",
+    "langchain_openai",
+    "langchain_google_genai",
+    "langchain_anthropic",
+    "langchain_community.chat_models",
+    "langchain_huggingface",
+    "langchain.document_loaders",
+    "langdetect",
+    "tiktoken",
+)
+
+
+def _parse_importtime(stderr: str):
+    """Parses `python -X importtime` output into (module, self_us, cumulative_us) rows"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        try:
+            self_us, cumulative_us, module = line[len("import time:"):].split("|")
+            rows.append((module.strip(), int(self_us), int(cumulative_us)))
+        except ValueError:
+            continue
+    return rows
+
+
+def import_time(module: str, top: int = 5) -> dict:
+    """Imports a module in a fresh interpreter and returns its cumulative import time and its slowest dependencies"""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True
+    )
+    rows = _parse_importtime(completed.stderr)
+    if completed.returncode != 0:
+        error = completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "import failed"
+        return {"module": module, "error": error}
+
+    cumulative = next((cumulative_us for name, _, cumulative_us in rows if name == module), None)
+    slowest = sorted(rows, key=lambda row: row[1], reverse=True)[:top]
+    return {
+        "module": module,
+        "seconds": cumulative / 1e6 if cumulative is not None else None,
+        "slowest": [{"module": name, "self_seconds": self_us / 1e6} for name, self_us, _ in slowest],
+    }
+
+
+def warmup_time() -> dict:
+    """Runs warmup.warm_up() in a fresh interpreter, so nothing is already loaded"""
+    completed = subprocess.run(
+        [sys.executable, "-m", "src.coldstart", "warmup"], capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        error = completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "warm-up failed"
+        return {"error": error}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def report(modules=MODULES, include_warmup: bool = True) -> dict:
+    """
+    Builds the cold-start report. `ui_ready_seconds` is what the Streamlit script needs before
+    it renders (the warm-up runs behind it), `api_ready_seconds` is what the HTTP service needs
+    before it accepts requests. The suggested health-check start period covers the slower one
+    with 50% headroom.
+    """
+    imports = [import_time(module) for module in modules]
+    seconds = {entry["module"]: entry.get("seconds") or 0.0 for entry in imports}
+    results = {"imports": imports}
+
+    results["ui_ready_seconds"] = seconds.get("src.interface", 0.0)
+    results["api_ready_seconds"] = seconds.get("src.api", 0.0)
+    if include_warmup:
+        results["warmup"] = warmup_time()
+        results["api_ready_seconds"] += results["warmup"].get("total", 0.0)
+    slowest_start = max(results["ui_ready_seconds"], results["api_ready_seconds"])
+    results["suggested_start_period_seconds"] = max(5, math.ceil(slowest_start * 1.5))
+    results["warmup_on_startup"] = Config.WARMUP_ON_STARTUP
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time and cold-start report")
+    parser.add_argument("command", nargs="?", choices=["report", "warmup"], default="report")
+    parser.add_argument("--no-warmup", action="store_true", help="Only measure import times")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    if args.command == "warmup":
+        from .warmup import warm_up
+        print(json.dumps(warm_up()))
+        return
+
+    output = json.dumps(report(include_warmup=not args.no_warmup), indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        sys.stdout.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,15 +3,145 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+
+def _env_number(name: str, default, cast=float, minimum=0):
+    """Reads a numeric setting, failing at startup with the variable's name instead of deep inside a client"""
+    value = os.getenv(name)
+    try:
+        number = cast(value) if value is not None else default
+    except ValueError:
+        raise ValueError(f"{name} must be a number, got {value!r}") from None
+    if number < minimum:
+        raise ValueError(f"{name} must be at least {minimum}, got {number}")
+    return number
+
 class Config:
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
     GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
     ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
     OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434") # For Local Ollama
-    FAISS_INDEX_PATH = "embeddings/faiss_index"
-    DOCUMENTS_JSON_PATH = "embeddings/documents.json"
+    # Alternative endpoints for the cloud providers, e.g. a proxy or the stub server (python -m src.llm_stub)
+    OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")
+    ANTHROPIC_BASE_URL = os.getenv("ANTHROPIC_BASE_URL")
+    GOOGLE_API_ENDPOINT = os.getenv("GOOGLE_API_ENDPOINT")
+    # Index snapshots (see snapshots.py): every change writes a new version under INDEX_ROOT/versions and then
+    # switches the INDEX_ROOT/CURRENT pointer to it. The index paths below are relative to a version directory
+    INDEX_ROOT = "embeddings"
+    FAISS_INDEX_PATH = "faiss_index"
+    DOCUMENTS_JSON_PATH = "documents.json"  # Document list of indexes written before the catalog, migrated on first use
+    CATALOG_PATH = "catalog.sqlite"  # Document catalog (see catalog.py)
+    CATALOG_PAGE_SIZE = 20  # Documents listed per page in the sidebar
+    SNAPSHOT_KEEP_VERSIONS = 2  # Previous versions kept besides the current one
+    SNAPSHOT_GC_GRACE_SECONDS = 300  # Replaced versions are kept at least this long for in-flight readers
     EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2" # Multilingual Embedding Model
 
     EMBEDDING_DEVICE = "cpu"  # Force CPU usage to avoid meta tensor issues
     EMBEDDING_MODEL_KWARGS = {'device': 'cpu'}
     EMBEDDING_ENCODE_KWARGS = {'normalize_embeddings': True}
+    # Embedding backend (see embedding_backends.py): "hf" (reference), "int8" (dynamically quantized) or "onnx"
+    EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "hf")
+    EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", 0))  # Inference threads, 0 keeps the library default
+
+    # Query caching (see cache.py); caches are keyed on the index version so they go stale after ingestion
+    QUERY_CACHE_SIZE = 1024
+    QUERY_CACHE_TTL_SECONDS = 3600
+    ANSWER_CACHE_ENABLED = True
+    ANSWER_CACHE_SIZE = 512
+    ANSWER_CACHE_TTL_SECONDS = 3600
+    SEMANTIC_CACHE_THRESHOLD = 0.95  # Minimum cosine similarity to reuse a previous answer
+
+    # Ingestion pipeline: files are parsed in a process pool and embedded in batches
+    INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", os.cpu_count() or 1))
+    EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 64))
+
+    # Streaming ingestion for very large files: pages/text blocks are split, embedded and indexed in windows
+    INGEST_MODE = os.getenv("INGEST_MODE", "auto")  # "batch", "streaming" or "auto" (streaming from STREAMING_INGEST_MIN_MB on)
+    STREAMING_INGEST_MIN_MB = 50
+    INGEST_WINDOW_CHUNKS = 512  # Chunks embedded and added to the index together
+    INGEST_MEMORY_CEILING_MB = int(os.getenv("INGEST_MEMORY_CEILING_MB", 0))  # Flush windows early above this RSS, 0 disables
+    TEXT_BLOCK_CHARS = 1_000_000  # Characters read at a time from .txt/.md files
+
+    # Persistent chunk embedding cache (see embedding_store.py), kept across "Clear Data" so re-ingests are cheap
+    EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+    EMBEDDING_CACHE_PATH = "embeddings/embedding_cache"
+    EMBEDDING_CACHE_MAX_ENTRIES = 500_000  # ~770 MB of float32 vectors at 384 dimensions
+
+    # Vector index type: "flat" (exact), "ivf_flat", "hnsw", "ivf_pq" or "auto"
+    # "auto" uses the flat index for small corpora and AUTO_ANN_INDEX_TYPE from ANN_THRESHOLD vectors on
+    INDEX_TYPE = os.getenv("INDEX_TYPE", "auto")
+    AUTO_ANN_INDEX_TYPE = "hnsw"
+    ANN_THRESHOLD = 100_000
+    IVF_NLIST = None  # None picks ~4*sqrt(n) lists at training time, never more than there are training vectors
+    IVF_NPROBE = 16  # Lists visited per query, higher is more accurate and slower
+    HNSW_M = 32
+    HNSW_EF_CONSTRUCTION = 200
+    HNSW_EF_SEARCH = 64  # Candidate list size per query, higher is more accurate and slower
+    PQ_M = 16  # Sub-quantizers, must divide the embedding dimension (384)
+    PQ_NBITS = 8  # Lowered when there are fewer than 2**PQ_NBITS training vectors
+
+    # On-disk index format used for queries: "pickle" (FAISS.save_local) or "mmap"
+    # "mmap" memory-maps the vectors and keeps chunks in SQLite, fetched lazily for the top-k hits only
+    INDEX_FORMAT = os.getenv("INDEX_FORMAT", "pickle")
+    MMAP_INDEX_PATH = "faiss_mmap"
+
+    # Retrieval mode: "dense" (FAISS only), "lexical" (BM25 only) or "hybrid" (both, fused with RRF)
+    RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+    BM25_INDEX_PATH = "bm25_index.json"
+    HYBRID_FETCH_K = 20  # Candidates taken from each retriever before fusion
+    RRF_K = 60
+
+    # Tracing and metrics (see tracing.py)
+    TRACE_JSON_LOGS = os.getenv("TRACE_JSON_LOGS", "true").lower() == "true"  # One JSON line per span in logs/traces.jsonl
+    METRICS_FILE_PATH = os.getenv("METRICS_FILE_PATH", "logs/metrics.prom")  # Prometheus text file, empty to disable
+    METRICS_EXPORT_INTERVAL_SECONDS = 15
+    METRICS_PORT = int(os.getenv("METRICS_PORT", 0))  # Serves /metrics on this port when set
+
+    # Headless HTTP service (python -m src.api)
+    API_HOST = os.getenv("API_HOST", "0.0.0.0")
+    API_PORT = int(os.getenv("API_PORT", 8000))
+    API_MAX_BATCH_SIZE = 32  # Queries embedded and searched together
+    API_BATCH_WAIT_MS = 5  # How long the first query of a batch waits for others
+    API_MAX_CONCURRENT_LLM_CALLS = int(os.getenv("API_MAX_CONCURRENT_LLM_CALLS", 8))
+    API_MAX_UPLOAD_MB = 200
+    API_MAX_K = 50  # Largest number of chunks a /query request may ask for
+    API_MAX_PAGE_SIZE = 100  # Largest page of documents a /documents request may ask for
+
+    # Index compaction: rebuild once this fraction of the live chunks has been deleted since the last compaction
+    COMPACTION_DELETED_RATIO = 0.2
+
+    # Prompt context packing (see context.py): token budget for the retrieved context per model
+    CONTEXT_TOKEN_BUDGETS = {
+        "OpenAI": 3000,
+        "Google": 6000,
+        "Anthropic": 6000,
+        "Local": 2000,
+        "default": 3000,
+    }
+    CONTEXT_DEDUP_THRESHOLD = 0.8  # Word 3-gram Jaccard similarity above which a chunk counts as a duplicate
+
+    # Language sharding (see shards.py): one index per chunk language, derived from the main index after every change
+    LANGUAGE_SHARDING = os.getenv("LANGUAGE_SHARDING", "false").lower() == "true"
+    SHARD_INDEX_PATH = "shards"
+    SHARD_ROUTING = os.getenv("SHARD_ROUTING", "route")  # "route": only the query language's shard when detected confidently, "fanout": every shard
+    SHARD_ROUTING_MIN_CONFIDENCE = 0.9
+    SHARD_SEARCH_WORKERS = 4  # Shards searched in parallel on fan-out
+
+    # Chunk language tagging (see language.py)
+    LANGDETECT_BATCH_SIZE = 8  # Consecutive chunks detected with a single langdetect call
+    LANGDETECT_BATCH_CONFIDENCE = 0.99  # Below this a batch counts as mixed and its chunks are detected one by one
+    LANGDETECT_MIN_CHARS = 40  # Shorter chunks take the language of their batch
+
+    # Startup: load the embedding model and the index in a background thread while the UI renders
+    WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() == "true"
+
+    # Batch retrieval (retriever.iter_retrieve_batches, python -m src.batch_retrieval)
+    RETRIEVAL_BATCH_SIZE = 256  # Queries embedded and searched together
+    FILTER_FETCH_MULTIPLIER = 5  # With metadata filters, k * this many candidates are searched before filtering
+
+    # LLM clients (see llm_clients.py): pooled per provider, model and API key
+    LLM_CLIENT_POOL_SIZE = 32
+    LLM_TIMEOUT_SECONDS = _env_number("LLM_TIMEOUT_SECONDS", 60.0, minimum=0.001)  # Per request attempt
+    LLM_MAX_RETRIES = _env_number("LLM_MAX_RETRIES", 2, cast=int)  # Retries after the first attempt, with exponential backoff and jitter
+    LLM_RETRY_MAX_WAIT_SECONDS = 10
+    LLM_FALLBACK_TO_LOCAL = os.getenv("LLM_FALLBACK_TO_LOCAL", "false").lower() == "true"  # Answer with Ollama when a cloud provider fails
+    LLM_LATENCY_WINDOW = 1000  # Recent calls per provider kept for the latency percentiles
@@ -0,0 +1,108 @@
+import re
+from typing import List
+from langchain.schema import Document
+from .config import Config
+from .tokenizer import count_tokens
+
+_WORD_RE = re.compile(r"\w+")
+
+# Overlap between neighbouring chunks is at most the splitter's chunk_overlap (50 chars),
+# shorter matches are ignored so unrelated chunks are never glued together by accident
+MIN_TEXT_OVERLAP = 20
+MAX_TEXT_OVERLAP = 200
+
+
+def _shingles(text: str, size: int = 3) -> set:
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def _jaccard(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def deduplicate(docs: List[Document], threshold: float = None) -> List[Document]:
+    """Drops chunks whose word 3-gram Jaccard similarity to a higher-ranked chunk reaches the threshold"""
+    threshold = threshold if threshold is not None else Config.CONTEXT_DEDUP_THRESHOLD
+    kept, kept_shingles = [], []
+    for doc in docs:
+        shingles = _shingles(doc.page_content)
+        if any(_jaccard(shingles, other) >= threshold for other in kept_shingles):
+            continue
+        kept.append(doc)
+        kept_shingles.append(shingles)
+    return kept
+
+
+def _same_origin(a: Document, b: Document) -> bool:
+    return (a.metadata.get("source") == b.metadata.get("source")
+            and a.metadata.get("page") == b.metadata.get("page"))
+
+
+def _join(first: Document, second: Document):
+    """Joins two chunks if `second` continues `first`, returning the combined text or None"""
+    first_start = first.metadata.get("start_index")
+    second_start = second.metadata.get("start_index")
+    if first_start is not None and second_start is not None:
+        first_end = first_start + len(first.page_content)
+        if first_start <= second_start <= first_end:
+            return first.page_content + second.page_content[first_end - second_start:]
+        return None
+
+    # Chunks ingested without start_index: look for a suffix of `first` that starts `second`
+    a, b = first.page_content, second.page_content
+    for size in range(min(len(a), len(b), MAX_TEXT_OVERLAP), MIN_TEXT_OVERLAP - 1, -1):
+        if a.endswith(b[:size]):
+            return a + b[size:]
+    return None
+
+
+def merge_adjacent(docs: List[Document]) -> List[Document]:
+    """
+    Merges chunks from the same source (and page) that overlap, so the shared overlap is sent
+    only once. The merged chunk keeps the position of its best-ranked part. The input documents
+    are never modified, since they may be shared with the retrieval cache.
+    """
+    merged = []
+    for doc in docs:
+        for i, current in enumerate(merged):
+            if not _same_origin(current, doc):
+                continue
+            combined, start = _join(current, doc), current.metadata.get("start_index")
+            if combined is None:
+                combined, start = _join(doc, current), doc.metadata.get("start_index")
+            if combined is not None:
+                metadata = dict(current.metadata)
+                if start is not None:
+                    metadata["start_index"] = start
+                merged[i] = Document(page_content=combined, metadata=metadata)
+                break
+        else:
+            merged.append(doc)
+    return merged
+
+
+def token_budget(model_name: str) -> int:
+    return Config.CONTEXT_TOKEN_BUDGETS.get(model_name, Config.CONTEXT_TOKEN_BUDGETS["default"])
+
+
+def pack_context(docs: List[Document], model_name: str, budget: int = None):
+    """
+    Builds the context for the RAG prompt: near-duplicates are removed, overlapping neighbours
+    are merged, and the highest-ranked chunks are packed until the model's token budget is used.
+    Returns (packed_docs, context_tokens).
+    """
+    budget = budget if budget is not None else token_budget(model_name)
+    packed, used = [], 0
+    for doc in merge_adjacent(deduplicate(docs)):
+        tokens = count_tokens(doc.page_content)
+        # Lower-ranked chunks that still fit are used even after a larger one was skipped
+        if used + tokens > budget:
+            continue
+        packed.append(doc)
+        used += tokens
+    return packed, used
@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import logging
+import argparse
+from typing import List
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from .config import Config
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+BACKENDS = ("hf", "int8", "onnx")
+
+
+def model_id(backend: str = None) -> str:
+    """
+    Identifies the vectors a backend produces, for cache keys. The quantized backends embed
+    into the same space as the reference model but not bit-for-bit identically.
+    """
+    backend = backend or Config.EMBEDDING_BACKEND
+    return Config.EMBEDDING_MODEL if backend == "hf" else f"{Config.EMBEDDING_MODEL}#{backend}"
+
+
+class SentenceTransformerEmbeddings(Embeddings):
+    """
+    LangChain wrapper around an already built SentenceTransformer, so quantized or ONNX models
+    can be used wherever HuggingFaceEmbeddings is. Vectors are L2-normalized like the index expects.
+    """
+
+    def __init__(self, model, batch_size: int = None):
+        self.model = model
+        self.batch_size = batch_size or Config.EMBEDDING_BATCH_SIZE
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = self.model.encode(
+            texts, batch_size=self.batch_size, normalize_embeddings=True,
+            convert_to_numpy=True, show_progress_bar=False
+        )
+        return vectors.astype(np.float32).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def _set_threads(threads: int):
+    if threads:
+        import torch
+        torch.set_num_threads(threads)
+
+
+def _int8_model(threads: int):
+    # Dynamic quantization stores the Linear layer weights as int8 and quantizes activations
+    # on the fly, which is where almost all of a MiniLM forward pass is spent on CPU
+    import torch
+    from sentence_transformers import SentenceTransformer
+    _set_threads(threads)
+    model = SentenceTransformer(Config.EMBEDDING_MODEL, device="cpu")
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def _onnx_model(threads: int):
+    # The ONNX export is done by sentence-transformers (optimum) on first load and cached with the model
+    from sentence_transformers import SentenceTransformer
+    try:
+        import onnxruntime
+    except ImportError:
+        raise ValueError("EMBEDDING_BACKEND=onnx needs the optional optimum[onnxruntime] package")
+    session_options = onnxruntime.SessionOptions()
+    if threads:
+        session_options.intra_op_num_threads = threads
+    return SentenceTransformer(
+        Config.EMBEDDING_MODEL, device="cpu", backend="onnx",
+        model_kwargs={"provider": "CPUExecutionProvider", "session_options": session_options},
+    )
+
+
+def create_embeddings(backend: str = None, threads: int = None):
+    """Builds the embedding model for a backend: "hf" (reference), "int8" (quantized torch) or "onnx" """
+    backend = backend or Config.EMBEDDING_BACKEND
+    threads = threads if threads is not None else Config.EMBEDDING_THREADS
+    if backend == "hf":
+        from langchain_huggingface import HuggingFaceEmbeddings
+        _set_threads(threads)
+        return HuggingFaceEmbeddings(
+            model_name=Config.EMBEDDING_MODEL,
+            model_kwargs=Config.EMBEDDING_MODEL_KWARGS,
+            encode_kwargs={**Config.EMBEDDING_ENCODE_KWARGS, "batch_size": Config.EMBEDDING_BATCH_SIZE}
+        )
+    if backend == "int8":
+        return SentenceTransformerEmbeddings(_int8_model(threads))
+    if backend == "onnx":
+        return SentenceTransformerEmbeddings(_onnx_model(threads))
+    raise ValueError(f"Unsupported embedding backend: {backend}")
+
+
+def _load_corpus(test_data_dir: str):
+    """Chunk texts of the test_data documents, with their source file names, plus the QnA questions"""
+    from .ingest import load_document, process_documents
+    from .benchmark import QNA_SOURCES, load_qna
+    quiet = logging.getLogger("rag_embedding_compare")
+    quiet.addHandler(logging.NullHandler())
+    quiet.propagate = False
+
+    data_dir = os.path.join(test_data_dir, "data")
+    texts, sources = [], []
+    for file_name in sorted(os.listdir(data_dir)):
+        chunks = process_documents(load_document(os.path.join(data_dir, file_name), quiet), file_name, quiet)
+        texts.extend(chunk.page_content for chunk in chunks)
+        sources.extend(file_name for _ in chunks)
+
+    questions = []
+    for qna_file, source in QNA_SOURCES.items():
+        for pair in load_qna(os.path.join(test_data_dir, "QnA_files", qna_file)):
+            questions.append((pair["question"], source))
+    return texts, sources, questions
+
+
+def compare_backends(backends=BACKENDS, k: int = 4, test_data_dir: str = "test_data") -> dict:
+    """
+    Embeds the test_data chunks with every backend and compares throughput and quality with the
+    "hf" reference: cosine similarity of each chunk vector to its reference vector, overlap of
+    the top-k neighbours of every QnA question, and recall@k of the question's source document.
+    """
+    texts, sources, questions = _load_corpus(test_data_dir)
+    sources = np.array(sources)
+    results = {"chunks": len(texts), "questions": len(questions), "k": k, "backends": {}}
+    reference = None
+
+    for backend in ["hf"] + [backend for backend in backends if backend != "hf"]:
+        started = time.perf_counter()
+        embeddings = create_embeddings(backend)
+        load_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        doc_vectors = np.array(embeddings.embed_documents(texts), dtype=np.float32)
+        embed_seconds = time.perf_counter() - started
+        query_vectors = np.array(embeddings.embed_documents([question for question, _ in questions]), dtype=np.float32)
+        top_k = np.argsort(-(query_vectors @ doc_vectors.T), axis=1)[:, :k]
+
+        entry = {
+            "load_seconds": load_seconds,
+            "chunks_per_s": len(texts) / embed_seconds if embed_seconds else 0.0,
+            f"recall@{k}": float(np.mean([
+                source in sources[row] for (_, source), row in zip(questions, top_k)
+            ])),
+        }
+        if reference is None:
+            reference = (doc_vectors, top_k)
+        else:
+            reference_vectors, reference_top_k = reference
+            cosines = np.sum(doc_vectors * reference_vectors, axis=1)
+            entry["cosine_to_reference_mean"] = float(cosines.mean())
+            entry["cosine_to_reference_min"] = float(cosines.min())
+            entry[f"top{k}_overlap"] = float(np.mean([
+                len(set(row) & set(reference_row)) / k for row, reference_row in zip(top_k, reference_top_k)
+            ]))
+            entry["speedup"] = entry["chunks_per_s"] / results["backends"]["hf"]["chunks_per_s"]
+        results["backends"][backend] = entry
+        logger.info(f"{backend}: {entry['chunks_per_s']:.1f} chunks/s")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare embedding backends on the test_data corpus")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--threads", type=int, help="Inference threads, defaults to Config.EMBEDDING_THREADS")
+    parser.add_argument("--test-data", default="test_data")
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        Config.EMBEDDING_THREADS = args.threads
+    print(json.dumps(compare_backends(args.backends, args.k, args.test_data), indent=2))
+
+
+if __name__ == "__main__":
+    main()
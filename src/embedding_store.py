@@ -0,0 +1,218 @@
+import os
+import hashlib
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from typing import List
+import numpy as np
+from .config import Config
+from .embedding_backends import model_id
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: access is still serialized within a process, but not across processes
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+VECTORS_FILE = "vectors.f32"
+INDEX_FILE = "index.sqlite"
+LOCK_FILE = "cache.lock"
+# SQLite's default limit on host parameters in one statement is 999
+_SQL_BATCH = 500
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def _key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+class PersistentEmbeddingCache:
+    """
+    On-disk cache of chunk embeddings, content-addressed by sha256 of the embedding model id
+    and the chunk text. Vectors are rows of a memory-mapped float32 array and a SQLite table
+    maps keys to rows. Once max_entries is reached the least recently used entries are evicted
+    and their rows reused, so the used rows always stay 0..count-1. The UI, the API and ingest
+    workers may share one cache directory: writers hold an exclusive file lock, readers a
+    shared one, so no reader sees a row while it is being reused.
+    """
+
+    def __init__(self, path: str, model: str, max_entries: int):
+        # One directory per model, since different models have different dimensions
+        self.path = os.path.join(path, hashlib.sha1(model.encode("utf-8")).hexdigest()[:16])
+        self.model = model
+        self.max_entries = max_entries
+        os.makedirs(self.path, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._lock_file = open(os.path.join(self.path, LOCK_FILE), "a")
+        self._conn = sqlite3.connect(os.path.join(self.path, INDEX_FILE), check_same_thread=False)
+        with self._locked():
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries "
+                "(key TEXT PRIMARY KEY, slot INTEGER NOT NULL UNIQUE, last_used INTEGER NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._conn.execute("INSERT OR IGNORE INTO meta VALUES ('model', ?)", (model,))
+            self._conn.commit()
+        self._dimension = None
+        self._vectors = None
+
+    @contextmanager
+    def _locked(self, exclusive: bool = True):
+        """The thread lock within the process, and a file lock across the processes sharing the cache"""
+        with self._lock:
+            if fcntl is not None:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def __len__(self):
+        with self._locked(exclusive=False):
+            return self._count()
+
+    def _count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def _read_dimension(self):
+        # Another process may have stored the first vectors since this one opened the cache
+        if self._dimension is None:
+            row = self._conn.execute("SELECT value FROM meta WHERE name = 'dimension'").fetchone()
+            self._dimension = int(row[0]) if row else None
+        return self._dimension
+
+    def _next_clock(self) -> int:
+        # Entries are stamped with a counter rather than a timestamp, so clock changes can't reorder them
+        # Read from the table each time, so the counter is shared by every process using the cache
+        return self._conn.execute("SELECT COALESCE(MAX(last_used), 0) FROM entries").fetchone()[0] + 1
+
+    def _open(self, min_rows: int = 0):
+        """
+        Maps the vector file, growing it (by doubling, up to max_entries rows) to hold min_rows.
+        It is mapped again whenever its size changed, also when another process grew it.
+        """
+        file_path = os.path.join(self.path, VECTORS_FILE)
+        row_bytes = self._dimension * 4
+        rows = os.path.getsize(file_path) // row_bytes if os.path.exists(file_path) else 0
+        if rows < min_rows:
+            rows = min(self.max_entries, max(min_rows, rows * 2, 1024))
+            with open(file_path, "ab") as f:
+                f.truncate(rows * row_bytes)
+        if rows and (self._vectors is None or len(self._vectors) != rows):
+            self._vectors = np.memmap(file_path, dtype=np.float32, mode="r+", shape=(rows, self._dimension))
+        return self._vectors
+
+    def get_many(self, texts: List[str]):
+        """Returns the cached vector of every text, or None where it isn't cached"""
+        keys = [_key(self.model, text) for text in texts]
+        # Shared lock: other readers may run at the same time, but no writer can reuse the rows being read
+        with self._locked(exclusive=False):
+            if self._read_dimension() is None:
+                return [None] * len(texts)
+            slots = {}
+            for start in range(0, len(keys), _SQL_BATCH):
+                batch = keys[start:start + _SQL_BATCH]
+                slots.update(self._conn.execute(
+                    f"SELECT key, slot FROM entries WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall())
+            if not slots:
+                return [None] * len(texts)
+
+            vectors = self._open()
+            found = [vectors[slots[key]].tolist() if key in slots else None for key in keys]
+
+        # The touch writes, so it takes the exclusive lock, held only for this one UPDATE. Keys
+        # evicted in between match no row, and the vectors were already copied out above.
+        with self._locked():
+            clock = self._next_clock()
+            self._conn.executemany(
+                "UPDATE entries SET last_used = ? WHERE key = ?", [(clock, key) for key in slots]
+            )
+            self._conn.commit()
+        return found
+
+    def put_many(self, texts: List[str], vectors):
+        """Stores vectors, evicting the least recently used entries when the cache is full"""
+        entries = {}
+        for text, vector in zip(texts, vectors):
+            entries[_key(self.model, text)] = vector
+        vectors = np.asarray(list(entries.values()), dtype=np.float32)
+        keys = list(entries)[-self.max_entries:]
+        vectors = vectors[-self.max_entries:]
+        if not keys:
+            return
+
+        # Slots are allocated and written under the exclusive lock, so concurrent writers never pick the same rows
+        with self._locked():
+            if self._read_dimension() is None:
+                self._conn.execute("INSERT OR IGNORE INTO meta VALUES ('dimension', ?)", (str(vectors.shape[1]),))
+                self._conn.commit()
+                # Another process may have stored the dimension first
+                self._read_dimension()
+
+            existing = set()
+            for start in range(0, len(keys), _SQL_BATCH):
+                batch = keys[start:start + _SQL_BATCH]
+                existing.update(key for (key,) in self._conn.execute(
+                    f"SELECT key FROM entries WHERE key IN ({','.join('?' * len(batch))})", batch
+                ))
+            new = [i for i, key in enumerate(keys) if key not in existing]
+            if not new:
+                return
+
+            count = self._count()
+            overflow = count + len(new) - self.max_entries
+            slots = list(range(count, min(count + len(new), self.max_entries)))
+            if overflow > 0:
+                evicted = self._conn.execute(
+                    "SELECT key, slot FROM entries ORDER BY last_used LIMIT ?", (overflow,)
+                ).fetchall()
+                # Evictions are committed before their rows are overwritten, so no key ever points at another text's vector
+                self._conn.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in evicted])
+                self._conn.commit()
+                slots.extend(slot for _, slot in evicted)
+                logger.debug(f"Evicted {len(evicted)} entries from the embedding cache")
+
+            storage = self._open(min_rows=count + len(new) - max(overflow, 0))
+            storage[slots] = vectors[new]
+            storage.flush()
+
+            clock = self._next_clock()
+            self._conn.executemany(
+                "INSERT INTO entries VALUES (?, ?, ?)",
+                [(keys[i], slot, clock) for i, slot in zip(new, slots)]
+            )
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._locked(exclusive=False):
+            file_path = os.path.join(self.path, VECTORS_FILE)
+            return {
+                "entries": self._count(),
+                "max_entries": self.max_entries,
+                "dimension": self._read_dimension(),
+                "bytes": os.path.getsize(file_path) if os.path.exists(file_path) else 0,
+            }
+
+
+def get_store():
+    """Returns the persistent cache for the configured embedding model and path, or None if disabled"""
+    if not Config.EMBEDDING_CACHE_ENABLED:
+        return None
+    key = (Config.EMBEDDING_CACHE_PATH, model_id())
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = PersistentEmbeddingCache(
+                Config.EMBEDDING_CACHE_PATH, model_id(), Config.EMBEDDING_CACHE_MAX_ENTRIES
+            )
+        return store
@@ -1,65 +1,182 @@
-from langchain_openai import ChatOpenAI
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_community.chat_models import ChatOllama
-from langchain_anthropic import ChatAnthropic
-from langchain.chains import create_retrieval_chain
-from langchain.chains.combine_documents import create_stuff_documents_chain
+from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
 import logging
+import time
 
 from .config import Config
-from .retriever import get_vectorstore
+from .retriever import get_index, embed_query, search_by_vector
+from . import cache
+from . import tracing
+from . import llm_clients
+from .tokenizer import count_tokens
+from .context import pack_context
 
-# Code to select the desired LLM and its API Key you can add more models if you need
+# Code to select the desired LLM and its API Key you can add more models in llm_clients.py if you need
+# Clients are pooled per provider, model and API key, so connections are reused across questions
 def get_llm(model_name: str, api_key: str = None):
-    if model_name == "OpenAI":
-        return ChatOpenAI(model="gpt-3.5-turbo", api_key=api_key)
-    elif model_name == "Google":
-        return ChatGoogleGenerativeAI(model="gemini-1.5-flash", api_key=api_key)
-    elif model_name == "Anthropic":
-        return ChatAnthropic(model="claude-2", api_key=api_key)
-    elif model_name == "Local":
-        return ChatOllama(model="llama3", base_url=Config.OLLAMA_BASE_URL)
-    else:
-        raise ValueError("Unsupported LLM model")
+    return llm_clients.get_client(model_name, api_key)
 
-# Code to generate a response from the selected model, include the System Prompt
-def generate_response(model_name: str, query: str, api_key: str = None, logger: logging.Logger = None):
+# The main System Prompt is defined here, you can change it you you want
+SYSTEM_PROMPT = (
+    "You are an AI assistant for question-answering tasks. "
+    "Use the following retrieved context to answer the question. "
+    "If you do not know the answer, just say that you do not know. "
+    "Use three sentences maximum and keep the answer concise.\n\n"
+    "{context}"
+)
+
+
+def _get_logger(logger: logging.Logger = None):
     if logger is None:
         logger = logging.getLogger(__name__)
         logger.addHandler(logging.NullHandler())
+    return logger
+
+
+PROMPT = ChatPromptTemplate.from_messages([
+    ("system", SYSTEM_PROMPT),
+    ("human", "{input}"),
+])
+
+
+# Code to stuff the retrieved documents into the System Prompt
+# The context is deduplicated, overlapping chunks are merged and it is packed into the model's token budget
+def _build_messages(query: str, docs, model_name: str, logger: logging.Logger = None):
+    with tracing.span("generation.prompt_assembly") as span:
+        packed_docs, context_tokens = pack_context(docs, model_name)
+        context = "\n\n".join(doc.page_content for doc in packed_docs)
+        messages = PROMPT.format_messages(context=context, input=query)
+        prompt_tokens = count_tokens("".join(str(message.content) for message in messages))
+        span["chunks"] = len(docs)
+        span["packed_chunks"] = len(packed_docs)
+        span["context_tokens"] = context_tokens
+        span["prompt_tokens"] = prompt_tokens
+    tracing.increment("prompt_tokens_total", prompt_tokens, model=model_name)
+    _get_logger(logger).info(
+        f"Packed {len(docs)} retrieved chunks into {len(packed_docs)} ({context_tokens} context tokens), "
+        f"prompt tokens: {prompt_tokens}"
+    )
+    return messages, prompt_tokens
+
 
+# Code shared by generate_response and stream_response: retrieval and the answer cache lookup
+# Returns (final_answer, docs, answer_scope, query_embedding), final_answer is set when no LLM call is needed
+def _prepare(model_name: str, query: str, logger: logging.Logger, filters=None):
     logger.info(f"Generating response for query: {query} using model: {model_name}")
-    llm = get_llm(model_name, api_key)
-    vectorstore = get_vectorstore()
+    index = get_index()
 
-    if not vectorstore:
+    if index is None:
         logger.warning("No documents ingested yet, cannot generate response.")
-        return "No documents have been ingested yet. Please upload and ingest documents first."
-
-    retriever = vectorstore.as_retriever()
-    logger.info("Retriever initialized.")
-    
-    # The main System Prompt is defined here, you can change it you you want
-    system_prompt = (
-        "You are an AI assistant for question-answering tasks. "
-        "Use the following retrieved context to answer the question. "
-        "If you do not know the answer, just say that you do not know. "
-        "Use three sentences maximum and keep the answer concise.\n\n"
-        "{context}"
-    )
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", system_prompt),
-        ("human", "{input}"),
-    ])
+        return "No documents have been ingested yet. Please upload and ingest documents first.", [], None, None
+
+    query_embedding = embed_query(query)
 
-    qna_chain = create_stuff_documents_chain(llm, prompt)
-    rag_chain = create_retrieval_chain(retriever, qna_chain)
+    # Similar enough questions asked before in the same language, against the same index,
+    # model and filters reuse the cached answer
+    scope = None
+    if Config.ANSWER_CACHE_ENABLED:
+        scope = cache.answer_scope(model_name, index.version, query, filters)
+        cached_answer = cache.answer_cache.lookup(scope, query_embedding)
+        if cached_answer is not None:
+            logger.info("Answer served from semantic cache.")
+            return cached_answer, [], scope, query_embedding
+
+    docs = search_by_vector(index, query, query_embedding, filters=filters)
+    logger.info(f"Retrieved {len(docs)} documents.")
+    return None, docs, scope, query_embedding
+
+
+# Code to generate a response from the selected model, include the System Prompt
+# `llm` replaces the pooled client of the model, e.g. with an offline stand-in in the benchmark suite
+# `filters` restricts the context to matching chunks, as in retriever.search_by_vector
+def generate_response(model_name: str, query: str, api_key: str = None, logger: logging.Logger = None, llm=None,
+                      filters=None):
+    logger = _get_logger(logger)
+    answer, docs, scope, query_embedding = _prepare(model_name, query, logger, filters)
+    if answer is not None:
+        return answer
+
+    messages, _ = _build_messages(query, docs, model_name, logger)
+    qna_chain = (llm or get_llm(model_name, api_key)) | StrOutputParser()
 
     try:
-        response = rag_chain.invoke({"input": query})
+        with tracing.span("generation.llm", model=model_name) as span:
+            answer = qna_chain.invoke(messages)
+            span["completion_tokens"] = count_tokens(answer)
+        tracing.increment("completion_tokens_total", span["completion_tokens"], model=model_name)
         logger.info("RAG chain invoked successfully.")
-        return response["answer"]
     except Exception as e:
         logger.error(f"Error during RAG chain invocation: {e}")
         return f"An error occurred while generating the response: {str(e)}"
+
+    if Config.ANSWER_CACHE_ENABLED:
+        cache.answer_cache.store(scope, query, query_embedding, answer)
+    return answer
+
+
+# Async variant used by the HTTP service (api.py), which does retrieval itself in micro-batches
+# Errors are raised to the caller instead of being turned into an answer string
+async def agenerate_from_documents(model_name: str, query: str, docs, api_key: str = None):
+    messages, _ = _build_messages(query, docs, model_name)
+    qna_chain = get_llm(model_name, api_key) | StrOutputParser()
+    with tracing.span("generation.llm", model=model_name) as span:
+        answer = await qna_chain.ainvoke(messages)
+        span["completion_tokens"] = count_tokens(answer)
+    tracing.increment("completion_tokens_total", span["completion_tokens"], model=model_name)
+    return answer
+
+
+# Code to stream a response token by token, works with every backend in get_llm
+def stream_response(model_name: str, query: str, api_key: str = None, logger: logging.Logger = None, llm=None,
+                    filters=None):
+    """
+    Streaming variant of generate_response. Yields event dicts in this order:
+        {"type": "sources", "documents": [...]}  once retrieval is done
+        {"type": "token", "text": "..."}          for every chunk the provider emits
+        {"type": "done", "answer": "...", "time_to_first_token": seconds, "prompt_tokens": n}
+    Cached answers and errors are delivered as a single token event. `llm` and `filters`
+    are as in generate_response.
+    """
+    logger = _get_logger(logger)
+    started = time.perf_counter()
+    answer, docs, scope, query_embedding = _prepare(model_name, query, logger, filters)
+    yield {"type": "sources", "documents": docs}
+
+    if answer is not None:
+        yield {"type": "token", "text": answer}
+        yield {"type": "done", "answer": answer, "time_to_first_token": time.perf_counter() - started,
+               "prompt_tokens": 0}
+        return
+
+    messages, prompt_tokens = _build_messages(query, docs, model_name, logger)
+    qna_chain = (llm or get_llm(model_name, api_key)) | StrOutputParser()
+    parts = []
+    time_to_first_token = None
+
+    try:
+        with tracing.span("generation.llm", model=model_name, streaming=True) as span:
+            for token in qna_chain.stream(messages):
+                if not token:
+                    continue
+                if time_to_first_token is None:
+                    time_to_first_token = time.perf_counter() - started
+                    span["time_to_first_token"] = time_to_first_token
+                    logger.info(f"First token after {time_to_first_token:.3f}s")
+                parts.append(token)
+                yield {"type": "token", "text": token}
+            span["completion_tokens"] = count_tokens("".join(parts))
+        tracing.increment("completion_tokens_total", span["completion_tokens"], model=model_name)
+        logger.info("RAG chain streamed successfully.")
+    except Exception as e:
+        logger.error(f"Error during RAG chain streaming: {e}")
+        error = f"An error occurred while generating the response: {str(e)}"
+        yield {"type": "token", "text": error}
+        yield {"type": "done", "answer": "".join(parts) + error, "time_to_first_token": time_to_first_token,
+               "prompt_tokens": prompt_tokens}
+        return
+
+    answer = "".join(parts)
+    if Config.ANSWER_CACHE_ENABLED:
+        cache.answer_cache.store(scope, query, query_embedding, answer)
+    yield {"type": "done", "answer": answer, "time_to_first_token": time_to_first_token,
+           "prompt_tokens": prompt_tokens}
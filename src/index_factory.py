@@ -0,0 +1,346 @@
+import math
+import time
+import uuid
+import weakref
+import logging
+import argparse
+import json
+import numpy as np
+import faiss
+from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain.schema import Document
+from .config import Config
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+INDEX_TYPES = ("flat", "ivf_flat", "hnsw", "ivf_pq")
+# Fewest training vectors of the trained index types, smaller corpora get the flat index
+# IVF needs a vector per list, PQ a vector per centroid of its (at least 16 entry) codebooks
+MIN_TRAINING_VECTORS = {"ivf_flat": 1, "ivf_pq": 2 ** 4}
+
+
+def choose_index_type(n_vectors: int, index_type: str = None) -> str:
+    """
+    Resolves Config.INDEX_TYPE into a concrete index type. "auto" keeps the exact flat
+    index for small corpora and switches to Config.AUTO_ANN_INDEX_TYPE past Config.ANN_THRESHOLD.
+    A trained type is replaced by flat when there are too few vectors to train it.
+    """
+    index_type = index_type or Config.INDEX_TYPE
+    if index_type == "auto":
+        index_type = Config.AUTO_ANN_INDEX_TYPE if n_vectors >= Config.ANN_THRESHOLD else "flat"
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unsupported index type: {index_type}")
+    if n_vectors < MIN_TRAINING_VECTORS.get(index_type, 0):
+        logger.info(f"Only {n_vectors} vectors, too few to train a {index_type} index, using a flat index")
+        return "flat"
+    return index_type
+
+
+def _nlist_for(n_vectors: int) -> int:
+    # Rule of thumb from the FAISS wiki, capped so every list gets enough training points
+    nlist = Config.IVF_NLIST or max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // 39 or 1))
+    if nlist > n_vectors:
+        # k-means can't train more lists than there are vectors
+        logger.info(f"Only {n_vectors} training vectors, using {n_vectors} IVF lists instead of {nlist}")
+        nlist = max(1, n_vectors)
+    return nlist
+
+
+def _pq_nbits_for(n_vectors: int) -> int:
+    # Every PQ codebook has 2**nbits centroids trained with k-means, so it needs as many vectors
+    nbits = Config.PQ_NBITS
+    if n_vectors < 2 ** nbits:
+        nbits = max(1, int(math.log2(max(1, n_vectors))))
+        logger.info(f"Only {n_vectors} training vectors, using {nbits}-bit PQ codes instead of {Config.PQ_NBITS}-bit")
+    return nbits
+
+
+def create_index(dimension: int, index_type: str, n_vectors: int):
+    """Creates an empty (possibly untrained) FAISS index using L2 distance, like LangChain's default"""
+    if index_type == "flat":
+        return faiss.IndexFlatL2(dimension)
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, Config.HNSW_M)
+        index.hnsw.efConstruction = Config.HNSW_EF_CONSTRUCTION
+        return index
+    if index_type == "ivf_flat":
+        return faiss.IndexIVFFlat(faiss.IndexFlatL2(dimension), dimension, _nlist_for(n_vectors))
+    if index_type == "ivf_pq":
+        return faiss.IndexIVFPQ(
+            faiss.IndexFlatL2(dimension), dimension, _nlist_for(n_vectors), Config.PQ_M, _pq_nbits_for(n_vectors)
+        )
+    raise ValueError(f"Unsupported index type: {index_type}")
+
+
+def index_type_of(index) -> str:
+    """Returns the index type name for a loaded FAISS index"""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+
+def apply_search_params(index, nprobe: int = None, ef_search: int = None):
+    """Applies the runtime search knobs (nprobe for IVF, efSearch for HNSW) to a loaded index"""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search or Config.HNSW_EF_SEARCH
+    elif isinstance(index, faiss.IndexIVF):
+        index.nprobe = nprobe or Config.IVF_NPROBE
+    return index
+
+
+def _train(index, vectors: np.ndarray, index_type: str):
+    if not index.is_trained:
+        started = time.perf_counter()
+        index.train(vectors)
+        logger.info(f"Trained {index_type} index on {len(vectors)} vectors in {time.perf_counter() - started:.2f}s")
+
+
+def build_index(vectors: np.ndarray, index_type: str = None):
+    """Builds, trains and fills an index of the requested (or automatically chosen) type"""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n_vectors, dimension = vectors.shape
+    index_type = choose_index_type(n_vectors, index_type)
+    index = create_index(dimension, index_type, n_vectors)
+    _train(index, vectors, index_type)
+    index.add(vectors)
+    apply_search_params(index)
+    return index
+
+
+def build_vectorstore(text_embeddings, embeddings, metadatas=None, ids=None, index_type: str = None):
+    """
+    Drop-in replacement for FAISS.from_embeddings that trains an ANN index when the corpus
+    is large enough. The docstore and id mapping are filled by LangChain as usual.
+    """
+    vectors = np.array([vector for _, vector in text_embeddings], dtype=np.float32)
+    index_type = choose_index_type(len(vectors), index_type)
+    index = create_index(vectors.shape[1], index_type, len(vectors))
+    _train(index, vectors, index_type)
+    apply_search_params(index)
+
+    vectorstore = FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=InMemoryDocstore(),
+        index_to_docstore_id={},
+    )
+    add_vectors(vectorstore, text_embeddings, metadatas=metadatas, ids=ids)
+    logger.info(f"Built {index_type} vector store with {len(vectors)} vectors")
+    return vectorstore
+
+
+def _use_id_hashtable(index):
+    """
+    Gives an IVF index a label -> list entry hashtable, so vectors can be reconstructed and
+    removed by label without scanning the lists. Indexes saved without one get it on first use.
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and ivf.direct_map.type != faiss.DirectMap.Hashtable:
+        ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+    return ivf
+
+
+def reconstruct_vectors(index, labels=None) -> np.ndarray:
+    """
+    Returns the stored vectors of an index (exact for flat/HNSW/IVF-Flat, approximate for
+    IVF-PQ), those with the given labels or by default all of them. Without labels the
+    index must be numbered 0..ntotal-1, as flat indexes and freshly built ones are.
+    """
+    _use_id_hashtable(index)
+    if labels is None:
+        return index.reconstruct_n(0, index.ntotal)
+    return index.reconstruct_batch(np.asarray(labels, dtype=np.int64))
+
+
+def add_vectors(vectorstore, text_embeddings, metadatas=None, ids=None):
+    """
+    Adds embedded texts under new labels, after every label in use. Replaces LangChain's
+    add_embeddings, which numbers new vectors from len(index_to_docstore_id) and so hands
+    out labels still held by IVF and HNSW indexes after deletions (see remove_vectors).
+    """
+    texts = [text for text, _ in text_embeddings]
+    vectors = np.array([vector for _, vector in text_embeddings], dtype=np.float32)
+    metadatas = metadatas or [{} for _ in texts]
+    ids = ids or [str(uuid.uuid4()) for _ in texts]
+    index = vectorstore.index
+    start = max(index.ntotal, max(vectorstore.index_to_docstore_id, default=-1) + 1)
+    labels = np.arange(start, start + len(vectors), dtype=np.int64)
+    if _use_id_hashtable(index) is not None:
+        index.add_with_ids(vectors, labels)
+    else:
+        # Flat and HNSW indexes number their vectors themselves, from ntotal on
+        index.add(vectors)
+    vectorstore.docstore.add({
+        chunk_id: Document(page_content=text, metadata=metadata)
+        for chunk_id, text, metadata in zip(ids, texts, metadatas)
+    })
+    vectorstore.index_to_docstore_id.update(zip(labels.tolist(), ids))
+
+
+def remove_vectors(vectorstore, labels):
+    """
+    Removes vectors and their chunks by label, touching only those vectors. Flat indexes
+    renumber the vectors that stay, so the label mapping is renumbered with them. IVF
+    indexes remove them through their label hashtable and keep every other label. HNSW
+    graphs can't remove vectors, their labels are dropped from the mapping and skipped by
+    search() until the index is compacted.
+    """
+    index = vectorstore.index
+    chunk_ids = [vectorstore.index_to_docstore_id[label] for label in labels]
+    if isinstance(faiss.downcast_index(index), faiss.IndexFlat):
+        index.remove_ids(np.asarray(labels, dtype=np.int64))
+        removed = set(labels)
+        vectorstore.index_to_docstore_id = {
+            i: chunk_id for i, chunk_id in enumerate(
+                chunk_id for label, chunk_id in sorted(vectorstore.index_to_docstore_id.items()) if label not in removed
+            )
+        }
+    else:
+        if _use_id_hashtable(index) is not None:
+            label_array = np.asarray(labels, dtype=np.int64)
+            index.remove_ids(faiss.IDSelectorArray(len(label_array), faiss.swig_ptr(label_array)))
+        for label in labels:
+            del vectorstore.index_to_docstore_id[label]
+        _deleted.pop(index, None)
+    vectorstore.docstore.delete(chunk_ids)
+
+
+class _DeletedLabels:
+    """The labels an HNSW graph still holds for deleted vectors, and a search filter excluding them"""
+
+    def __init__(self, labels: np.ndarray):
+        self.labels = labels
+        # The batch selector must outlive the one wrapping it, FAISS doesn't keep a reference
+        self._batch = faiss.IDSelectorBatch(labels)
+        self.selector = faiss.IDSelectorNot(self._batch)
+
+
+# index -> _DeletedLabels (or None), computed once per loaded or changed HNSW index
+_deleted = weakref.WeakKeyDictionary()
+
+
+def _deleted_labels(vectorstore):
+    index = vectorstore.index
+    if index not in _deleted:
+        deleted = None
+        if isinstance(faiss.downcast_index(index), faiss.IndexHNSW) and \
+                index.ntotal > len(vectorstore.index_to_docstore_id):
+            labels = np.setdiff1d(
+                np.arange(index.ntotal, dtype=np.int64),
+                np.fromiter(vectorstore.index_to_docstore_id, dtype=np.int64)
+            )
+            deleted = _DeletedLabels(labels)
+        _deleted[index] = deleted
+    return _deleted[index]
+
+
+def search(vectorstore, vectors: np.ndarray, k: int):
+    """
+    Searches a vector store's index like faiss' index.search, returning (distances, labels)
+    with -1 for missing hits. Vectors deleted from an HNSW graph are filtered out during the
+    graph search, so every returned label is in vectorstore.index_to_docstore_id.
+    """
+    index = vectorstore.index
+    deleted = _deleted_labels(vectorstore)
+    if deleted is None:
+        return index.search(vectors, k)
+    params = faiss.SearchParametersHNSW()
+    params.sel = deleted.selector
+    params.efSearch = faiss.downcast_index(index).hnsw.efSearch
+    return index.search(vectors, k, params=params)
+
+
+def upgrade_vectorstore(vectorstore, index_type: str = None):
+    """
+    Rebuilds a flat vectorstore as an ANN index once it has outgrown Config.ANN_THRESHOLD.
+    Stores that are already ANN, or still small, are returned unchanged.
+    """
+    n_vectors = vectorstore.index.ntotal
+    current_type = index_type_of(vectorstore.index)
+    target_type = choose_index_type(n_vectors, index_type)
+    if current_type != "flat" or target_type == "flat":
+        return vectorstore
+
+    logger.info(f"Corpus reached {n_vectors} vectors, rebuilding flat index as {target_type}")
+    vectorstore.index = build_index(reconstruct_vectors(vectorstore.index), target_type)
+    return vectorstore
+
+
+def compare_recall(vectors: np.ndarray, query_vectors: np.ndarray, k: int = 10, index_types=None) -> dict:
+    """
+    Builds every requested index type from the same vectors and compares it against exact
+    (flat) search: build time, mean query latency and recall@k of the exact top-k.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    query_vectors = np.ascontiguousarray(query_vectors, dtype=np.float32)
+    index_types = index_types or INDEX_TYPES
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    started = time.perf_counter()
+    _, truth = exact.search(query_vectors, k)
+    exact_latency = (time.perf_counter() - started) / len(query_vectors)
+
+    results = {}
+    for index_type in index_types:
+        started = time.perf_counter()
+        index = build_index(vectors, index_type)
+        build_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        _, found = index.search(query_vectors, k)
+        latency = (time.perf_counter() - started) / len(query_vectors)
+
+        hits = sum(len(set(row_found) & set(row_truth)) for row_found, row_truth in zip(found, truth))
+        results[index_type] = {
+            "build_seconds": build_seconds,
+            "latency_ms": latency * 1000,
+            "speedup_vs_exact": exact_latency / latency if latency else 0.0,
+            f"recall@{k}": hits / (len(query_vectors) * k),
+        }
+    return results
+
+
+def _stored_vectors(vectorstore):
+    """Vectors of every chunk stored in a vectorstore"""
+    if index_type_of(vectorstore.index) == "ivf_pq":
+        # PQ codes are lossy, so re-embed the stored chunks to get exact vectors for the ground truth
+        texts = [vectorstore.docstore.search(doc_id).page_content
+                 for doc_id in vectorstore.index_to_docstore_id.values()]
+        return np.array(vectorstore.embedding_function.embed_documents(texts), dtype=np.float32)
+    return reconstruct_vectors(vectorstore.index, list(vectorstore.index_to_docstore_id))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare ANN index types against exact search on the current index")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200, help="Number of stored vectors sampled as queries")
+    parser.add_argument("--types", nargs="+", default=list(INDEX_TYPES), choices=INDEX_TYPES)
+    args = parser.parse_args()
+
+    from .resources import get_vectorstore
+    from .shards import ShardedVectorStore
+    vectorstore = get_vectorstore()
+    if vectorstore is None:
+        raise SystemExit("No index found, ingest some documents first.")
+
+    # With language sharding the chunks are spread over one index per language
+    stores = [vectorstore.shard(language) for language in vectorstore.languages] \
+        if isinstance(vectorstore, ShardedVectorStore) else [vectorstore]
+    vectors = np.concatenate([_stored_vectors(store) for store in stores])
+
+    rng = np.random.default_rng(0)
+    sample = rng.choice(len(vectors), size=min(args.queries, len(vectors)), replace=False)
+    print(json.dumps(compare_recall(vectors, vectors[sample], args.k, args.types), indent=2))
+
+
+if __name__ == "__main__":
+    main()
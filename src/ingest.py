@@ -1,51 +1,67 @@
 import os
 import json
+import time
+import uuid
+import hashlib
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from typing import List
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.document_loaders import PyPDFLoader, TextLoader, Docx2txtLoader, UnstructuredPowerPointLoader
 from langchain.schema import Document
-from langdetect import detect
 from .config import Config
+from . import resources
+from . import index_factory
+from . import mmap_store
+from . import lexical
+from . import shards
+from . import snapshots
+from . import catalog
+from .catalog import document_id
+from . import embedding_store
+from . import tracing
+from .language import detect_languages, majority_language, UNKNOWN
 import logging
-import tiktoken
+
+# Throughput figures of the most recent ingest_documents call
+last_ingest_stats = {}
 
 
 def get_embeddings():
-    """Initialize embeddings with proper device configuration"""
-    # Set environment variables to force CPU usage
-    os.environ['CUDA_VISIBLE_DEVICES'] = ''
-    os.environ['PYTORCH_CUDA_ALLOC_CONF'] = 'max_split_size_mb:128'
-
-    return HuggingFaceEmbeddings(
-        model_name=Config.EMBEDDING_MODEL,
-        model_kwargs={'device': 'cpu'},
-        encode_kwargs={'normalize_embeddings': True}
-    )
+    """Returns the process-wide embedding model, shared with the retriever"""
+    return resources.get_embeddings()
+
+
+# Loaders are imported on first use, importing them all pulls in every parser's dependencies
+def _get_loader(file_path: str, logger: logging.Logger):
+    if file_path.endswith(".pdf"):
+        from langchain.document_loaders import PyPDFLoader
+        logger.debug("Using PyPDFLoader")
+        return PyPDFLoader(file_path)
+    elif file_path.endswith(".txt") or file_path.endswith(".md"):
+        from langchain.document_loaders import TextLoader
+        logger.debug("Using TextLoader for .txt or .md")
+        return TextLoader(file_path, encoding="utf-8")
+    elif file_path.endswith(".docx"):
+        from langchain.document_loaders import Docx2txtLoader
+        logger.debug("Using Docx2txtLoader")
+        return Docx2txtLoader(file_path)
+    elif file_path.endswith(".ppt") or file_path.endswith(".pptx"):
+        from langchain.document_loaders import UnstructuredPowerPointLoader
+        logger.debug("Using UnstructuredPowerPointLoader")
+        return UnstructuredPowerPointLoader(file_path)
+    logger.warning(f"Unsupported file type: {file_path}")
+    raise ValueError(f"Unsupported file type: {file_path}")
 
 
 def load_document(file_path: str, logger: logging.Logger):
     logger.info(f"Attempting to load file: {file_path}")
 
     try:
-        if file_path.endswith(".pdf"):
-            loader = PyPDFLoader(file_path)
-            logger.debug("Using PyPDFLoader")
-        elif file_path.endswith(".txt") or file_path.endswith(".md"):
-            loader = TextLoader(file_path, encoding="utf-8")
-            logger.debug("Using TextLoader for .txt or .md")
-        elif file_path.endswith(".docx"):
-            loader = Docx2txtLoader(file_path)
-            logger.debug("Using Docx2txtLoader")
-        elif file_path.endswith(".ppt") or file_path.endswith(".pptx"):
-            loader = UnstructuredPowerPointLoader(file_path)
-            logger.debug("Using UnstructuredPowerPointLoader")
-        else:
-            logger.warning(f"Unsupported file type: {file_path}")
-            raise ValueError(f"Unsupported file type: {file_path}")
-
-        documents = loader.load()
+        loader = _get_loader(file_path, logger)
+        with tracing.span("ingest.parse", file_type=os.path.splitext(file_path)[1]) as span:
+            documents = loader.load()
+            span["pages"] = len(documents)
         logger.info(f"Successfully loaded {len(documents)} document(s) from {file_path}")
         return documents
 
@@ -54,101 +70,617 @@ def load_document(file_path: str, logger: logging.Logger):
         raise
 
 
-def process_documents(documents: List[Document], original_filename: str, logger: logging.Logger):
-    """Process documents and split into chunks"""
-    text_splitter = RecursiveCharacterTextSplitter(
+def _iter_text_blocks(file_path: str, block_chars: int):
+    """
+    Yields (offset, text) blocks of a text file. Blocks are cut after the last paragraph (or
+    line) break, so no chunk ever spans two blocks.
+    """
+    offset = 0
+    carry = ""
+    with open(file_path, "r", encoding="utf-8") as f:
+        while True:
+            data = f.read(block_chars)
+            if not data:
+                break
+            text = carry + data
+            cut = text.rfind("\n\n")
+            cut = cut + 2 if cut > 0 else text.rfind("\n") + 1
+            if cut <= 0:
+                cut = len(text)
+            yield offset, text[:cut]
+            offset += cut
+            carry = text[cut:]
+    if carry:
+        yield offset, carry
+
+
+def load_document_lazy(file_path: str, logger: logging.Logger):
+    """
+    Yields a file one piece at a time as (document, offset, fraction): pages for PDFs, blocks of
+    Config.TEXT_BLOCK_CHARS characters for text files. `offset` is the character position of
+    the piece in the file, `fraction` the share of the file read so far (None if unknown).
+    """
+    logger.info(f"Streaming file: {file_path}")
+    if file_path.endswith(".txt") or file_path.endswith(".md"):
+        size = os.path.getsize(file_path) or 1
+        for offset, text in _iter_text_blocks(file_path, Config.TEXT_BLOCK_CHARS):
+            # Offsets count characters and the size bytes, so this is an estimate for non-ASCII text
+            yield Document(page_content=text, metadata={"source": file_path}), offset, min(1.0, (offset + len(text)) / size)
+        return
+
+    for document in _get_loader(file_path, logger).lazy_load():
+        yield document, 0, None
+
+
+def _text_splitter():
+    return RecursiveCharacterTextSplitter(
         chunk_size=500,
         chunk_overlap=50,
-        length_function=len
+        length_function=len,
+        add_start_index=True  # Lets the prompt builder merge overlapping neighbours (see context.py)
     )
 
+
+def _tag_languages(chunks: List[Document]):
+    """Tags every chunk with its own language and returns the languages"""
+    with tracing.span("ingest.langdetect", chunks=len(chunks)):
+        languages = detect_languages([chunk.page_content for chunk in chunks])
+    for chunk, language in zip(chunks, languages):
+        chunk.metadata['language'] = language
+    return languages
+
+
+def process_documents(documents: List[Document], original_filename: str, logger: logging.Logger):
+    """Process documents and split into chunks"""
+    text_splitter = _text_splitter()
+
     processed_chunks = []
-    for doc in documents:
-        chunks = text_splitter.split_documents([doc])
-        for chunk in chunks:
-            chunk.metadata['source'] = original_filename
-            processed_chunks.append(chunk)
+    with tracing.span("ingest.split") as span:
+        for doc in documents:
+            chunks = text_splitter.split_documents([doc])
+            for chunk in chunks:
+                chunk.metadata['source'] = original_filename
+                chunk.metadata['doc_id'] = document_id(original_filename)
+                processed_chunks.append(chunk)
+        span["chunks"] = len(processed_chunks)
 
     logger.info(f"Created {len(processed_chunks)} chunks from {original_filename}")
     return processed_chunks
 
 
+def file_hash(file_path: str) -> str:
+    """SHA-256 of a file's content, read in blocks"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
 def count_words(text: str) -> int:
-    enc = tiktoken.get_encoding("cl100k_base")
     return len(text.split())
 
 
-def ingest_documents(file_paths: List[str], original_filenames: List[str], logger: logging.Logger):
-    all_processed_chunks = []
-    documents_metadata = []
-
-    for file_path, original_filename in zip(file_paths, original_filenames):
-        logger.info(f"Loading document: {original_filename}")
-        try:
+def _load_and_process(file_path: str, original_filename: str, logger: logging.Logger = None):
+    """
+    Parse, split and describe a single file. Runs inside the ingestion process pool, so the
+    spans recorded here are returned to the parent process along with the chunks.
+    """
+    logger = logger or logging.getLogger(__name__)
+    logger.info(f"Loading document: {original_filename}")
+    try:
+        with tracing.capture() as spans:
             documents = load_document(file_path, logger)
             processed_chunks = process_documents(documents, original_filename, logger)
-            all_processed_chunks.extend(processed_chunks)
 
             # Store metadata for each document
-            documents_metadata.append({
+            with tracing.span("ingest.word_count"):
+                word_count = sum(count_words(doc.page_content) for doc in documents)
+            # Every chunk is tagged with its own language, the document gets the most common one
+            languages = _tag_languages(processed_chunks)
+            language = majority_language(languages) if languages else UNKNOWN
+            metadata = {
+                "doc_id": document_id(original_filename),
                 "file_name": original_filename,
-                "word_count": sum(count_words(doc.page_content) for doc in documents),
-                "language": detect(documents[0].page_content) if documents else "unknown"
-            })
-        except Exception as e:
-            logger.error(f"Failed to load or process document {original_filename}: {e}")
-            raise
+                "content_hash": file_hash(file_path),
+                "word_count": word_count,
+                "chunk_count": len(processed_chunks),
+                "language": language
+            }
+        return processed_chunks, metadata, spans
+    except Exception as e:
+        logger.error(f"Failed to load or process document {original_filename}: {e}")
+        raise
+
+
+def _iter_parsed_documents(file_paths: List[str], original_filenames: List[str], logger: logging.Logger):
+    """
+    Yields (chunks, metadata) per file in input order. With more than one worker the files
+    are parsed in a process pool, so the caller can embed finished files while later ones
+    are still being parsed.
+    """
+    workers = min(Config.INGEST_WORKERS, len(file_paths))
+    if workers <= 1:
+        for file_path, original_filename in zip(file_paths, original_filenames):
+            processed_chunks, metadata, spans = _load_and_process(file_path, original_filename, logger)
+            tracing.replay(spans)
+            yield processed_chunks, metadata
+        return
+
+    logger.info(f"Parsing {len(file_paths)} files with {workers} worker processes")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # map() keeps input order, so the output matches the serial path exactly
+        for processed_chunks, metadata, spans in executor.map(_load_and_process, file_paths, original_filenames):
+            tracing.replay(spans)
+            yield processed_chunks, metadata
+
+
+def _embed_in_batches(embeddings, texts: List[str], batch_size: int):
+    """
+    Embeds texts in batches. Chunks embedded by an earlier ingest are served from the persistent
+    embedding cache, and repeated texts are embedded once. Returns (vectors, cache hits).
+    """
+    store = embedding_store.get_store()
+    if store is not None:
+        with tracing.span("ingest.embedding_cache_lookup", chunks=len(texts)):
+            vectors = store.get_many(texts)
+    else:
+        vectors = [None] * len(texts)
+    hits = sum(vector is not None for vector in vectors)
+    tracing.increment("embedding_cache_hits_total", hits)
+
+    missing = {}
+    for i, vector in enumerate(vectors):
+        if vector is None:
+            missing.setdefault(texts[i], []).append(i)
+    missing_texts = list(missing)
+    for start in range(0, len(missing_texts), batch_size):
+        batch = missing_texts[start:start + batch_size]
+        with tracing.span("ingest.embed", batch_size=len(batch)):
+            batch_vectors = embeddings.embed_documents(batch)
+        tracing.increment("embeddings_total", len(batch))
+        for text, vector in zip(batch, batch_vectors):
+            for i in missing[text]:
+                vectors[i] = vector
+        if store is not None:
+            store.put_many(batch, batch_vectors)
+    return vectors, hits
+
+
+def _use_streaming(file_paths: List[str]) -> bool:
+    if Config.INGEST_MODE == "streaming":
+        return True
+    if Config.INGEST_MODE == "auto":
+        total_mb = sum(os.path.getsize(file_path) for file_path in file_paths) / (1024 * 1024)
+        return total_mb >= Config.STREAMING_INGEST_MIN_MB
+    return False
+
+
+def ingest_documents(file_paths: List[str], original_filenames: List[str], logger: logging.Logger, progress=None):
+    """
+    Ingests files into the index, replacing earlier versions of the same file names. Uploads
+    above Config.STREAMING_INGEST_MIN_MB are streamed in bounded-memory windows (see
+    Config.INGEST_MODE). `progress`, if given, is called as progress(fraction, message).
+    Returns the processed chunks; streaming mode doesn't keep them and returns an empty list,
+    the counts are in last_ingest_stats either way.
+    """
+    if _use_streaming(file_paths):
+        return _ingest_streaming(file_paths, original_filenames, logger, progress)
+
+    started = time.perf_counter()
+    all_processed_chunks = []
+    all_vectors = []
+    documents_metadata = []
+    embeddings = None
+    embed_seconds = 0.0
+    cache_hits = 0
+    pending = []
+
+    # Stage 1 parses files in parallel, stage 2 embeds full batches as soon as they are available
+    for processed_chunks, metadata in _iter_parsed_documents(file_paths, original_filenames, logger):
+        all_processed_chunks.extend(processed_chunks)
+        documents_metadata.append(metadata)
+        pending.extend(processed_chunks)
+        if progress:
+            progress(len(documents_metadata) / (len(file_paths) + 1), f"Parsed {metadata['file_name']}")
+
+        if len(pending) >= Config.EMBEDDING_BATCH_SIZE:
+            if embeddings is None:
+                logger.info("Initializing embeddings...")
+                embeddings = get_embeddings()
+                logger.info("Embeddings initialized successfully")
+            full = len(pending) - len(pending) % Config.EMBEDDING_BATCH_SIZE
+            embed_started = time.perf_counter()
+            vectors, hits = _embed_in_batches(
+                embeddings, [chunk.page_content for chunk in pending[:full]], Config.EMBEDDING_BATCH_SIZE
+            )
+            all_vectors.extend(vectors)
+            cache_hits += hits
+            embed_seconds += time.perf_counter() - embed_started
+            pending = pending[full:]
 
     if all_processed_chunks:
         # Initialize embeddings only when needed
-        logger.info("Initializing embeddings...")
-        embeddings = get_embeddings()
-        logger.info("Embeddings initialized successfully")
-
-        # Create or load existing vector store
-        if os.path.exists(Config.FAISS_INDEX_PATH):
-            logger.info("Loading existing FAISS index")
-            vectorstore = FAISS.load_local(Config.FAISS_INDEX_PATH, embeddings, allow_dangerous_deserialization=True)
-            vectorstore.add_documents(all_processed_chunks)
-            logger.info(f"Added {len(all_processed_chunks)} chunks to existing vector store")
-        else:
-            logger.info("Creating new FAISS index")
-            vectorstore = FAISS.from_documents(all_processed_chunks, embeddings)
-            logger.info(f"Created new vector store with {len(all_processed_chunks)} chunks")
+        if embeddings is None:
+            logger.info("Initializing embeddings...")
+            embeddings = get_embeddings()
+            logger.info("Embeddings initialized successfully")
+
+        embed_started = time.perf_counter()
+        vectors, hits = _embed_in_batches(
+            embeddings, [chunk.page_content for chunk in pending], Config.EMBEDDING_BATCH_SIZE
+        )
+        all_vectors.extend(vectors)
+        cache_hits += hits
+        embed_seconds += time.perf_counter() - embed_started
 
-        # Save the updated vector store
-        vectorstore.save_local(Config.FAISS_INDEX_PATH)
-        logger.info("Vector store saved successfully")
+        # Stage 3 inserts every vector into the index in a single bulk call
+        text_embeddings = [(chunk.page_content, vector) for chunk, vector in zip(all_processed_chunks, all_vectors)]
+        metadatas = [chunk.metadata for chunk in all_processed_chunks]
+        # Chunk ids are shared by the FAISS docstore and the BM25 index so their hits can be fused
+        chunk_ids = [str(uuid.uuid4()) for _ in all_processed_chunks]
 
-        # Update documents metadata
-        existing_metadata = []
-        if os.path.exists(Config.DOCUMENTS_JSON_PATH):
-            with open(Config.DOCUMENTS_JSON_PATH, 'r') as f:
-                existing_metadata = json.load(f)
+        # The index is read, modified and written as a new snapshot version under the single-writer lock
+        with snapshots.writer(logger) as snapshot:
+            vectorstore, chunk_map, lexical_index = _open_index(embeddings, documents_metadata, logger, snapshot)
+            if vectorstore is not None:
+                with tracing.span("ingest.index_insert", chunks=len(text_embeddings)):
+                    index_factory.add_vectors(vectorstore, text_embeddings, metadatas=metadatas, ids=chunk_ids)
+                    vectorstore = index_factory.upgrade_vectorstore(vectorstore)
+                logger.info(f"Added {len(all_processed_chunks)} chunks to existing vector store")
+            else:
+                logger.info("Creating new FAISS index")
+                with tracing.span("ingest.index_insert", chunks=len(text_embeddings)):
+                    vectorstore = index_factory.build_vectorstore(
+                        text_embeddings, embeddings, metadatas=metadatas, ids=chunk_ids
+                    )
+                logger.info(f"Created new vector store with {len(all_processed_chunks)} chunks")
 
-        existing_metadata.extend(documents_metadata)
+            for chunk, chunk_id in zip(all_processed_chunks, chunk_ids):
+                chunk_map["documents"].setdefault(chunk.metadata["doc_id"], []).append(chunk_id)
 
-        with open(Config.DOCUMENTS_JSON_PATH, 'w') as f:
-            json.dump(existing_metadata, f, indent=2)
+            # Update the BM25 index incrementally with the new chunks
+            with tracing.span("ingest.lexical_index"):
+                lexical_index.add(chunk_ids, [chunk.page_content for chunk in all_processed_chunks])
+            logger.info(f"Lexical index updated, now holding {len(lexical_index)} chunks")
 
-        logger.info(f"Updated metadata for {len(documents_metadata)} documents")
+            if progress:
+                progress(len(file_paths) / (len(file_paths) + 1), "Saving index")
+            _finish_ingest(vectorstore, lexical_index, chunk_map, documents_metadata, logger, snapshot)
 
+    _record_ingest_stats(started, len(documents_metadata), len(all_processed_chunks), embed_seconds, cache_hits, logger)
+    if progress:
+        progress(1.0, f"Ingested {len(documents_metadata)} file(s), {len(all_processed_chunks)} chunks")
     return all_processed_chunks
 
 
+def _open_index(embeddings, documents_metadata, logger: logging.Logger, snapshot):
+    """
+    Loads a private copy of the snapshot's base index, its chunk map and the lexical index,
+    and removes the chunks of earlier versions of the given documents. Returns (None, empty
+    map, empty index) when nothing has been ingested yet.
+    """
+    vectorstore = _load_base_index(snapshot, embeddings, logger)
+    if vectorstore is None:
+        return None, {"documents": {}, "deleted_chunks": 0}, lexical.BM25Index()
+    chunk_map = _load_chunk_map(vectorstore, snapshot)
+    lexical_index = _load_lexical_index(vectorstore, snapshot)
+
+    # Documents that were ingested before under the same name are replaced in place, all in one removal
+    old_chunk_ids = []
+    for metadata in documents_metadata:
+        chunk_ids = chunk_map["documents"].pop(metadata["doc_id"], None)
+        if chunk_ids:
+            logger.info(f"Replacing {len(chunk_ids)} chunks of previous version of {metadata['file_name']}")
+            old_chunk_ids.extend(chunk_ids)
+    if old_chunk_ids:
+        _remove_chunks(vectorstore, lexical_index, old_chunk_ids)
+        chunk_map["deleted_chunks"] += len(old_chunk_ids)
+    return vectorstore, chunk_map, lexical_index
+
+
+def _finish_ingest(vectorstore, lexical_index, chunk_map, documents_metadata, logger: logging.Logger, snapshot):
+    _maybe_compact(vectorstore, chunk_map, logger)
+    # Catalog entries of replaced documents are swapped for the new ones, they share the document id
+    _save_index(vectorstore, lexical_index, chunk_map, logger, snapshot, added=documents_metadata)
+    logger.info(f"Updated metadata for {len(documents_metadata)} documents")
+
+
+def _record_ingest_stats(started: float, files: int, chunks: int, embed_seconds: float, cache_hits: int,
+                         logger: logging.Logger, **extra):
+    elapsed = time.perf_counter() - started
+    tracing.increment("ingested_files_total", files)
+    tracing.increment("ingested_chunks_total", chunks)
+    tracing.registry.observe("ingest.total", elapsed)
+    last_ingest_stats.clear()
+    last_ingest_stats.update({
+        "files": files,
+        "chunks": chunks,
+        "seconds": elapsed,
+        "embed_seconds": embed_seconds,
+        "files_per_s": files / elapsed if elapsed else 0.0,
+        "chunks_per_s": chunks / elapsed if elapsed else 0.0,
+        "embeddings_per_s": chunks / embed_seconds if embed_seconds else 0.0,
+        "embedding_cache_hits": cache_hits,
+        "embedding_cache_hit_ratio": cache_hits / chunks if chunks else 0.0,
+        **extra,
+    })
+    logger.info(
+        f"Ingestion throughput: {last_ingest_stats['files_per_s']:.2f} files/s, "
+        f"{last_ingest_stats['chunks_per_s']:.1f} chunks/s, "
+        f"{last_ingest_stats['embeddings_per_s']:.1f} embeddings/s, "
+        f"embedding cache hit ratio {last_ingest_stats['embedding_cache_hit_ratio']:.1%}"
+    )
+
+
+def _over_memory_ceiling() -> bool:
+    return bool(Config.INGEST_MEMORY_CEILING_MB) and \
+        mmap_store.rss_bytes() > Config.INGEST_MEMORY_CEILING_MB * 1024 * 1024
+
+
+def _ingest_streaming(file_paths: List[str], original_filenames: List[str], logger: logging.Logger, progress=None):
+    """
+    Bounded-memory ingestion: each file is read one page (or text block) at a time, and its
+    chunks are embedded and added to the index in windows of Config.INGEST_WINDOW_CHUNKS, or
+    earlier once the process RSS passes Config.INGEST_MEMORY_CEILING_MB. Only the current
+    window of chunks is held in memory, besides the index itself.
+    """
+    started = time.perf_counter()
+    logger.info(f"Streaming ingestion of {len(file_paths)} file(s)")
+    embeddings = get_embeddings()
+    documents_metadata = [
+        {"doc_id": document_id(file_name), "file_name": file_name} for file_name in original_filenames
+    ]
+    # Windows are added to a private copy of the index, published as one new snapshot version at the end
+    with snapshots.writer(logger) as snapshot:
+        vectorstore, chunk_map, lexical_index = _open_index(embeddings, documents_metadata, logger, snapshot)
+        text_splitter = _text_splitter()
+        total_bytes = sum(os.path.getsize(file_path) for file_path in file_paths) or 1
+        done_bytes = 0
+        totals = {"chunks": 0, "cache_hits": 0, "embed_seconds": 0.0, "windows": 0, "peak_rss_mb": 0.0}
+        window = []
+
+        def flush():
+            nonlocal vectorstore
+            embed_started = time.perf_counter()
+            texts = [chunk.page_content for chunk in window]
+            vectors, hits = _embed_in_batches(embeddings, texts, Config.EMBEDDING_BATCH_SIZE)
+            totals["embed_seconds"] += time.perf_counter() - embed_started
+            chunk_ids = [str(uuid.uuid4()) for _ in window]
+
+            with tracing.span("ingest.index_insert", chunks=len(window)):
+                if vectorstore is None:
+                    # Starts exact, upgrade_vectorstore trains the configured ANN index once every window is in
+                    vectorstore = index_factory.build_vectorstore(
+                        list(zip(texts, vectors)), embeddings, metadatas=[chunk.metadata for chunk in window],
+                        ids=chunk_ids, index_type="flat"
+                    )
+                else:
+                    index_factory.add_vectors(
+                        vectorstore, list(zip(texts, vectors)), metadatas=[chunk.metadata for chunk in window],
+                        ids=chunk_ids
+                    )
+            for chunk, chunk_id in zip(window, chunk_ids):
+                chunk_map["documents"].setdefault(chunk.metadata["doc_id"], []).append(chunk_id)
+            with tracing.span("ingest.lexical_index"):
+                lexical_index.add(chunk_ids, texts)
+
+            totals["chunks"] += len(window)
+            totals["cache_hits"] += hits
+            totals["windows"] += 1
+            totals["peak_rss_mb"] = max(totals["peak_rss_mb"], mmap_store.rss_bytes() / (1024 * 1024))
+            window.clear()
+
+        for file_path, metadata in zip(file_paths, documents_metadata):
+            file_name = metadata["file_name"]
+            size = os.path.getsize(file_path)
+            word_count = 0
+            chunk_count = 0
+            languages = Counter()
+            for document, offset, fraction in load_document_lazy(file_path, logger):
+                word_count += count_words(document.page_content)
+                with tracing.span("ingest.split") as span:
+                    chunks = text_splitter.split_documents([document])
+                    span["chunks"] = len(chunks)
+                for chunk in chunks:
+                    chunk.metadata['source'] = file_name
+                    chunk.metadata['doc_id'] = metadata["doc_id"]
+                    # Text blocks are split separately, their positions are made relative to the whole file
+                    chunk.metadata['start_index'] = chunk.metadata.get('start_index', 0) + offset
+                languages.update(_tag_languages(chunks))
+                chunk_count += len(chunks)
+                window.extend(chunks)
+
+                if len(window) >= Config.INGEST_WINDOW_CHUNKS or (window and _over_memory_ceiling()):
+                    flush()
+                if progress:
+                    read = size * fraction if fraction is not None else 0
+                    progress((done_bytes + read) / total_bytes * 0.95, f"{file_name}: {chunk_count} chunks")
+
+            metadata.update({
+                "content_hash": file_hash(file_path),
+                "word_count": word_count,
+                "chunk_count": chunk_count,
+                "language": majority_language(languages.elements()),
+            })
+            done_bytes += size
+            logger.info(f"Streamed {chunk_count} chunks from {file_name}")
+
+        if window:
+            flush()
+
+        if vectorstore is not None:
+            if progress:
+                progress(0.95, "Saving index")
+            vectorstore = index_factory.upgrade_vectorstore(vectorstore)
+            _finish_ingest(vectorstore, lexical_index, chunk_map, documents_metadata, logger, snapshot)
+        else:
+            snapshot.discard()
+
+    _record_ingest_stats(
+        started, len(documents_metadata), totals["chunks"], totals["embed_seconds"], totals["cache_hits"], logger,
+        windows=totals["windows"], peak_rss_mb=totals["peak_rss_mb"]
+    )
+    if progress:
+        progress(1.0, f"Ingested {len(documents_metadata)} file(s), {totals['chunks']} chunks")
+    return []
+
+
+def _chunk_map_path(index_path: str):
+    # Stored inside the FAISS directory so it is always saved and removed together with the index
+    return os.path.join(index_path, "doc_chunks.json")
+
+
+def _load_base_index(snapshot, embeddings, logger: logging.Logger):
+    """Loads a private copy of the index the snapshot replaces, or returns None if there is none"""
+    index_path = snapshot.base_path(Config.FAISS_INDEX_PATH)
+    if index_path is None or not os.path.exists(index_path):
+        return None
+    # Readers keep using their own copy of the base version until the new one is published
+    logger.info(f"Loading FAISS index of snapshot {snapshot.base}")
+    with tracing.span("ingest.index_load"):
+        return FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
+
+
+def _load_chunk_map(vectorstore, snapshot):
+    """
+    Loads the document id -> chunk ids mapping. Indexes created before the mapping existed
+    are backfilled from the chunk metadata in the docstore.
+    """
+    chunk_map_path = _chunk_map_path(snapshot.base_path(Config.FAISS_INDEX_PATH))
+    if os.path.exists(chunk_map_path):
+        with open(chunk_map_path, "r") as f:
+            return json.load(f)
+
+    chunk_map = {"documents": {}, "deleted_chunks": 0}
+    for chunk_id in vectorstore.index_to_docstore_id.values():
+        metadata = vectorstore.docstore.search(chunk_id).metadata
+        doc_id = metadata.get("doc_id") or document_id(metadata.get("source", ""))
+        chunk_map["documents"].setdefault(doc_id, []).append(chunk_id)
+    return chunk_map
+
+
+def _load_lexical_index(vectorstore, snapshot):
+    lexical_index = lexical.BM25Index.load(snapshot.base_path(Config.BM25_INDEX_PATH))
+    if len(lexical_index) < len(vectorstore.index_to_docstore_id):
+        # The FAISS index predates the lexical index, so backfill it from the docstore
+        lexical_index = lexical.build_from_vectorstore(vectorstore)
+    return lexical_index
+
+
+def _save_index(vectorstore, lexical_index, chunk_map, logger: logging.Logger, snapshot, added=(), removed=()):
+    """
+    Writes the vector store, chunk map and lexical index into the new snapshot version, and
+    its document catalog with the `added` metadata and without the `removed` document ids.
+    Readers switch to all of them at once when the writer publishes it.
+    """
+    index_path = snapshot.path(Config.FAISS_INDEX_PATH)
+    with tracing.span("ingest.index_save"):
+        if Config.LANGUAGE_SHARDING:
+            # Unchanged shards are carried over from the base version, only changed ones are rebuilt
+            # Runs first so language tags backfilled for older chunks are saved with the main index
+            snapshot.inherit(Config.SHARD_INDEX_PATH)
+            shards.sync_shards(snapshot.path(Config.SHARD_INDEX_PATH), vectorstore, logger)
+        vectorstore.save_local(index_path)
+        with open(_chunk_map_path(index_path), 'w') as f:
+            json.dump(chunk_map, f)
+        if Config.INDEX_FORMAT == "mmap":
+            mmap_store.convert(index_path, snapshot.path(Config.MMAP_INDEX_PATH), logger=logger)
+        lexical_index.save(snapshot.path(Config.BM25_INDEX_PATH))
+    logger.info("Vector store saved successfully")
+
+    with catalog.open_for_writing(snapshot, logger) as documents:
+        documents.remove(removed)
+        documents.upsert(added, snapshot.version, ingested_at=time.time())
+
+
+def _rebuild_index(vectorstore):
+    """
+    Rebuilds the FAISS index from its live vectors, renumbered 0..n-1. ANN indexes are
+    retrained on the remaining data, which also drops the vectors HNSW graphs keep for
+    deleted chunks. IVF-PQ vectors are rebuilt from their compressed codes, so they keep
+    the same approximation error.
+    """
+    live = sorted(vectorstore.index_to_docstore_id.items())
+    if live:
+        vectors = index_factory.reconstruct_vectors(vectorstore.index, [label for label, _ in live])
+        vectorstore.index = index_factory.build_index(vectors)
+    else:
+        vectorstore.index = index_factory.create_index(vectorstore.index.d, "flat", 0)
+    vectorstore.index_to_docstore_id = {i: chunk_id for i, (_, chunk_id) in enumerate(live)}
+
+
+def _remove_chunks(vectorstore, lexical_index, chunk_ids):
+    """Removes chunks from the vector store and the lexical index, touching only those vectors"""
+    labels = {chunk_id: label for label, chunk_id in vectorstore.index_to_docstore_id.items()}
+    # Ids missing from the index (e.g. a stale chunk map) are skipped instead of failing the whole delete
+    chunk_ids = [chunk_id for chunk_id in chunk_ids if chunk_id in labels]
+    if not chunk_ids:
+        return
+    texts = [vectorstore.docstore.search(chunk_id).page_content for chunk_id in chunk_ids]
+    with tracing.span("ingest.delete_chunks", chunks=len(chunk_ids)):
+        index_factory.remove_vectors(vectorstore, [labels[chunk_id] for chunk_id in chunk_ids])
+        lexical_index.remove(chunk_ids, texts)
+
+
+def _maybe_compact(vectorstore, chunk_map, logger: logging.Logger):
+    total = len(vectorstore.index_to_docstore_id)
+    if total and chunk_map["deleted_chunks"] >= Config.COMPACTION_DELETED_RATIO * total:
+        logger.info(f"{chunk_map['deleted_chunks']} chunks deleted since last compaction, compacting index")
+        with tracing.span("ingest.compact", chunks=total):
+            _rebuild_index(vectorstore)
+        chunk_map["deleted_chunks"] = 0
+
+
+def delete_document(file_name: str, logger: logging.Logger):
+    """Deletes a single document's vectors, docstore entries, lexical postings and metadata"""
+    doc_id = document_id(file_name)
+    with snapshots.writer(logger) as snapshot:
+        vectorstore = _load_base_index(snapshot, get_embeddings(), logger)
+        if vectorstore is None:
+            raise ValueError(f"Document not found: {file_name}")
+        chunk_map = _load_chunk_map(vectorstore, snapshot)
+        chunk_ids = chunk_map["documents"].pop(doc_id, None)
+        if chunk_ids is None:
+            raise ValueError(f"Document not found: {file_name}")
+
+        lexical_index = _load_lexical_index(vectorstore, snapshot)
+        _remove_chunks(vectorstore, lexical_index, chunk_ids)
+        chunk_map["deleted_chunks"] += len(chunk_ids)
+        _maybe_compact(vectorstore, chunk_map, logger)
+
+        _save_index(vectorstore, lexical_index, chunk_map, logger, snapshot, removed=[doc_id])
+    logger.info(f"Deleted document {file_name} ({len(chunk_ids)} chunks)")
+
+
+def compact_index(logger: logging.Logger):
+    """Rebuilds the index from its live vectors to reclaim space and rebalance ANN indexes after deletions"""
+    with snapshots.writer(logger) as snapshot:
+        vectorstore = _load_base_index(snapshot, get_embeddings(), logger)
+        if vectorstore is None:
+            snapshot.discard()
+            return
+        chunk_map = _load_chunk_map(vectorstore, snapshot)
+        with tracing.span("ingest.compact", chunks=vectorstore.index.ntotal):
+            _rebuild_index(vectorstore)
+        chunk_map["deleted_chunks"] = 0
+        _save_index(vectorstore, _load_lexical_index(vectorstore, snapshot), chunk_map, logger, snapshot)
+    logger.info(f"Compacted index, {vectorstore.index.ntotal} chunks remaining")
+
+
 def clear_ingested_data(logger: logging.Logger):
     """Clear all ingested data"""
     try:
-        if os.path.exists(Config.FAISS_INDEX_PATH):
-            import shutil
-            shutil.rmtree(Config.FAISS_INDEX_PATH)
-            logger.info("Removed FAISS index directory")
+        # An empty version is published, so readers switch to "nothing ingested" in one step
+        # No replaced version is kept, but they are only removed after the grace period, other
+        # processes may still be reading them; later writers remove the rest
+        with snapshots.writer(logger, keep_versions=0):
+            pass
+        logger.info("Published an empty index snapshot")
 
-        if os.path.exists(Config.DOCUMENTS_JSON_PATH):
-            os.remove(Config.DOCUMENTS_JSON_PATH)
-            logger.info("Removed documents metadata file")
+        resources.invalidate()
 
         logger.info("All ingested data cleared successfully")
     except Exception as e:
         logger.error(f"Error clearing ingested data: {e}")
-        raise
\ No newline at end of file
+        raise
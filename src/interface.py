@@ -1,17 +1,40 @@
 import streamlit as st
 import os
-import json
+import hashlib
+import shutil
 import tempfile
 import logging
-from .generator import generate_response
-from .ingest import ingest_documents, clear_ingested_data
+from datetime import datetime
 from .config import Config
 from .logger_setup import setup_logging
+from . import tracing
+from . import warmup
+from . import catalog
 
 
 # Initialize logger at module level
 logger = setup_logging(logging.INFO)
 
+# Serves Prometheus metrics when Config.METRICS_PORT is set
+try:
+    tracing.start_metrics_server()
+except OSError as e:
+    logger.warning(f"Could not start metrics server: {e}")
+
+# Loads the embedding model and the index in the background while the first page renders
+# Generation and ingestion modules are imported only when they are first used
+warmup.start(logger)
+
+
+# Hashes an upload block by block instead of copying its whole content
+def upload_hash(uploaded_file) -> str:
+    digest = hashlib.sha256()
+    uploaded_file.seek(0)
+    for block in iter(lambda: uploaded_file.read(1024 * 1024), b""):
+        digest.update(block)
+    uploaded_file.seek(0)
+    return digest.hexdigest()
+
 
 # Clears the entire chat history
 def clear_chat_history():
@@ -52,6 +75,8 @@ def main():
         # Code in Sidebar here
         with st.sidebar:
             st.header("Configuration")
+            if warmup.status()["state"] == "running":
+                st.caption("Loading the embedding model and index in the background...")
 
             with st.expander("Model Setting"):
                 # Model Selector
@@ -88,17 +113,14 @@ def main():
                     logger.info("Ingest button clicked")
                     if uploaded_files:
                         try:
-                            # Loads previously ingested filenames
-                            ingested_filenames = set()
-                            if os.path.exists(Config.DOCUMENTS_JSON_PATH):
-                                with open(Config.DOCUMENTS_JSON_PATH, "r") as f:
-                                    ingested_docs = json.load(f)
-                                    ingested_filenames = {doc["file_name"] for doc in ingested_docs}
-                                logger.info(f"Found {len(ingested_filenames)} previously ingested files")
-
-                            # Filters out already ingested files so that the existing ones do not ingest again
-                            new_uploaded_files = [f for f in uploaded_files if f.name not in ingested_filenames]
-                            logger.info(f"Found {len(new_uploaded_files)} new files to ingest")
+                            # Filters out files that are already ingested with the same content
+                            # A file with a known name but new content replaces the old version in place
+                            documents = catalog.get_catalog(logger)
+                            new_uploaded_files = [
+                                f for f in uploaded_files
+                                if not documents.is_ingested(f.name, upload_hash(f))
+                            ]
+                            logger.info(f"Found {len(new_uploaded_files)} new or changed files to ingest")
 
                             if not new_uploaded_files:
                                 st.info("All uploaded files are already ingested.")
@@ -110,14 +132,21 @@ def main():
                                     for uploaded_file in new_uploaded_files:
                                         with tempfile.NamedTemporaryFile(delete=False,
                                                                          suffix=f".{uploaded_file.name.split('.')[-1]}") as tmp_file:
-                                            tmp_file.write(uploaded_file.getvalue())
+                                            uploaded_file.seek(0)
+                                            shutil.copyfileobj(uploaded_file, tmp_file, 1024 * 1024)
                                             temp_paths.append(tmp_file.name)
                                             og_names.append(uploaded_file.name)
 
                                     logger.info(f"Created temporary files for {len(temp_paths)} documents")
 
                                     try:
-                                        ingest_documents(temp_paths, og_names, logger)  # <-- pass both lists
+                                        from .ingest import ingest_documents
+                                        progress_bar = st.progress(0.0, text="Starting ingestion...")
+
+                                        def report_progress(fraction, message):
+                                            progress_bar.progress(min(max(fraction, 0.0), 1.0), text=message)
+
+                                        ingest_documents(temp_paths, og_names, logger, progress=report_progress)  # <-- pass both lists
                                         st.success(f"Successfully ingested {len(new_uploaded_files)} new document(s)!")
                                         logger.info(f"Successfully ingested {len(new_uploaded_files)} new document(s)")
                                     except Exception as e:
@@ -144,6 +173,7 @@ def main():
                 if st.button("Clear Data"):
                     logger.info("Clear Data button clicked")
                     try:
+                        from .ingest import clear_ingested_data
                         clear_ingested_data(logger)
                         logger.info("Ingested data cleared")
                         clear_uploaded_files()
@@ -161,22 +191,40 @@ def main():
 
             st.header("Ingested Documents")
             try:
-                if os.path.exists(Config.DOCUMENTS_JSON_PATH):
-                    with open(Config.DOCUMENTS_JSON_PATH, 'r') as f:
-                        docs_metadata = json.load(f)
-
-                    if docs_metadata:
-                        logger.debug(f"Displaying {len(docs_metadata)} ingested documents")
-                        for doc in docs_metadata:
+                documents = catalog.get_catalog(logger)
+                if documents.count():
+                    search = st.text_input("Search documents", key="documents_search", placeholder="File name")
+                    total = documents.count(search)
+                    pages = max(1, -(-total // Config.CATALOG_PAGE_SIZE))
+                    # The page may no longer exist after a new search or a delete
+                    if st.session_state.get("documents_page", 1) > pages:
+                        st.session_state["documents_page"] = pages
+                    page = st.number_input("Page", min_value=1, max_value=pages, key="documents_page") \
+                        if pages > 1 else 1
+
+                    docs_metadata = documents.list(
+                        offset=(page - 1) * Config.CATALOG_PAGE_SIZE, limit=Config.CATALOG_PAGE_SIZE, search=search
+                    )
+                    logger.debug(f"Displaying {len(docs_metadata)} of {total} ingested documents")
+                    st.caption(f"{total} document(s)")
+                    for doc in docs_metadata:
+                        name_col, delete_col = st.columns([4, 1])
+                        with name_col:
                             st.write(f"   **{doc['file_name']}**")
-                            st.write(f"   - Words: {doc['word_count']}")
-                            st.write(f"   - Language: {doc['language']}")
-                    else:
-                        st.write("No documents ingested yet.")
-                        logger.debug("No documents in metadata file")
+                        with delete_col:
+                            # Removes only this document's chunks from the index
+                            if st.button("🗑️", key=f"delete_{doc['file_name']}", help="Delete this document"):
+                                logger.info(f"Delete button clicked for {doc['file_name']}")
+                                from .ingest import delete_document
+                                delete_document(doc['file_name'], logger)
+                                st.rerun()
+                        st.write(f"   - Words: {doc['word_count']}")
+                        st.write(f"   - Language: {doc['language']}")
+                        if doc['ingested_at']:
+                            st.write(f"   - Ingested: {datetime.fromtimestamp(doc['ingested_at']):%Y-%m-%d %H:%M}")
                 else:
                     st.write("No documents ingested yet.")
-                    logger.debug("Documents metadata file does not exist")
+                    logger.debug("No documents in the catalog")
             except Exception as e:
                 error_msg = f"Error reading ingested documents: {str(e)}"
                 st.error(error_msg)
@@ -208,20 +256,44 @@ def main():
                 st.markdown(prompt)
 
             with st.chat_message("assistant"):
-                with st.spinner("Thinking..."):
-                    if selected_model != "Local" and not api_key:
-                        response = f"Please provide an API key for {selected_model}."
-                        logger.warning(f"No API key provided for {selected_model} model")
-                    else:
-                        try:
-                            logger.info(f"Generating response using {selected_model} model")
-                            response = generate_response(selected_model, prompt, api_key)
-                            logger.info(f"Successfully generated response (length: {len(response)} characters)")
-                        except Exception as e:
-                            response = f"Error generating response: {str(e)}"
-                            logger.error(f"Error generating response: {str(e)}", exc_info=True)
-
+                if selected_model != "Local" and not api_key:
+                    response = f"Please provide an API key for {selected_model}."
+                    logger.warning(f"No API key provided for {selected_model} model")
                     st.markdown(response)
+                else:
+                    response = ""
+                    sources_placeholder = st.empty()
+                    placeholder = st.empty()
+                    try:
+                        logger.info(f"Generating response using {selected_model} model")
+                        with st.spinner("Searching documents..."):
+                            from .generator import stream_response
+                            events = stream_response(selected_model, prompt, api_key, logger)
+                            sources_event = next(events)
+
+                        # Sources are shown first, then the answer is rendered token by token
+                        sources = sorted({doc.metadata.get("source", "unknown") for doc in sources_event["documents"]})
+                        if sources:
+                            sources_placeholder.caption("Sources: " + ", ".join(sources))
+
+                        for event in events:
+                            if event["type"] == "token":
+                                response += event["text"]
+                                placeholder.markdown(response + "▌")
+                            elif event["type"] == "done":
+                                response = event["answer"]
+                                time_to_first_token = event["time_to_first_token"]
+                                if time_to_first_token is not None:
+                                    st.caption(f"First token in {time_to_first_token:.2f}s · "
+                                               f"{event['prompt_tokens']} prompt tokens")
+                                    logger.info(f"Time to first token: {time_to_first_token:.3f}s")
+
+                        logger.info(f"Successfully generated response (length: {len(response)} characters)")
+                    except Exception as e:
+                        response = f"Error generating response: {str(e)}"
+                        logger.error(f"Error generating response: {str(e)}", exc_info=True)
+
+                    placeholder.markdown(response)
 
             st.session_state.messages.append({"role": "assistant", "content": response})
             logger.debug("Added assistant response to chat history")
@@ -0,0 +1,70 @@
+import re
+from collections import Counter
+from typing import List
+from .config import Config
+
+UNKNOWN = "unknown"
+
+_DEVANAGARI_RE = re.compile(r"[\u0900-\u097F]")
+_LETTER_RE = re.compile(r"[^\W\d_]")
+
+
+def _langdetect():
+    # Imported on first use, and seeded so detection gives the same answer in every worker process
+    import langdetect
+    langdetect.DetectorFactory.seed = 0
+    return langdetect
+
+
+def _script_language(text: str):
+    # Devanagari text is tagged as Hindi from its script alone, which is much cheaper than langdetect
+    letters = len(_LETTER_RE.findall(text))
+    if letters and len(_DEVANAGARI_RE.findall(text)) / letters >= 0.5:
+        return "hi"
+    return None
+
+
+def detect_language(text: str):
+    """Returns (language, probability) for a text, or (UNKNOWN, 0.0) if it has no detectable language"""
+    language = _script_language(text)
+    if language:
+        return language, 1.0
+    langdetect = _langdetect()
+    try:
+        best = langdetect.detect_langs(text)[0]
+    except langdetect.LangDetectException:
+        return UNKNOWN, 0.0
+    return best.lang, best.prob
+
+
+def detect_languages(texts: List[str], batch_size: int = None) -> List[str]:
+    """
+    Tags each text (chunk) with its language. Consecutive chunks are detected in batches:
+    one langdetect call on the concatenated batch, and only batches that don't come out as a
+    single confident language fall back to one call per chunk. Devanagari chunks are always
+    tagged per chunk from their script, and chunks too short to classify take the batch language.
+    """
+    batch_size = batch_size or Config.LANGDETECT_BATCH_SIZE
+    languages = []
+    for start in range(0, len(texts), batch_size):
+        batch = texts[start:start + batch_size]
+        scripts = [_script_language(text) for text in batch]
+        rest = [text for text, script in zip(batch, scripts) if script is None]
+
+        batch_language, probability = detect_language("\n".join(rest)) if rest else (UNKNOWN, 0.0)
+        mixed = probability < Config.LANGDETECT_BATCH_CONFIDENCE
+        for text, script in zip(batch, scripts):
+            if script:
+                languages.append(script)
+            elif mixed and len(text) >= Config.LANGDETECT_MIN_CHARS:
+                language = detect_language(text)[0]
+                languages.append(batch_language if language == UNKNOWN else language)
+            else:
+                languages.append(batch_language)
+    return languages
+
+
+def majority_language(languages) -> str:
+    """The most common known language of a document's chunks"""
+    counts = Counter(language for language in languages if language != UNKNOWN)
+    return counts.most_common(1)[0][0] if counts else UNKNOWN
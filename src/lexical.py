@@ -0,0 +1,152 @@
+import os
+import re
+import json
+import math
+import heapq
+import unicodedata
+from collections import Counter
+from typing import List
+from .config import Config
+from . import snapshots
+
+# Words are runs of letters/digits plus the Devanagari block, so vowel signs (matras) and
+# the virama stay inside Hindi words instead of splitting them
+_TOKEN_RE = re.compile(r"[\w\u0900-\u097F]+")
+_DEVANAGARI_RE = re.compile(r"[\u0900-\u097F]")
+# French elisions such as l', d', qu' are dropped so "l'entreprise" matches "entreprise"
+_ELISION_RE = re.compile(r"\b(?:qu|[cdjlmnst])['’]", re.IGNORECASE)
+
+STOPWORDS = {
+    # English
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "how", "in", "is", "it", "of",
+    "on", "or", "that", "the", "to", "was", "we", "what", "when", "where", "which", "who", "with",
+    # French
+    "au", "aux", "ce", "ces", "dans", "de", "des", "du", "en", "est", "et", "la", "le", "les",
+    "ou", "par", "pour", "quel", "quelle", "qui", "sont", "sur", "un", "une",
+    # Spanish
+    "al", "como", "con", "cual", "del", "el", "es", "las", "los", "para", "por", "que", "se",
+    "su", "una", "y",
+    # Hindi
+    "का", "की", "के", "को", "में", "है", "हैं", "और", "से", "पर", "यह", "क्या", "कौन", "कब", "था", "थे",
+}
+
+
+def _fold_accents(token: str) -> str:
+    # Only Latin-script tokens are folded, Devanagari combining marks carry meaning
+    if _DEVANAGARI_RE.search(token):
+        return unicodedata.normalize("NFC", token)
+    decomposed = unicodedata.normalize("NFKD", token)
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercases, strips French elisions and Latin accents, and drops common stopwords"""
+    text = _ELISION_RE.sub(" ", text.lower())
+    tokens = []
+    for token in _TOKEN_RE.findall(text):
+        token = _fold_accents(token)
+        if token and token not in STOPWORDS:
+            tokens.append(token)
+    return tokens
+
+
+class BM25Index:
+    """
+    In-process BM25 inverted index over chunk texts, keyed by the same chunk ids as the
+    FAISS docstore so lexical and dense hits can be fused. Built incrementally during ingestion.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}  # term -> {chunk_id: term frequency}
+        self.doc_lengths = {}  # chunk_id -> number of tokens
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def add(self, chunk_ids: List[str], texts: List[str]):
+        for chunk_id, text in zip(chunk_ids, texts):
+            tokens = tokenize(text)
+            self.doc_lengths[chunk_id] = len(tokens)
+            self.total_length += len(tokens)
+            for term, frequency in Counter(tokens).items():
+                self.postings.setdefault(term, {})[chunk_id] = frequency
+
+    def remove(self, chunk_ids: List[str], texts: List[str]):
+        """Removes chunks, given the same texts they were added with"""
+        for chunk_id, text in zip(chunk_ids, texts):
+            length = self.doc_lengths.pop(chunk_id, None)
+            if length is None:
+                continue
+            self.total_length -= length
+            for term in set(tokenize(text)):
+                postings = self.postings.get(term)
+                if postings is not None:
+                    postings.pop(chunk_id, None)
+                    if not postings:
+                        del self.postings[term]
+
+    def search(self, query: str, k: int = 4):
+        """Returns up to k (chunk_id, score) pairs, best first"""
+        n_docs = len(self.doc_lengths)
+        if not n_docs:
+            return []
+        average_length = self.total_length / n_docs
+
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, frequency in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[chunk_id] / average_length)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def save(self, path: str = None):
+        path = path or snapshots.path(Config.BM25_INDEX_PATH)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "k1": self.k1,
+                "b": self.b,
+                "postings": self.postings,
+                "doc_lengths": self.doc_lengths,
+            }, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str = None):
+        """Loads the index from disk (by default of the current snapshot), or returns an empty one if it doesn't exist yet"""
+        path = path or snapshots.path(Config.BM25_INDEX_PATH)
+        index = cls()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            index.k1, index.b = data["k1"], data["b"]
+            index.postings = data["postings"]
+            index.doc_lengths = data["doc_lengths"]
+            index.total_length = sum(index.doc_lengths.values())
+        return index
+
+
+def build_from_vectorstore(vectorstore) -> BM25Index:
+    """Builds a BM25 index from every chunk in a FAISS vectorstore's docstore"""
+    index = BM25Index()
+    chunk_ids = list(vectorstore.index_to_docstore_id.values())
+    index.add(chunk_ids, [vectorstore.docstore.search(chunk_id).page_content for chunk_id in chunk_ids])
+    return index
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[str]:
+    """Fuses several ranked id lists into one, scoring each id by sum(1 / (k + rank))"""
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
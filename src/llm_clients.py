@@ -0,0 +1,187 @@
+import math
+import time
+import hashlib
+import logging
+import threading
+from collections import deque
+from langchain_core.callbacks import BaseCallbackHandler
+from .config import Config
+from .cache import LRUCache
+from . import tracing
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+CLOUD_PROVIDERS = ("OpenAI", "Google", "Anthropic")
+PROVIDERS = CLOUD_PROVIDERS + ("Local",)
+
+# Chat models hold their HTTP clients, so reusing them reuses the open (TLS) connections
+_pool = LRUCache(Config.LLM_CLIENT_POOL_SIZE)
+_pool_lock = threading.RLock()  # Re-entered when a client is built with its Local fallback
+
+_stats_lock = threading.Lock()
+_latencies = {}  # provider -> recent call durations in seconds
+_counts = {}  # provider -> {"calls": n, "errors": n}
+
+
+class LatencyRecorder(BaseCallbackHandler):
+    """Records the duration and outcome of every call made through a pooled client, per provider"""
+
+    # Called in the caller's thread, also for async calls, so no executor hop per callback
+    run_inline = True
+
+    def __init__(self, provider: str):
+        self.provider = provider
+        self._started = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            _record(self.provider, time.perf_counter() - started, error=False)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            _record(self.provider, time.perf_counter() - started, error=True)
+        logger.warning(f"{self.provider} call failed: {error}")
+
+
+def _record(provider: str, seconds: float, error: bool):
+    with _stats_lock:
+        latencies = _latencies.get(provider)
+        if latencies is None:
+            latencies = _latencies[provider] = deque(maxlen=Config.LLM_LATENCY_WINDOW)
+            _counts[provider] = {"calls": 0, "errors": 0}
+        latencies.append(seconds)
+        _counts[provider]["calls"] += 1
+        _counts[provider]["errors"] += int(error)
+    tracing.registry.observe(f"llm.{provider}", seconds)
+    tracing.increment("llm_calls_total", provider=provider, outcome="error" if error else "ok")
+
+
+def _percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def latency_stats() -> dict:
+    """Call counts, error rate and latency percentiles (over the last LLM_LATENCY_WINDOW calls) per provider"""
+    with _stats_lock:
+        snapshot = {provider: (list(latencies), dict(_counts[provider])) for provider, latencies in _latencies.items()}
+    stats = {}
+    for provider, (latencies, counts) in snapshot.items():
+        stats[provider] = {
+            **counts,
+            "error_rate": counts["errors"] / counts["calls"] if counts["calls"] else 0.0,
+            "mean_seconds": sum(latencies) / len(latencies),
+            "p50_seconds": _percentile(latencies, 0.5),
+            "p95_seconds": _percentile(latencies, 0.95),
+            "max_seconds": max(latencies),
+        }
+    return stats
+
+
+def _transient_errors(model_name: str):
+    """Exceptions that mean the provider is slow or unavailable rather than that the request is wrong"""
+    # Timeouts are connection errors in both SDKs
+    if model_name == "OpenAI":
+        import openai
+        return (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+    if model_name == "Anthropic":
+        import anthropic
+        return (anthropic.APIConnectionError, anthropic.RateLimitError, anthropic.InternalServerError)
+    if model_name == "Google":
+        from google.api_core import exceptions
+        return (exceptions.DeadlineExceeded, exceptions.ServiceUnavailable, exceptions.ResourceExhausted,
+                exceptions.InternalServerError)
+    import requests
+    return (requests.ConnectionError, requests.Timeout)
+
+
+# Code to build the chat model of a provider, with the configured timeout and retries
+# Provider SDKs are imported on first use, most sessions only ever need one of them
+def _create(model_name: str, api_key: str = None):
+    callbacks = [LatencyRecorder(model_name)]
+    if model_name == "OpenAI":
+        from langchain_openai import ChatOpenAI
+        # The SDK retries timeouts, connection errors, 429 and 5xx with exponential backoff and jitter
+        return ChatOpenAI(
+            model="gpt-3.5-turbo", api_key=api_key, base_url=Config.OPENAI_BASE_URL,
+            timeout=Config.LLM_TIMEOUT_SECONDS, max_retries=Config.LLM_MAX_RETRIES, callbacks=callbacks
+        )
+    elif model_name == "Google":
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        endpoint = {"client_options": {"api_endpoint": Config.GOOGLE_API_ENDPOINT}, "transport": "rest"} \
+            if Config.GOOGLE_API_ENDPOINT else {}
+        return ChatGoogleGenerativeAI(
+            model="gemini-1.5-flash", api_key=api_key, timeout=Config.LLM_TIMEOUT_SECONDS,
+            max_retries=Config.LLM_MAX_RETRIES, callbacks=callbacks, **endpoint
+        )
+    elif model_name == "Anthropic":
+        from langchain_anthropic import ChatAnthropic
+        return ChatAnthropic(
+            model="claude-2", api_key=api_key, base_url=Config.ANTHROPIC_BASE_URL,
+            default_request_timeout=Config.LLM_TIMEOUT_SECONDS, max_retries=Config.LLM_MAX_RETRIES,
+            callbacks=callbacks
+        )
+    elif model_name == "Local":
+        from langchain_community.chat_models import ChatOllama
+        # ChatOllama only takes whole seconds
+        llm = ChatOllama(
+            model="llama3", base_url=Config.OLLAMA_BASE_URL, timeout=math.ceil(Config.LLM_TIMEOUT_SECONDS),
+            callbacks=callbacks
+        )
+        # The Ollama client has no retries of its own
+        if Config.LLM_MAX_RETRIES:
+            llm = llm.with_retry(
+                retry_if_exception_type=_transient_errors(model_name), wait_exponential_jitter=True,
+                stop_after_attempt=Config.LLM_MAX_RETRIES + 1
+            )
+        return llm
+    else:
+        raise ValueError("Unsupported LLM model")
+
+
+def _pool_key(model_name: str, api_key: str = None):
+    # The key is hashed so the pool doesn't index clients by plain-text secrets
+    key_hash = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16] if api_key else None
+    return (
+        model_name, key_hash, Config.LLM_TIMEOUT_SECONDS, Config.LLM_MAX_RETRIES, Config.LLM_FALLBACK_TO_LOCAL,
+        Config.OPENAI_BASE_URL, Config.ANTHROPIC_BASE_URL, Config.GOOGLE_API_ENDPOINT, Config.OLLAMA_BASE_URL,
+    )
+
+
+def get_client(model_name: str, api_key: str = None):
+    """
+    Returns the pooled chat model for a provider and API key, creating it on first use. With
+    Config.LLM_FALLBACK_TO_LOCAL set, cloud providers fall back to the Local model when they
+    time out or are unavailable after their retries.
+    """
+    key = _pool_key(model_name, api_key)
+    with _pool_lock:
+        client = _pool.get(key)
+        if client is None:
+            client = _create(model_name, api_key)
+            if Config.LLM_FALLBACK_TO_LOCAL and model_name in CLOUD_PROVIDERS:
+                client = client.with_fallbacks(
+                    [get_client("Local")], exceptions_to_handle=_transient_errors(model_name)
+                )
+            _pool.put(key, client)
+            logger.info(f"Created {model_name} client ({len(_pool)} pooled)")
+    return client
+
+
+def pool_stats() -> dict:
+    return _pool.stats()
+
+
+def clear():
+    """Drops every pooled client, e.g. after changing endpoints or keys"""
+    with _pool_lock:
+        _pool.clear()
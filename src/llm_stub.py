@@ -0,0 +1,138 @@
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+ANSWER = "This is a canned answer from the stub server."
+
+
+class StubSettings:
+    """Behaviour of the stub, can be changed while it is running"""
+
+    def __init__(self, delay_seconds: float = 0.0, failure_rate: float = 0.0, failure_status: int = 503,
+                 answer: str = ANSWER, fail_first: int = 0):
+        self.delay_seconds = delay_seconds
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.fail_first = fail_first  # The first n requests fail, for deterministic retry tests
+        self.answer = answer
+        self.requests = 0
+
+
+def _handler(settings: StubSettings):
+    class StubHandler(BaseHTTPRequestHandler):
+        """OpenAI chat completions (/v1/chat/completions) and Ollama chat (/api/chat), plain or streamed"""
+
+        protocol_version = "HTTP/1.1"  # Keep-alive, so clients can reuse their connections
+
+        def _send(self, status: int, body: bytes, content_type: str = "application/json"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_stream(self, content_type: str, parts):
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for part in parts:
+                data = part.encode("utf-8")
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.write(b"0\r\n\r\n")
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            settings.requests += 1
+            failed = settings.requests <= settings.fail_first or random.random() < settings.failure_rate
+            time.sleep(settings.delay_seconds)
+
+            model = request.get("model", "stub")
+            words = settings.answer.split(" ")
+            tokens = [word if i == 0 else " " + word for i, word in enumerate(words)]
+            try:
+                if failed:
+                    self._send(settings.failure_status, json.dumps({"error": {"message": "stub failure"}}).encode("utf-8"))
+                elif self.path.endswith("/chat/completions"):
+                    self._openai(model, tokens, request.get("stream", False))
+                elif self.path == "/api/chat":
+                    self._ollama(model, tokens, request.get("stream", True))
+                else:
+                    self._send(404, b'{"error": "not found"}')
+            except (BrokenPipeError, ConnectionResetError):
+                # The client gave up, e.g. its timeout is shorter than the configured delay
+                logger.debug("Client disconnected before the answer was sent")
+
+        def _openai(self, model: str, tokens, stream: bool):
+            completion = {"id": "chatcmpl-stub", "created": int(time.time()), "model": model}
+            if not stream:
+                body = {**completion, "object": "chat.completion", "choices": [{
+                    "index": 0, "message": {"role": "assistant", "content": settings.answer}, "finish_reason": "stop"
+                }], "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)}}
+                self._send(200, json.dumps(body).encode("utf-8"))
+                return
+            chunks = [{**completion, "object": "chat.completion.chunk", "choices": [{
+                "index": 0, "delta": {"content": token}, "finish_reason": None
+            }]} for token in tokens]
+            chunks.append({**completion, "object": "chat.completion.chunk", "choices": [{
+                "index": 0, "delta": {}, "finish_reason": "stop"
+            }]})
+            self._send_stream(
+                "text/event-stream", [f"data: {json.dumps(chunk)}\n\n" for chunk in chunks] + ["data: [DONE]\n\n"]
+            )
+
+        def _ollama(self, model: str, tokens, stream: bool):
+            created_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+            done = {"model": model, "created_at": created_at, "message": {"role": "assistant", "content": ""},
+                    "done": True, "done_reason": "stop"}
+            if not stream:
+                done["message"]["content"] = settings.answer
+                self._send(200, json.dumps(done).encode("utf-8"))
+                return
+            lines = [json.dumps({"model": model, "created_at": created_at,
+                                 "message": {"role": "assistant", "content": token}, "done": False})
+                     for token in tokens]
+            self._send_stream("application/x-ndjson", [line + "\n" for line in lines + [json.dumps(done)]])
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return StubHandler
+
+
+def start(port: int = 0, settings: StubSettings = None):
+    """Starts the stub in a daemon thread and returns (server, settings), the port is server.server_port"""
+    settings = settings or StubSettings()
+    server = ThreadingHTTPServer(("127.0.0.1", port), _handler(settings))
+    threading.Thread(target=server.serve_forever, name="llm-stub", daemon=True).start()
+    return server, settings
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Stub LLM server speaking the OpenAI and Ollama chat APIs, for testing timeouts, retries and fallback"
+    )
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds to wait before answering every request")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of requests answered with an error")
+    parser.add_argument("--failure-status", type=int, default=503)
+    parser.add_argument("--fail-first", type=int, default=0, help="Answer the first n requests with an error")
+    args = parser.parse_args()
+
+    settings = StubSettings(args.delay, args.failure_rate, args.failure_status, fail_first=args.fail_first)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), _handler(settings))
+    print(f"Stub LLM server on http://127.0.0.1:{args.port} "
+          f"(OPENAI_BASE_URL=http://127.0.0.1:{args.port}/v1, OLLAMA_BASE_URL=http://127.0.0.1:{args.port})")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@ def setup_logging(log_level=logging.INFO):
     """
     Sets up logging for chatbot application.
     Logs are then saved to logs/rag_chatbot.log and also printed in the console.
+    Per-stage trace spans are saved as JSON lines to logs/traces.jsonl.
     The log directory will be created if it doesn't exist.
 
     Args:
@@ -36,4 +37,12 @@ def setup_logging(log_level=logging.INFO):
     logger.addHandler(file_handler)
     logger.addHandler(console_handler)
 
+    # Structured span events from tracing.py are written as JSON lines to their own file
+    trace_logger = logging.getLogger("rag_chatbot.trace")
+    trace_logger.setLevel(logging.INFO)
+    trace_logger.propagate = False
+    trace_handler = logging.FileHandler(os.path.join(log_dir, "traces.jsonl"))
+    trace_handler.setFormatter(logging.Formatter("%(message)s"))
+    trace_logger.addHandler(trace_handler)
+
     return logger
\ No newline at end of file
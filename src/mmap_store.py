@@ -0,0 +1,260 @@
+import os
+import sys
+import json
+import time
+import pickle
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import threading
+import subprocess
+import logging
+from collections.abc import Mapping
+import numpy as np
+import faiss
+from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.base import Docstore
+from langchain.schema import Document
+from .config import Config
+from . import snapshots
+from . import index_factory
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "docstore.sqlite"
+
+
+class SQLiteDocstore(Docstore):
+    """
+    Read-only docstore backed by a SQLite file. Chunks are fetched lazily by id, so only
+    the top-k hits of a search are ever read from disk and nothing is unpickled.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+
+    def search(self, search: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT page_content, metadata FROM chunks WHERE doc_id = ?", (search,)
+            ).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(page_content=row[0], metadata=json.loads(row[1]))
+
+    def id_at(self, position: int):
+        with self._lock:
+            row = self._conn.execute("SELECT doc_id FROM chunks WHERE position = ?", (position,)).fetchone()
+        if row is None:
+            raise KeyError(position)
+        return row[0]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def iter_ids(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT position, doc_id FROM chunks ORDER BY position").fetchall()
+        return rows
+
+    def add(self, texts):
+        raise NotImplementedError("The memory-mapped index is read-only, ingest into the pickle index and convert")
+
+    def delete(self, ids):
+        raise NotImplementedError("The memory-mapped index is read-only, ingest into the pickle index and convert")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SQLiteIdMap(Mapping):
+    """Lazy FAISS label -> docstore id mapping, so the id table is never loaded into memory"""
+
+    def __init__(self, docstore: SQLiteDocstore):
+        self._docstore = docstore
+
+    def __getitem__(self, position):
+        return self._docstore.id_at(int(position))
+
+    def __iter__(self):
+        return (position for position, _ in self._docstore.iter_ids())
+
+    def __len__(self):
+        return self._docstore.count()
+
+    def items(self):
+        return self._docstore.iter_ids()
+
+    def values(self):
+        return [doc_id for _, doc_id in self._docstore.iter_ids()]
+
+
+def read_index_mmap(index_path: str):
+    """Opens a FAISS index read-only through mmap, falling back to a normal read if the index type can't be mapped"""
+    try:
+        return faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError as e:
+        logger.warning(f"Index can't be memory-mapped ({e}), reading it into memory instead")
+        return faiss.read_index(index_path)
+
+
+def load_vectorstore(embeddings, path: str = None):
+    """Loads the memory-mapped index and SQLite docstore as a LangChain FAISS vectorstore, by default of the current snapshot"""
+    path = path or snapshots.path(Config.MMAP_INDEX_PATH)
+    index = read_index_mmap(os.path.join(path, INDEX_FILE))
+    docstore = SQLiteDocstore(os.path.join(path, DOCSTORE_FILE))
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=SQLiteIdMap(docstore),
+    )
+
+
+def convert(src_path: str, dst_path: str, logger: logging.Logger = logger):
+    """
+    One-shot converter from a FAISS.save_local directory (index.faiss + index.pkl) to the
+    memory-mapped format. The new directory is built next to the target and swapped in, so
+    the target must not be in a published snapshot version (see convert_current).
+    """
+    started = time.perf_counter()
+
+    index = faiss.read_index(os.path.join(src_path, "index.faiss"))
+    with open(os.path.join(src_path, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+
+    tmp_path = dst_path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    faiss.write_index(index, os.path.join(tmp_path, INDEX_FILE))
+
+    conn = sqlite3.connect(os.path.join(tmp_path, DOCSTORE_FILE))
+    conn.execute(
+        "CREATE TABLE chunks (position INTEGER PRIMARY KEY, doc_id TEXT NOT NULL UNIQUE, "
+        "page_content TEXT NOT NULL, metadata TEXT NOT NULL)"
+    )
+    rows = []
+    for position, doc_id in index_to_docstore_id.items():
+        doc = docstore.search(doc_id)
+        rows.append((int(position), doc_id, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False)))
+    conn.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+    shutil.rmtree(dst_path, ignore_errors=True)
+    os.replace(tmp_path, dst_path)
+    logger.info(f"Converted {len(rows)} chunks to memory-mapped format in {time.perf_counter() - started:.2f}s")
+    return dst_path
+
+
+def convert_current(logger: logging.Logger = logger) -> str:
+    """
+    Converts the current index, published as a new snapshot version under the writer lock
+    with everything else carried over, like every other index change. Returns the new
+    memory-mapped directory.
+    """
+    with snapshots.writer(logger) as snapshot:
+        src_path = snapshot.base_path(Config.FAISS_INDEX_PATH)
+        if src_path is None or not os.path.exists(src_path):
+            raise ValueError("No index found, ingest some documents first.")
+        for name in snapshots.index_names():
+            if name != Config.MMAP_INDEX_PATH:
+                snapshot.inherit(name)
+        return convert(src_path, snapshot.path(Config.MMAP_INDEX_PATH), logger=logger)
+
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _measure(index_format: str, path: str, k: int = 4) -> dict:
+    """Loads the index in the given format from `path` and runs one search, measuring time and RSS growth"""
+    rss_before = rss_bytes()
+    started = time.perf_counter()
+    if index_format == "mmap":
+        vectorstore = load_vectorstore(None, path)
+    else:
+        vectorstore = FAISS.load_local(path, None, allow_dangerous_deserialization=True)
+    load_seconds = time.perf_counter() - started
+
+    query = np.random.default_rng(0).standard_normal(vectorstore.index.d).astype(np.float32)
+    started = time.perf_counter()
+    _, labels = index_factory.search(vectorstore, query[None, :], k)
+    for label in labels[0]:
+        if label != -1:
+            vectorstore.docstore.search(vectorstore.index_to_docstore_id[int(label)])
+    search_seconds = time.perf_counter() - started
+
+    return {
+        "format": index_format,
+        "load_ms": load_seconds * 1000,
+        "first_search_ms": search_seconds * 1000,
+        "rss_delta_mb": (rss_bytes() - rss_before) / (1024 * 1024),
+    }
+
+
+def compare_formats() -> list:
+    """
+    Measures each format of the current index in a fresh interpreter so RSS figures don't
+    contaminate each other. Without memory-mapped files the index is converted into a
+    temporary directory for the measurement, the published version is only read.
+    """
+    version = snapshots.current()
+    pickle_path = snapshots.path(Config.FAISS_INDEX_PATH, version) if version else None
+    if pickle_path is None or not os.path.exists(pickle_path):
+        raise ValueError("No index found, ingest some documents first.")
+    mmap_path = snapshots.path(Config.MMAP_INDEX_PATH, version)
+    tmp_dir = None
+    if not os.path.exists(os.path.join(mmap_path, INDEX_FILE)):
+        tmp_dir = tempfile.mkdtemp(prefix="faiss_mmap_")
+        mmap_path = convert(pickle_path, os.path.join(tmp_dir, Config.MMAP_INDEX_PATH))
+
+    results = []
+    try:
+        for index_format, path in (("pickle", pickle_path), ("mmap", mmap_path)):
+            output = subprocess.run(
+                [sys.executable, "-m", "src.mmap_store", "measure", index_format, path],
+                check=True, capture_output=True, text=True
+            ).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory-mapped FAISS index tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("convert", help="Add the memory-mapped format to the current index, as a new snapshot version")
+    subparsers.add_parser("compare", help="Compare load time and RSS of both formats")
+    measure = subparsers.add_parser("measure")
+    measure.add_argument("format", choices=["pickle", "mmap"])
+    measure.add_argument("path")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        print(convert_current())
+    elif args.command == "compare":
+        print(json.dumps(compare_formats(), indent=2))
+    else:
+        print(json.dumps(_measure(args.format, args.path)))
+
+
+if __name__ == "__main__":
+    main()
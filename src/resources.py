@@ -0,0 +1,247 @@
+import os
+import weakref
+import threading
+import logging
+from langchain_community.vectorstores import FAISS
+from .config import Config
+from . import index_factory
+from . import mmap_store
+from . import shards
+from . import snapshots
+from . import lexical
+from . import tracing
+from . import embedding_backends
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# Process-wide shared resources, guarded by a single re-entrant lock so concurrent
+# Streamlit sessions never load the model or the index twice
+_lock = threading.RLock()
+_embeddings = None
+_index = None  # LoadedIndex of the version in memory
+_load_lock = threading.Lock()  # Held while a snapshot version is read from disk
+
+_stats = {
+    "embedding_loads": 0,
+    "embedding_hits": 0,
+    "index_loads": 0,
+    "index_reloads": 0,
+    "index_hits": 0,
+    "index_stale_hits": 0,  # Queries served from the previous version while a new one was loading
+    "index_misses": 0,
+}
+
+
+class LoadedIndex:
+    """
+    One snapshot version in memory: its vectorstore and its BM25 index, which is loaded on
+    first use. Callers keep the object for a whole query, so the dense and lexical hits,
+    the chunk lookups and the cache keys all come from the same version even if a newer
+    one is loaded meanwhile. The version stays pinned until the last reference is dropped.
+    """
+
+    def __init__(self, version: str, vectorstore):
+        self.version = version
+        self.vectorstore = vectorstore
+        self._lexical_index = None
+        self._lock = threading.Lock()
+        snapshots.pin(version)
+        weakref.finalize(self, snapshots.unpin, version)
+
+    def lexical_index(self):
+        with self._lock:
+            if self._lexical_index is None:
+                self._lexical_index = lexical.BM25Index.load(snapshots.path(Config.BM25_INDEX_PATH, self.version))
+            return self._lexical_index
+
+
+def _index_files(version: str):
+    """Returns the directory and file names of a version's index in the configured on-disk format"""
+    if Config.INDEX_FORMAT == "mmap":
+        return snapshots.path(Config.MMAP_INDEX_PATH, version), (mmap_store.INDEX_FILE, mmap_store.DOCSTORE_FILE)
+    return snapshots.path(Config.FAISS_INDEX_PATH, version), ("index.faiss", "index.pkl")
+
+
+def index_version():
+    """
+    Returns the current index snapshot version (see snapshots.py), or None if it holds no
+    index in the configured format. Every ingest, delete or clear publishes a new version,
+    so it can be compared against the version that is currently loaded in memory.
+    """
+    version = snapshots.current()
+    return version if version is not None and _has_index(version) else None
+
+
+def _has_index(version: str) -> bool:
+    if Config.LANGUAGE_SHARDING:
+        return os.path.exists(os.path.join(snapshots.path(Config.SHARD_INDEX_PATH, version), shards.MANIFEST_FILE))
+    index_path, file_names = _index_files(version)
+    return all(os.path.exists(os.path.join(index_path, file_name)) for file_name in file_names)
+
+
+def get_embeddings():
+    """Returns the shared embedding model, loading it on first use"""
+    global _embeddings
+    with _lock:
+        if _embeddings is not None:
+            _stats["embedding_hits"] += 1
+            return _embeddings
+
+        # Set environment variables to force CPU usage
+        os.environ['CUDA_VISIBLE_DEVICES'] = ''
+        os.environ['PYTORCH_CUDA_ALLOC_CONF'] = 'max_split_size_mb:128'
+
+        logger.info(f"Loading embedding model: {Config.EMBEDDING_MODEL} ({Config.EMBEDDING_BACKEND} backend)")
+        with tracing.span("embedding.model_load", backend=Config.EMBEDDING_BACKEND):
+            # The backends import sentence-transformers and torch only here
+            _embeddings = embedding_backends.create_embeddings()
+        _stats["embedding_loads"] += 1
+        return _embeddings
+
+
+def set_embeddings(embeddings):
+    """Replaces the shared embedding model, e.g. with an offline stand-in for benchmarks"""
+    global _embeddings
+    with _lock:
+        _embeddings = embeddings
+        invalidate()
+
+
+def _needs_conversion(version: str) -> bool:
+    """True when the version has a main index but no shards or mmap files in the configured format yet"""
+    if not os.path.exists(os.path.join(snapshots.path(Config.FAISS_INDEX_PATH, version), "index.faiss")):
+        return False
+    if Config.LANGUAGE_SHARDING:
+        return shards.needs_sync(snapshots.path(Config.SHARD_INDEX_PATH, version))
+    return Config.INDEX_FORMAT == "mmap" and not _has_index(version)
+
+
+def _convert_current():
+    """
+    First start with sharding enabled or after switching formats: derives the shards or the
+    mmap files from the main index once, published as a new snapshot version
+    """
+    with snapshots.writer(logger) as snapshot:
+        if snapshot.base is None or not _needs_conversion(snapshot.base):
+            # Another writer converted it while this one waited for the lock
+            snapshot.discard()
+            return
+        # Nothing is modified in place, the conversion only adds the shards or the mmap files
+        for name in snapshots.index_names():
+            snapshot.inherit(name)
+        if Config.LANGUAGE_SHARDING:
+            shards.sync_shards(snapshot.path(Config.SHARD_INDEX_PATH), FAISS.load_local(
+                snapshot.path(Config.FAISS_INDEX_PATH), get_embeddings(), allow_dangerous_deserialization=True
+            ), logger)
+        elif Config.INDEX_FORMAT == "mmap":
+            mmap_store.convert(
+                snapshot.path(Config.FAISS_INDEX_PATH), snapshot.path(Config.MMAP_INDEX_PATH), logger=logger
+            )
+
+
+def _load(version: str):
+    if Config.LANGUAGE_SHARDING:
+        # Shards are loaded lazily, each the first time a query is routed to it
+        root = snapshots.path(Config.SHARD_INDEX_PATH, version)
+        return shards.ShardedVectorStore(root, shards.load_manifest(root), get_embeddings())
+
+    with tracing.span("retrieval.index_load", format=Config.INDEX_FORMAT):
+        if Config.INDEX_FORMAT == "mmap":
+            vectorstore = mmap_store.load_vectorstore(get_embeddings(), snapshots.path(Config.MMAP_INDEX_PATH, version))
+        else:
+            vectorstore = FAISS.load_local(
+                snapshots.path(Config.FAISS_INDEX_PATH, version), get_embeddings(), allow_dangerous_deserialization=True
+            )
+    index_factory.apply_search_params(vectorstore.index)
+    return vectorstore
+
+
+def get_index():
+    """
+    Returns the shared LoadedIndex, or None if nothing has been ingested yet. A new
+    snapshot version is loaded when one has been published (e.g. after an ingest or a
+    clear). While one thread loads it, other queries keep being served from the version
+    already in memory instead of waiting.
+    """
+    global _index
+    version = snapshots.current()
+    if version is not None and (_index is None or version != _index.version) and _needs_conversion(version):
+        _convert_current()
+    version = index_version()
+
+    with _lock:
+        if version is None:
+            _stats["index_misses"] += 1
+            _index = None
+            return None
+        if _index is not None and version == _index.version:
+            _stats["index_hits"] += 1
+            return _index
+        previous = _index
+
+    if previous is not None and not _load_lock.acquire(blocking=False):
+        with _lock:
+            _stats["index_stale_hits"] += 1
+        return previous
+    if previous is None:
+        _load_lock.acquire()
+    try:
+        with _lock:
+            if _index is not None and version == _index.version:
+                # Loaded by another thread while this one waited
+                _stats["index_hits"] += 1
+                return _index
+            if _index is not None:
+                _stats["index_reloads"] += 1
+                logger.info(f"Index snapshot {version} published, reloading")
+            else:
+                _stats["index_loads"] += 1
+                logger.info(f"Loading index snapshot {version}")
+
+        # Pinned while it loads, so garbage collection in this process keeps the files
+        snapshots.pin(version)
+        try:
+            index = LoadedIndex(version, _load(version))
+        finally:
+            snapshots.unpin(version)
+        with _lock:
+            _index = index
+            return index
+    finally:
+        _load_lock.release()
+
+
+def get_vectorstore():
+    """Returns the shared vectorstore, or None if nothing has been ingested yet (see get_index)"""
+    index = get_index()
+    return index.vectorstore if index is not None else None
+
+
+def current_index_version():
+    """Returns the version of the index currently held in memory, or None"""
+    with _lock:
+        return _index.version if _index is not None else None
+
+
+def invalidate():
+    """Drops the cached index so the next call to get_index reloads it"""
+    global _index
+    with _lock:
+        _index = None
+        logger.debug("Cached vectorstore invalidated")
+
+
+def get_stats() -> dict:
+    """Returns a snapshot of the cache hit/load counters"""
+    with _lock:
+        stats = dict(_stats)
+        stats["index_loaded"] = _index is not None
+        stats["index_version"] = _index.version if _index is not None else None
+        return stats
+
+
+def reset_stats():
+    with _lock:
+        for key in _stats:
+            _stats[key] = 0
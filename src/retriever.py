@@ -1,22 +1,187 @@
-import os
-from langchain_community.vectorstores import FAISS
-#from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_huggingface import HuggingFaceEmbeddings
+import numpy as np
+from langchain.schema import Document
+from . import resources
+from . import cache
+from . import index_factory
+from . import tracing
 from .config import Config
+from .lexical import reciprocal_rank_fusion
+from .shards import ShardedVectorStore
+from .embedding_backends import model_id
 
-# Code that loads the vectorstore index if it exists, otherwise return None
+# Code that returns the shared vectorstore index if it exists, otherwise return None
+# The embedding model and the index are loaded once per process and only reloaded
+# when the index on disk changes (see resources.py)
 def get_vectorstore():
-    embeddings = HuggingFaceEmbeddings(model_name=Config.EMBEDDING_MODEL)
-    index_file_path = os.path.join(Config.FAISS_INDEX_PATH, "index.faiss")
-    if os.path.exists(index_file_path):
-        return FAISS.load_local(Config.FAISS_INDEX_PATH, embeddings, allow_dangerous_deserialization=True)
-    return None
+    return resources.get_vectorstore()
+
+# Code that returns the shared index snapshot (vectorstore, lexical index and version together), or None
+# Queries hold on to it from search to cache key, so all of their hits come from the same version
+def get_index():
+    return resources.get_index()
+
+# Code to embed a query, exact repeats of the same query are served from the LRU cache
+def embed_query(query: str):
+    key = (model_id(), query)
+    embedding = cache.embedding_cache.get(key)
+    if embedding is None:
+        embeddings = resources.get_embeddings()
+        with tracing.span("retrieval.embed_query"):
+            embedding = embeddings.embed_query(query)
+        cache.embedding_cache.put(key, embedding)
+    return embedding
+
+# Code to embed many queries in a single model forward pass, cached queries are skipped
+def embed_queries(queries):
+    embeddings = [cache.embedding_cache.get((model_id(), query)) for query in queries]
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if missing:
+        model = resources.get_embeddings()
+        with tracing.span("retrieval.embed_query", batch_size=len(missing)):
+            vectors = model.embed_documents([queries[i] for i in missing])
+        for i, vector in zip(missing, vectors):
+            embeddings[i] = vector
+            cache.embedding_cache.put((model_id(), queries[i]), vector)
+    return embeddings
+
+# Code to get the docstore ids of the top k dense (FAISS) hits for many queries with one vectorized search
+def dense_search_ids_batch(vectorstore, query_embeddings, k: int):
+    _, positions = index_factory.search(vectorstore, np.array(query_embeddings, dtype=np.float32), k)
+    return [
+        [vectorstore.index_to_docstore_id[int(position)] for position in row if position != -1]
+        for row in positions
+    ]
+
+# Code to get the docstore ids of the top k dense (FAISS) hits
+def dense_search_ids(vectorstore, query_embedding, k: int):
+    return dense_search_ids_batch(vectorstore, [query_embedding], k)[0]
+
+# Code to get the docstore ids of the top k lexical (BM25) hits
+def lexical_search_ids(index, query: str, k: int):
+    return [chunk_id for chunk_id, _ in index.lexical_index().search(query, k)]
+
+# Code to check a document against metadata filters, e.g. {"source": ["a.pdf"], "language": ["fr"]}
+# A document matches when, for every filtered field, its metadata value is one of the allowed values
+def matches_filters(doc, filters) -> bool:
+    return all(doc.metadata.get(field) in values for field, values in filters.items())
+
+# Code to search many queries with the given retrieval mode, dense and lexical hits are fused with reciprocal rank fusion
+# All dense lookups of the batch share a single FAISS search call (one per shard with language sharding)
+# With metadata filters more candidates are fetched and filtered afterwards, FAISS itself searches the whole index
+def _search_batch(index, queries, query_embeddings, k: int, mode: str, filters=None):
+    vectorstore = index.vectorstore
+    candidates = k * Config.FILTER_FETCH_MULTIPLIER if filters else k
+    fetch_k = max(candidates, Config.HYBRID_FETCH_K)
+    sharded = isinstance(vectorstore, ShardedVectorStore)
+    routes = None
+    if sharded:
+        if filters and "language" in filters:
+            # A language filter selects the shards directly instead of routing on the query language
+            route = tuple(language for language in vectorstore.languages if language in filters["language"])
+            routes = [route for _ in queries]
+        else:
+            routes = [vectorstore.route(query) for query in queries]
+
+    def dense_search(n):
+        if sharded:
+            return vectorstore.dense_search_ids_batch(routes, query_embeddings, n)
+        return dense_search_ids_batch(vectorstore, query_embeddings, n)
+
+    def lexical_search(i, n):
+        if sharded:
+            # Lexical hits come from the global BM25 index, so they are restricted to the query's shards
+            return vectorstore.filter_ids(lexical_search_ids(index, queries[i], fetch_k), routes[i])[:n]
+        return lexical_search_ids(index, queries[i], n)
+
+    if mode == "dense":
+        rankings = dense_search(candidates)
+    elif mode == "lexical":
+        rankings = [lexical_search(i, candidates) for i in range(len(queries))]
+    elif mode == "hybrid":
+        dense_rankings = dense_search(fetch_k)
+        rankings = [
+            reciprocal_rank_fusion([dense_ids, lexical_search(i, fetch_k)], k=Config.RRF_K)[:candidates]
+            for i, dense_ids in enumerate(dense_rankings)
+        ]
+    else:
+        raise ValueError(f"Unsupported retrieval mode: {mode}")
+    # The docstore answers unknown ids with a "not found" string, those are dropped
+    results = [
+        [doc for doc in (vectorstore.docstore.search(chunk_id) for chunk_id in chunk_ids) if isinstance(doc, Document)]
+        for chunk_ids in rankings
+    ]
+    if filters:
+        results = [[doc for doc in docs if matches_filters(doc, filters)][:k] for docs in results]
+    return results
+
+def _search(index, query: str, query_embedding, k: int, mode: str, filters=None):
+    return _search_batch(index, [query], [query_embedding], k, mode, filters)[0]
+
+# Code to search an index snapshot with an already embedded query, results are cached per index version
+def search_by_vector(index, query: str, query_embedding, k: int = 4, mode: str = None, filters=None):
+    mode = mode or Config.RETRIEVAL_MODE
+    key = (index.version, mode, query, k, cache.filters_key(filters))
+    docs = cache.retrieval_cache.get(key)
+    if docs is None:
+        with tracing.span("retrieval.search", mode=mode, k=k) as span:
+            docs = _search(index, query, query_embedding, k, mode, filters)
+            span["chunks"] = len(docs)
+        tracing.increment("retrieved_chunks_total", len(docs), mode=mode)
+        cache.retrieval_cache.put(key, docs)
+    return list(docs)
+
+# Code to search many already embedded queries at once, returns one list of documents per query
+def search_batch(index, queries, query_embeddings, k: int = 4, mode: str = None, filters=None):
+    mode = mode or Config.RETRIEVAL_MODE
+    version = index.version
+    filters_key = cache.filters_key(filters)
+    results = [cache.retrieval_cache.get((version, mode, query, k, filters_key)) for query in queries]
+    missing = [i for i, docs in enumerate(results) if docs is None]
+    if missing:
+        with tracing.span("retrieval.search", mode=mode, k=k, batch_size=len(missing)) as span:
+            found = _search_batch(
+                index, [queries[i] for i in missing],
+                [query_embeddings[i] for i in missing] if query_embeddings is not None else None,
+                k, mode, filters
+            )
+            span["chunks"] = sum(len(docs) for docs in found)
+        tracing.increment("retrieved_chunks_total", span["chunks"], mode=mode)
+        for i, docs in zip(missing, found):
+            results[i] = docs
+            cache.retrieval_cache.put((version, mode, queries[i], k, filters_key), docs)
+    return [list(docs) for docs in results]
 
 # Code to Retrieve top k documents similar to the query using the vectorstore
-def retrieve_documents(query: str, k: int = 4):
-    vectorstore = get_vectorstore()
-    if vectorstore:
-        docs = vectorstore.similarity_search(query, k=k)
-        return docs
+def retrieve_documents(query: str, k: int = 4, mode: str = None, filters=None):
+    mode = mode or Config.RETRIEVAL_MODE
+    index = get_index()
+    if index is not None:
+        query_embedding = None if mode == "lexical" else embed_query(query)
+        return search_by_vector(index, query, query_embedding, k=k, mode=mode, filters=filters)
     return []
 
+# Code to retrieve documents for many queries: every batch is embedded in one model call and searched with one FAISS call
+# Yields (query, documents) in input order one batch at a time, so callers can stream results out
+def iter_retrieve_batches(queries, k: int = 4, mode: str = None, filters=None, batch_size: int = None):
+    mode = mode or Config.RETRIEVAL_MODE
+    batch_size = batch_size or Config.RETRIEVAL_BATCH_SIZE
+    index = get_index()
+    batch = []
+    for query in queries:
+        batch.append(query)
+        if len(batch) < batch_size:
+            continue
+        yield from zip(batch, _retrieve_batch(index, batch, k, mode, filters))
+        batch = []
+    if batch:
+        yield from zip(batch, _retrieve_batch(index, batch, k, mode, filters))
+
+def _retrieve_batch(index, queries, k: int, mode: str, filters):
+    if index is None:
+        return [[] for _ in queries]
+    query_embeddings = None if mode == "lexical" else embed_queries(queries)
+    return search_batch(index, queries, query_embeddings, k=k, mode=mode, filters=filters)
+
+# Code to retrieve the top k documents for every query of a list, see iter_retrieve_batches
+def retrieve_documents_batch(queries, k: int = 4, mode: str = None, filters=None, batch_size: int = None):
+    return [docs for _, docs in iter_retrieve_batches(queries, k, mode, filters, batch_size)]
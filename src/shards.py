@@ -0,0 +1,275 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from .config import Config
+from . import index_factory
+from . import mmap_store
+from . import tracing
+from .language import detect_language, detect_languages
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+MANIFEST_FILE = "manifest.json"
+CHUNK_SHARDS_FILE = "chunk_shards.json"  # chunk id -> language of the shard it is stored in
+
+# Shard searches run in threads, FAISS releases the GIL while searching
+_executor = None
+_executor_lock = threading.Lock()
+
+
+# Every function takes the shard directory of an index snapshot version (see snapshots.py)
+def shard_path(root: str, language: str) -> str:
+    return os.path.join(root, language)
+
+
+def _manifest_path(root: str) -> str:
+    return os.path.join(root, MANIFEST_FILE)
+
+
+def _chunk_shards_path(root: str) -> str:
+    return os.path.join(root, CHUNK_SHARDS_FILE)
+
+
+def _write_json(path: str, data, **kwargs):
+    # Written next to the file and swapped in, the old file may be hard-linked into a previous snapshot
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, **kwargs)
+    os.replace(tmp_path, path)
+
+
+def load_manifest(root: str):
+    """Returns {"format": ..., "shards": {language: {"chunks", "fingerprint"}}}, or None if no shards exist"""
+    try:
+        with open(_manifest_path(root), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def needs_sync(root: str) -> bool:
+    """True when the shards are missing, were written in another index format or have no chunk id map yet"""
+    manifest = load_manifest(root)
+    return manifest is None or manifest.get("format") != Config.INDEX_FORMAT or \
+        not os.path.exists(_chunk_shards_path(root))
+
+
+def _fingerprint(chunk_ids) -> str:
+    return hashlib.sha1("\n".join(chunk_ids).encode("utf-8")).hexdigest()
+
+
+def _group_by_language(vectorstore):
+    """
+    Groups the main index's (label, chunk_id) pairs by chunk language. Chunks ingested
+    before chunk-level tagging are tagged here, and the tag is kept in their metadata.
+    """
+    groups = {}
+    untagged = []
+    for label, chunk_id in sorted(vectorstore.index_to_docstore_id.items()):
+        doc = vectorstore.docstore.search(chunk_id)
+        language = doc.metadata.get("language")
+        if language:
+            groups.setdefault(language, []).append((label, chunk_id))
+        else:
+            untagged.append((label, chunk_id, doc))
+
+    if untagged:
+        languages = detect_languages([doc.page_content for _, _, doc in untagged])
+        for (label, chunk_id, doc), language in zip(untagged, languages):
+            doc.metadata["language"] = language
+            groups.setdefault(language, []).append((label, chunk_id))
+        for members in groups.values():
+            members.sort()
+    return groups
+
+
+def _write_shard(root: str, vectorstore, language: str, members, logger: logging.Logger):
+    """Builds one shard from its vectors of the main index and swaps it in"""
+    chunk_ids = [chunk_id for _, chunk_id in members]
+    docs = [vectorstore.docstore.search(chunk_id) for chunk_id in chunk_ids]
+    shard_vectors = index_factory.reconstruct_vectors(vectorstore.index, [label for label, _ in members])
+    # Each shard picks its own index type for its size (see index_factory.choose_index_type)
+    shard = index_factory.build_vectorstore(
+        [(doc.page_content, vector) for doc, vector in zip(docs, shard_vectors)],
+        None,
+        metadatas=[doc.metadata for doc in docs],
+        ids=chunk_ids,
+    )
+
+    path = shard_path(root, language)
+    build_path = path + ".build"
+    shutil.rmtree(build_path, ignore_errors=True)
+    shard.save_local(build_path)
+    if Config.INDEX_FORMAT == "mmap":
+        mmap_store.convert(build_path, path, logger=logger)
+        shutil.rmtree(build_path, ignore_errors=True)
+    else:
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(build_path, path)
+
+
+def sync_shards(root: str, vectorstore, logger: logging.Logger = logger):
+    """
+    Partitions the main index into one index per chunk language under `root`. Only shards
+    whose set of chunks changed since the last sync are rebuilt, and shards of languages
+    that no longer occur are removed. The manifest is written last.
+    """
+    manifest = load_manifest(root)
+    previous = manifest["shards"] if manifest and manifest.get("format") == Config.INDEX_FORMAT else {}
+    groups = _group_by_language(vectorstore)
+
+    shards = {}
+    rebuilt = []
+    with tracing.span("ingest.shard_sync") as span:
+        for language, members in sorted(groups.items()):
+            fingerprint = _fingerprint([chunk_id for _, chunk_id in members])
+            if previous.get(language, {}).get("fingerprint") == fingerprint and os.path.exists(shard_path(root, language)):
+                shards[language] = previous[language]
+                continue
+            _write_shard(root, vectorstore, language, members, logger)
+            shards[language] = {"chunks": len(members), "fingerprint": fingerprint}
+            rebuilt.append(language)
+
+        os.makedirs(root, exist_ok=True)
+        _write_json(_chunk_shards_path(root), {
+            chunk_id: language for language, members in groups.items() for _, chunk_id in members
+        })
+        _write_json(_manifest_path(root), {"format": Config.INDEX_FORMAT, "shards": shards}, indent=2)
+
+        for language in set(previous) - set(shards):
+            shutil.rmtree(shard_path(root, language), ignore_errors=True)
+        span["shards"] = len(shards)
+        span["rebuilt"] = len(rebuilt)
+
+    sizes = ", ".join(f"{language}={info['chunks']}" for language, info in shards.items())
+    logger.info(f"Language shards: {sizes} (rebuilt: {', '.join(rebuilt) or 'none'})")
+    return shards
+
+
+def _load_shard(root: str, language: str, index_format: str, embeddings):
+    if index_format == "mmap":
+        return mmap_store.load_vectorstore(embeddings, shard_path(root, language))
+    return FAISS.load_local(shard_path(root, language), embeddings, allow_dangerous_deserialization=True)
+
+
+def _map_parallel(function, items):
+    global _executor
+    if len(items) <= 1:
+        return [function(item) for item in items]
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=Config.SHARD_SEARCH_WORKERS, thread_name_prefix="shard-search")
+    # Each task runs in a copy of the caller's context, so its spans join the caller's trace
+    futures = [_executor.submit(contextvars.copy_context().run, function, item) for item in items]
+    return [future.result() for future in futures]
+
+
+class ShardedDocstore:
+    """Looks chunks up in the shard that stores them, unknown ids are a miss without loading any shard"""
+
+    def __init__(self, store):
+        self._store = store
+
+    def search(self, search: str):
+        language = self._store.language_of(search)
+        if language is None:
+            return f"ID {search} not found."
+        return self._store.shard(language).docstore.search(search)
+
+
+class ShardedVectorStore:
+    """
+    Read side of the language shards. Each shard is loaded on its own, the first time a
+    query needs it, so a deployment serving one language only ever loads that shard.
+    Queries are routed to the shard of their language, or fanned out to every shard in
+    parallel with the per-shard top-k merged by distance.
+    """
+
+    def __init__(self, root: str, manifest: dict, embeddings):
+        self.root = root
+        self.languages = sorted(manifest["shards"])
+        self.index_format = manifest["format"]
+        self._embeddings = embeddings
+        self._shards = {}
+        self._chunk_languages = None
+        self._lock = threading.Lock()
+        self.docstore = ShardedDocstore(self)
+
+    def language_of(self, chunk_id: str):
+        """Language of the shard a chunk is stored in, or None if no shard has it"""
+        if self._chunk_languages is None:
+            # Much smaller than the shards, read once on the first lookup
+            with open(_chunk_shards_path(self.root), "r") as f:
+                chunk_languages = json.load(f)
+            with self._lock:
+                if self._chunk_languages is None:
+                    self._chunk_languages = chunk_languages
+        return self._chunk_languages.get(chunk_id)
+
+    def shard(self, language: str):
+        store = self._shards.get(language)
+        if store is None:
+            with tracing.span("retrieval.shard_load", language=language, format=self.index_format):
+                store = _load_shard(self.root, language, self.index_format, self._embeddings)
+            index_factory.apply_search_params(store.index)
+            with self._lock:
+                store = self._shards.setdefault(language, store)
+        return store
+
+    def loaded_languages(self):
+        return [language for language in self.languages if language in self._shards]
+
+    def route(self, query: str):
+        """Languages of the shards a query is searched in"""
+        if Config.SHARD_ROUTING == "route":
+            language, probability = detect_language(query)
+            if language in self.languages and probability >= Config.SHARD_ROUTING_MIN_CONFIDENCE:
+                tracing.increment("shard_routed_queries_total", language=language)
+                return (language,)
+        tracing.increment("shard_fanout_queries_total")
+        return tuple(self.languages)
+
+    def dense_search_ids_batch(self, routes, query_embeddings, k: int):
+        """
+        Returns the top k chunk ids per query. Every shard is searched once for all the
+        queries routed to it, and different shards are searched in parallel.
+        """
+        rows_by_shard = {}
+        for row, route in enumerate(routes):
+            for language in route:
+                rows_by_shard.setdefault(language, []).append(row)
+        vectors = np.array(query_embeddings, dtype=np.float32)
+
+        def search(language):
+            store = self.shard(language)
+            rows = rows_by_shard[language]
+            with tracing.span("retrieval.shard_search", language=language, batch_size=len(rows)):
+                distances, positions = index_factory.search(store, vectors[rows], k)
+            return [
+                [(float(distance), store.index_to_docstore_id[int(position)])
+                 for distance, position in zip(row_distances, row_positions) if position != -1]
+                for row_distances, row_positions in zip(distances, positions)
+            ]
+
+        hits = [[] for _ in routes]
+        languages = list(rows_by_shard)
+        for language, shard_hits in zip(languages, _map_parallel(search, languages)):
+            for row, row_hits in zip(rows_by_shard[language], shard_hits):
+                hits[row].extend(row_hits)
+        # All shards use L2 distance on the same embeddings, so their scores can be merged directly
+        return [[chunk_id for _, chunk_id in sorted(row_hits)[:k]] for row_hits in hits]
+
+    def filter_ids(self, chunk_ids, route):
+        """Keeps the chunk ids (e.g. BM25 hits from the global lexical index) that are stored in the given shards"""
+        if len(route) == len(self.languages):
+            return list(chunk_ids)
+        route = set(route)
+        return [chunk_id for chunk_id in chunk_ids if self.language_of(chunk_id) in route]
@@ -0,0 +1,262 @@
+import os
+import time
+import shutil
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from .config import Config
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: writers are still serialized within a process, but not across processes
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+VERSIONS_DIR = "versions"
+CURRENT_FILE = "CURRENT"
+LOCK_FILE = "writer.lock"
+RETIRED_FILE = ".retired"
+
+_writer_lock = threading.Lock()
+_pins_lock = threading.Lock()
+_pins = Counter()  # version -> readers in this process that hold it
+
+
+def _root(*parts) -> str:
+    return os.path.join(Config.INDEX_ROOT, *parts)
+
+
+def version_path(version: str) -> str:
+    return _root(VERSIONS_DIR, version)
+
+
+def _read_current():
+    try:
+        with open(_root(CURRENT_FILE), "r") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def index_names():
+    """Names of everything a version holds"""
+    return (Config.FAISS_INDEX_PATH, Config.MMAP_INDEX_PATH, Config.SHARD_INDEX_PATH,
+            Config.BM25_INDEX_PATH, Config.DOCUMENTS_JSON_PATH, Config.CATALOG_PATH)
+
+
+def _legacy_items():
+    """Index files written directly under INDEX_ROOT, before there were versions"""
+    return [name for name in index_names() if os.path.exists(_root(name))]
+
+
+def current():
+    """Returns the version readers should use, or None if nothing has been written yet"""
+    version = _read_current()
+    if version is None and _legacy_items():
+        with _locked():
+            version = _read_current() or _migrate_legacy()
+    return version
+
+
+def path(name: str, version: str = None) -> str:
+    """Path of an index file or directory in a version, the current one by default"""
+    version = version or current()
+    if version is None:
+        # Nothing has been written yet, the path doesn't exist
+        return _root(name)
+    return os.path.join(version_path(version), name)
+
+
+def list_versions():
+    try:
+        return sorted(name for name in os.listdir(_root(VERSIONS_DIR)) if name.isdigit())
+    except FileNotFoundError:
+        return []
+
+
+def pin(version: str):
+    """Marks a version as in use by this process, so garbage collection keeps it"""
+    with _pins_lock:
+        _pins[version] += 1
+
+
+def unpin(version: str):
+    with _pins_lock:
+        _pins[version] -= 1
+        if _pins[version] <= 0:
+            del _pins[version]
+
+
+@contextmanager
+def _locked():
+    """Single-writer lock: a thread lock within the process and an exclusive file lock across processes"""
+    with _writer_lock:
+        os.makedirs(Config.INDEX_ROOT, exist_ok=True)
+        with open(_root(LOCK_FILE), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _fsync_tree(directory: str):
+    for dir_path, _, file_names in os.walk(directory):
+        for file_name in file_names:
+            fd = os.open(os.path.join(dir_path, file_name), os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+
+def _publish(version: str, previous: str = None):
+    """Atomically points CURRENT at a fully written version"""
+    _fsync_tree(version_path(version))
+    tmp_path = _root(CURRENT_FILE + ".tmp")
+    with open(tmp_path, "w") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, _root(CURRENT_FILE))
+    if previous is not None and os.path.isdir(version_path(previous)):
+        # The replacement time starts the garbage collection grace period
+        with open(os.path.join(version_path(previous), RETIRED_FILE), "w") as f:
+            f.write(str(time.time()))
+
+
+def _new_version() -> str:
+    existing = list_versions()
+    number = int(existing[-1]) + 1 if existing else 1
+    version = f"{number:08d}"
+    os.makedirs(version_path(version))
+    return version
+
+
+def _migrate_legacy(log: logging.Logger = logger):
+    """Moves an index written before versioning into the first version, called with the writer lock held"""
+    version = _new_version()
+    for name in _legacy_items():
+        os.replace(_root(name), os.path.join(version_path(version), name))
+    _publish(version)
+    log.info(f"Moved the existing index into snapshot version {version}")
+    return version
+
+
+class Snapshot:
+    """
+    A version being written. Everything is written under `path(...)`; `base` is the version
+    it replaces, which must only be read, since readers may still be using it.
+    """
+
+    def __init__(self, version: str, base: str = None):
+        self.version = version
+        self.base = base
+        self.discarded = False
+
+    def discard(self):
+        """Drops this version when the writer block exits, e.g. when there turned out to be nothing to write"""
+        self.discarded = True
+
+    def path(self, name: str) -> str:
+        return os.path.join(version_path(self.version), name)
+
+    def base_path(self, name: str):
+        """Path of a file or directory in the base version, or None if there is no base version"""
+        return os.path.join(version_path(self.base), name) if self.base else None
+
+    def inherit(self, name: str):
+        """
+        Hard-links a file or directory of the base version into this one, falling back to a copy.
+        Only for files that are replaced, never modified in place (e.g. the shards, which are
+        rebuilt next to their old directory and swapped in).
+        """
+        source = self.base_path(name)
+        if source is None or not os.path.exists(source):
+            return
+        destination = self.path(name)
+
+        def link(src, dst):
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copy2(src, dst)
+
+        if os.path.isdir(source):
+            shutil.copytree(source, destination, copy_function=link)
+        else:
+            link(source, destination)
+
+
+@contextmanager
+def writer(log: logging.Logger = logger, keep_versions: int = None):
+    """
+    Opens a new index version under the single-writer lock. The version becomes current
+    when the block exits normally, all at once; on an exception it is discarded. Readers
+    keep using the version they already have until they next call current(). Replaced
+    versions are then garbage collected, keeping `keep_versions` (see gc).
+    """
+    with _locked():
+        base = _read_current()
+        if base is None and _legacy_items():
+            base = _migrate_legacy(log)
+        snapshot = Snapshot(_new_version(), base)
+        try:
+            yield snapshot
+        except BaseException:
+            shutil.rmtree(version_path(snapshot.version), ignore_errors=True)
+            raise
+        if snapshot.discarded:
+            shutil.rmtree(version_path(snapshot.version), ignore_errors=True)
+            return
+        _publish(snapshot.version, base)
+        log.info(f"Index snapshot {snapshot.version} is now current")
+        gc(log, keep_versions=keep_versions)
+
+
+def gc(log: logging.Logger = logger, keep_versions: int = None, grace_seconds: float = None):
+    """
+    Deletes versions that are no longer current, except the newest `keep_versions` replaced
+    ones, versions pinned by a reader in this process, and versions replaced less than
+    `grace_seconds` ago (readers in other processes may still be loading them). Called by
+    writers with the writer lock held, so versions that were never published are left over
+    from crashed writers and are deleted too.
+    """
+    keep_versions = Config.SNAPSHOT_KEEP_VERSIONS if keep_versions is None else keep_versions
+    grace_seconds = Config.SNAPSHOT_GC_GRACE_SECONDS if grace_seconds is None else grace_seconds
+    current_version = _read_current()
+    with _pins_lock:
+        pinned = set(_pins)
+
+    retired = []
+    unpublished = []
+    for version in list_versions():
+        if version == current_version or version in pinned:
+            continue
+        marker = os.path.join(version_path(version), RETIRED_FILE)
+        if os.path.exists(marker):
+            retired.append((version, marker))
+        else:
+            unpublished.append((version, version_path(version)))
+    if keep_versions:
+        retired = retired[:-keep_versions]
+
+    removed = []
+    now = time.time()
+    for version, stamp_path in retired + unpublished:
+        try:
+            if now - os.path.getmtime(stamp_path) < grace_seconds:
+                continue
+        except FileNotFoundError:
+            continue
+        shutil.rmtree(version_path(version), ignore_errors=True)
+        removed.append(version)
+    if removed:
+        log.info(f"Removed old index snapshots: {', '.join(sorted(removed))}")
+    return removed
@@ -0,0 +1,37 @@
+import logging
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+
+class ApproximateEncoding:
+    """
+    Stand-in when a tiktoken encoding can't be loaded. Counts about 4 ASCII characters per
+    token and every other character as a token of its own (Devanagari, for one, takes a token
+    or more per character), so context budgets are overestimated rather than overrun.
+    """
+
+    name = "approximate"
+
+    def encode(self, text: str, **kwargs):
+        ascii_chars = sum(1 for char in text if char.isascii())
+        return range(-(-ascii_chars // 4) + len(text) - ascii_chars)
+
+
+# Building a tiktoken encoder is expensive, so each encoding is created once per process
+# tiktoken itself is imported on first use to keep startup fast
+@lru_cache(maxsize=None)
+def get_encoding(name: str = "cl100k_base"):
+    # tiktoken downloads encodings on first use (or reads them from TIKTOKEN_CACHE_DIR), so offline
+    # deployments get the approximate counter, cached like a real encoding so the download isn't retried
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(name)
+    except Exception as e:
+        logger.warning(f"Could not load the {name} token encoding, token counts are approximate: {e}")
+        return ApproximateEncoding()
+
+
+def count_tokens(text: str, encoding_name: str = "cl100k_base") -> int:
+    return len(get_encoding(encoding_name).encode(text, disallowed_special=()))
@@ -0,0 +1,210 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .config import Config
+
+# Structured trace events go to their own logger so they can be routed separately from app logs
+trace_logger = logging.getLogger("rag_chatbot.trace")
+trace_logger.addHandler(logging.NullHandler())
+
+# Histogram bucket upper bounds in seconds, from sub-millisecond lookups up to slow LLM calls
+BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_captured = contextvars.ContextVar("captured_spans", default=None)
+
+
+class MetricsRegistry:
+    """Thread-safe in-process store of per-stage latency histograms and counters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}  # stage -> [bucket counts..., count, sum]
+        self._counters = {}  # (name, labels) -> value
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = [0] * len(BUCKETS) + [0, 0.0]
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += 1
+            histogram[-1] += seconds
+
+    def increment(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "stages": {
+                    stage: {"count": histogram[-2], "sum_seconds": histogram[-1]}
+                    for stage, histogram in self._histograms.items()
+                },
+                "counters": {
+                    name + ("{" + ",".join(f"{k}={v}" for k, v in labels) + "}" if labels else ""): value
+                    for (name, labels), value in self._counters.items()
+                },
+            }
+
+    def render_prometheus(self) -> str:
+        """Renders all metrics in the Prometheus text exposition format"""
+        lines = [
+            "# HELP rag_stage_duration_seconds Time spent in each pipeline stage.",
+            "# TYPE rag_stage_duration_seconds histogram",
+        ]
+        with self._lock:
+            for stage, histogram in sorted(self._histograms.items()):
+                for bound, count in zip(BUCKETS, histogram):
+                    lines.append(f'rag_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'rag_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram[-2]}')
+                lines.append(f'rag_stage_duration_seconds_count{{stage="{stage}"}} {histogram[-2]}')
+                lines.append(f'rag_stage_duration_seconds_sum{{stage="{stage}"}} {histogram[-1]}')
+
+            for name in sorted({name for name, _ in self._counters}):
+                lines.append(f"# TYPE rag_{name} counter")
+                for (counter_name, labels), value in sorted(self._counters.items()):
+                    if counter_name != name:
+                        continue
+                    label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                    lines.append(f"rag_{name}{{{label_text}}} {value}" if label_text else f"rag_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+registry = MetricsRegistry()
+_last_export = 0.0
+_export_lock = threading.Lock()
+
+
+def _record(stage: str, seconds: float, attributes: dict):
+    # Inside capture() spans are only collected, the caller replays them in the parent process
+    captured = _captured.get()
+    if captured is not None:
+        captured.append((stage, seconds, attributes))
+        return
+
+    registry.observe(stage, seconds)
+    if Config.TRACE_JSON_LOGS and trace_logger.isEnabledFor(logging.INFO):
+        trace_logger.info(json.dumps({
+            "event": "span",
+            "trace_id": _current_trace.get(),
+            "stage": stage,
+            "duration_ms": round(seconds * 1000, 3),
+            **attributes,
+        }, ensure_ascii=False, default=str))
+
+    _maybe_export()
+
+
+@contextmanager
+def span(stage: str, **attributes):
+    """
+    Times a pipeline stage. Yields a dict that the caller can add attributes to (e.g. token
+    or chunk counts), which end up in the JSON trace log line. Spans opened inside another
+    span share its trace id.
+    """
+    token = None
+    if _current_trace.get() is None:
+        token = _current_trace.set(uuid.uuid4().hex[:16])
+    started = time.perf_counter()
+    try:
+        yield attributes
+    finally:
+        _record(stage, time.perf_counter() - started, attributes)
+        if token is not None:
+            _current_trace.reset(token)
+
+
+def increment(name: str, value: float = 1, **labels):
+    """Increments a counter, e.g. tokens or chunks processed"""
+    registry.increment(name, value, **labels)
+
+
+@contextmanager
+def capture():
+    """
+    Collects the spans recorded in this context instead of recording them, so worker
+    processes can send them back to the parent, which records them with replay().
+    """
+    spans = []
+    token = _captured.set(spans)
+    try:
+        yield spans
+    finally:
+        _captured.reset(token)
+
+
+def replay(spans):
+    """Records spans that were captured in another process"""
+    for stage, seconds, attributes in spans:
+        _record(stage, seconds, attributes)
+
+
+def _maybe_export():
+    # Writing the metrics file is throttled so spans stay cheap on the hot path
+    global _last_export
+    if not Config.METRICS_FILE_PATH:
+        return
+    now = time.monotonic()
+    if now - _last_export < Config.METRICS_EXPORT_INTERVAL_SECONDS:
+        return
+    with _export_lock:
+        if now - _last_export < Config.METRICS_EXPORT_INTERVAL_SECONDS:
+            return
+        _last_export = now
+        write_prometheus_file()
+
+
+def write_prometheus_file(path: str = None):
+    """Atomically writes the Prometheus text metrics, e.g. for the node_exporter textfile collector"""
+    path = path or Config.METRICS_FILE_PATH
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(registry.render_prometheus())
+    os.replace(tmp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+
+
+def start_metrics_server(port: int = None):
+    """Serves /metrics on the given port from a daemon thread, once per process"""
+    global _server
+    port = port or Config.METRICS_PORT
+    if _server is not None or not port:
+        return _server
+    _server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+    return _server
@@ -0,0 +1,79 @@
+import time
+import logging
+import threading
+from .config import Config
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+# This module only imports the standard library and the config, so the UI can start the
+# warm-up before anything heavy is loaded
+_lock = threading.Lock()
+_thread = None
+_status = {"state": "idle", "timings": {}, "error": None}
+
+
+def warm_up() -> dict:
+    """
+    Imports the retrieval and generation stack, loads the embedding model and the index, and
+    embeds one query so the first real request doesn't pay for any of it. Returns the seconds
+    spent in each step.
+    """
+    timings = {}
+
+    started = time.perf_counter()
+    from . import resources
+    from . import generator  # noqa: F401
+    from .tokenizer import get_encoding
+    timings["imports"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    embeddings = resources.get_embeddings()
+    timings["embedding_model"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    embeddings.embed_query("warm-up")
+    timings["first_embedding"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    resources.get_vectorstore()
+    timings["index"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    get_encoding()
+    timings["tokenizer"] = time.perf_counter() - started
+
+    timings["total"] = sum(timings.values())
+    return timings
+
+
+def _run(log: logging.Logger):
+    try:
+        timings = warm_up()
+    except Exception as e:
+        # Not fatal, everything is loaded again lazily on first use
+        with _lock:
+            _status.update(state="failed", error=str(e))
+        log.warning(f"Background warm-up failed: {e}", exc_info=True)
+        return
+    with _lock:
+        _status.update(state="done", timings=timings)
+    steps = ", ".join(f"{step}={seconds:.2f}s" for step, seconds in timings.items() if step != "total")
+    log.info(f"Background warm-up finished in {timings['total']:.2f}s ({steps})")
+
+
+def start(log: logging.Logger = logger):
+    """Starts the warm-up in a daemon thread, once per process, if Config.WARMUP_ON_STARTUP is set"""
+    global _thread
+    with _lock:
+        if _thread is not None or not Config.WARMUP_ON_STARTUP:
+            return _thread
+        _status["state"] = "running"
+        _thread = threading.Thread(target=_run, args=(log,), name="warmup", daemon=True)
+        _thread.start()
+        return _thread
+
+
+def status() -> dict:
+    with _lock:
+        return {"state": _status["state"], "timings": dict(_status["timings"]), "error": _status["error"]}
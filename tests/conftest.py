@@ -0,0 +1,22 @@
+import os
+import pytest
+from src.config import Config
+from src import resources
+from src import cache
+from src.benchmark import HashingEmbeddings
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test_data")
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    """Index, snapshots and embedding cache in a temporary directory, with the offline hashing embeddings"""
+    monkeypatch.setattr(Config, "INDEX_ROOT", str(tmp_path / "embeddings"))
+    monkeypatch.setattr(Config, "EMBEDDING_CACHE_PATH", str(tmp_path / "embeddings" / "embedding_cache"))
+    monkeypatch.setattr(Config, "INGEST_WORKERS", 1)
+    monkeypatch.setattr(resources, "_embeddings", HashingEmbeddings())
+    resources.invalidate()
+    cache.clear_all()
+    yield tmp_path
+    resources.invalidate()
+    cache.clear_all()
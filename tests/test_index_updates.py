@@ -0,0 +1,55 @@
+import os
+import logging
+import pytest
+from langchain.schema import Document
+from src.config import Config
+from src import index_factory
+from src import resources
+from src import cache
+from src.benchmark import QNA_SOURCES, load_qna
+from src.ingest import ingest_documents, delete_document, compact_index
+from src.retriever import retrieve_documents
+from .conftest import TEST_DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.path.join(TEST_DATA_DIR, "data")
+QUESTIONS = [
+    pair["question"]
+    for qna_file in QNA_SOURCES for pair in load_qna(os.path.join(TEST_DATA_DIR, "QnA_files", qna_file))
+]
+
+
+def _check_queries(index_type: str, step: str, absent: str = None) -> int:
+    """Every question returns documents, none from `absent`; returns the number of live chunks"""
+    cache.clear_all()
+    for question in QUESTIONS:
+        docs = retrieve_documents(question, k=4)
+        assert docs and all(isinstance(doc, Document) for doc in docs), \
+            f"{index_type}: query after {step} returned {docs!r}"
+        assert absent not in [doc.metadata.get("source") for doc in docs], \
+            f"{index_type}: {absent} still retrieved after {step}"
+    return len(resources.get_vectorstore().index_to_docstore_id)
+
+
+@pytest.mark.parametrize("index_type", index_factory.INDEX_TYPES)
+def test_delete_replace_compact(workspace, monkeypatch, index_type):
+    monkeypatch.setattr(Config, "INDEX_TYPE", index_type)
+    monkeypatch.setattr(Config, "LANGUAGE_SHARDING", False)
+    # Compaction is run explicitly, so deletes and replacements go through the in-place path
+    monkeypatch.setattr(Config, "COMPACTION_DELETED_RATIO", float("inf"))
+    file_names = sorted(os.listdir(DATA_DIR))
+    paths = [os.path.join(DATA_DIR, name) for name in file_names]
+    deleted, replaced = file_names[-1], file_names[0]
+
+    ingest_documents(paths, file_names, logger)
+    chunks = {"ingest": _check_queries(index_type, "ingest")}
+    delete_document(deleted, logger)
+    chunks["delete"] = _check_queries(index_type, "delete", absent=deleted)
+    ingest_documents([paths[0]], [replaced], logger)
+    chunks["replace"] = _check_queries(index_type, "replace", absent=deleted)
+    compact_index(logger)
+    chunks["compact"] = _check_queries(index_type, "compact", absent=deleted)
+
+    assert chunks["replace"] == chunks["delete"] == chunks["compact"] < chunks["ingest"], chunks
+    assert index_factory.index_type_of(resources.get_vectorstore().index) == index_type
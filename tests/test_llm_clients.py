@@ -0,0 +1,71 @@
+import time
+import pytest
+from src.config import Config
+from src import llm_clients
+from src import llm_stub
+
+
+@pytest.fixture
+def stub():
+    """A stub LLM server in a background thread, returns (base URL, settings)"""
+    server, settings = llm_stub.start()
+    yield f"http://127.0.0.1:{server.server_port}", settings
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def fresh_pool():
+    llm_clients.clear()
+    yield
+    llm_clients.clear()
+
+
+def test_local_timeout_is_retried_then_raised(stub, monkeypatch):
+    url, settings = stub
+    monkeypatch.setattr(Config, "OLLAMA_BASE_URL", url)
+    # Fractional timeouts are rounded up for Ollama, which only takes whole seconds
+    monkeypatch.setattr(Config, "LLM_TIMEOUT_SECONDS", 0.5)
+    monkeypatch.setattr(Config, "LLM_MAX_RETRIES", 1)
+    settings.delay_seconds = 5.0
+
+    started = time.perf_counter()
+    with pytest.raises(Exception):
+        llm_clients.get_client("Local").invoke("ping")
+    assert time.perf_counter() - started < settings.delay_seconds
+    assert settings.requests == 2
+
+
+def test_openai_retries_transient_errors(stub, monkeypatch):
+    pytest.importorskip("langchain_openai")
+    url, settings = stub
+    monkeypatch.setattr(Config, "OPENAI_BASE_URL", f"{url}/v1")
+    monkeypatch.setattr(Config, "LLM_MAX_RETRIES", 2)
+    settings.fail_first = 2
+
+    assert llm_clients.get_client("OpenAI", "stub-key").invoke("ping").content == llm_stub.ANSWER
+    assert settings.requests == 3
+
+
+def test_cloud_provider_falls_back_to_local(stub, monkeypatch):
+    pytest.importorskip("langchain_openai")
+    url, settings = stub
+    local_server, local_settings = llm_stub.start()
+    try:
+        monkeypatch.setattr(Config, "OPENAI_BASE_URL", f"{url}/v1")
+        monkeypatch.setattr(Config, "OLLAMA_BASE_URL", f"http://127.0.0.1:{local_server.server_port}")
+        monkeypatch.setattr(Config, "LLM_MAX_RETRIES", 0)
+        monkeypatch.setattr(Config, "LLM_FALLBACK_TO_LOCAL", True)
+        settings.failure_rate = 1.0
+
+        assert llm_clients.get_client("OpenAI", "stub-key").invoke("ping").content == llm_stub.ANSWER
+        assert local_settings.requests == 1
+
+        # Errors in the request itself are not handed to the fallback
+        settings.failure_status = 401
+        with pytest.raises(Exception):
+            llm_clients.get_client("OpenAI", "stub-key").invoke("ping")
+        assert local_settings.requests == 1
+    finally:
+        local_server.shutdown()
+        local_server.server_close()